@@ -1,113 +1,164 @@
 import os
+import atexit
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import queue
 import logging
-import json
-import pyodbc
+import logging.handlers
+import orjson
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, render_template, g
+from flask import Flask, request, jsonify, render_template, g, Response, stream_with_context, session
 from flask import send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.exceptions import BadRequest
 
 # New Imports for refactored classes and new services
 from config import Config
 from models import OrderBook, Order # Keeping for completeness
-from repositories import OrderRepository, FaqRepository
-from services import AIService, FormatterService
-from controllers import ChatController
+from repositories import OrderRepository, FaqRepository, get_db # get_db checks pooled connections out into g
+from services import AIService, FormatterService, deepseek_breaker
+from controllers import ChatController, find_order_id, fetch_order_cached
 from book_service import BookRecommendationService # Import book_service (assuming this is the correct filename now)
+from db_utils import ConnectionPool
 
 # --- Configure Logging ---
-# Get the absolute path of the directory where app.py is located
-base_dir = os.path.dirname(os.path.abspath(__file__))
-# Define the path for the new 'logs' directory
-log_dir = os.path.join(base_dir, 'logs')
-# Create the 'logs' directory if it doesn't exist
-os.makedirs(log_dir, exist_ok=True)
-# Define the full path to the log file
-log_file_path = os.path.join(log_dir, 'requests.log')
-
-logging.basicConfig(
-    filename=log_file_path, # Use the new, full path
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# Resolved once at import: logs/requests.log next to app.py, whatever the working directory
+LOG_PATH = Path(__file__).resolve().parent / 'logs' / 'requests.log'
+LOG_PATH.parent.mkdir(exist_ok=True)
+
+# All records are put on an in-memory queue by the request threads; a single
+# QueueListener thread owns the file handlers and does the actual disk writes.
+log_queue = queue.Queue(-1)
+
+root_file_handler = logging.FileHandler(LOG_PATH, delay=True)
+root_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+root_file_handler.addFilter(lambda record: record.name != 'request_activity')
+
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s')) # Final formatting happens in the listener's handlers
 
+# force=True replaces the default stderr handler installed by any logging.info() call made while importing the modules above
+logging.basicConfig(level=Config.LOG_LEVEL, handlers=[queue_handler], force=True)
+
+# Registered once here; request handlers log to it unconditionally
 request_logger = logging.getLogger('request_activity')
 request_logger.setLevel(logging.INFO)
 
+log_handlers = [root_file_handler]
 try:
-    request_handler = logging.FileHandler('log_file_path')
+    request_handler = logging.FileHandler(LOG_PATH, delay=True)
     request_formatter = logging.Formatter('%(filename)s:%(funcName)s: %(message)s')
     request_handler.setFormatter(request_formatter)
-    request_logger.addHandler(request_handler)
+    request_handler.addFilter(logging.Filter('request_activity'))
+    log_handlers.append(request_handler)
     logging.info("app.py:Logging Setup: Request activity logger configured successfully.")
 except Exception as e:
-    logging.error(f"app.py:Logging Setup: Failed to configure request activity logger: {e}")
+    logging.error("app.py:Logging Setup: Failed to configure request activity logger: %s", e)
+
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop) # Flush queued records on interpreter shutdown
 
 load_dotenv()
 
-# Database Connection Management for all services that need a cursor
-def get_db():
-    """Get database connection and cursor, managed by Flask's g"""
-    if 'db' not in g:
-        conn_str = Config.get_connection_string()
-        if not conn_str:
-            logging.error("Database Connection:get_db: Database connection string is not configured.")
-            g.db = None
-            g.cursor = None
-            return None, None
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, used by request.get_json() and jsonify()"""
 
-        try:
-            g.db = pyodbc.connect(conn_str)
-            g.cursor = g.db.cursor()
-            logging.info("Database Connection:get_db: Database connection established.")
-        except Exception as e:
-            logging.error(f"Database Connection:get_db: Database connection error: {e}", exc_info=True)
-            g.db = None
-            g.cursor = None
+    def loads(self, s, **kwargs):
+        return orjson.loads(s) # Accepts the raw request bytes directly
 
-    return g.db, g.cursor
+    def dumps(self, obj, **kwargs):
+        # Types orjson can't handle natively (Decimal, etc.) fall back to Flask's default serializer
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
 
 # Initialize Flask application
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
 
+# Process-wide connection pool, created once and shared by every request
+app.extensions['db_pool'] = ConnectionPool(
+    Config.get_connection_string,
+    max_size=Config.DB_POOL_SIZE,
+    recycle_seconds=Config.DB_POOL_RECYCLE,
+    max_overflow=Config.DB_POOL_MAX_OVERFLOW,
+    timeout=Config.DB_POOL_TIMEOUT,
+    ping_after_seconds=Config.DB_POOL_PING_AFTER
+)
+
+EMPTY_REQUEST_RESPONSE = "My apologies, it seems I received an empty scroll! I need a message to get started. What bookish quest can I help you with?"
+
+# Order lookups started while DeepSeek is still classifying the intent
+order_prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="order_prefetch")
+# Seconds the order route waits for a prefetch before looking the order up itself
+ORDER_PREFETCH_TIMEOUT = 10
+
+def prefetch_order(order_id, user_id):
+    """Warm ChatController's order cache on a worker thread, using a pooled connection of its own"""
+    with app.app_context():
+        get_db() # Repository lookups reuse the pooled connection placed in this context's g
+        fetch_order_cached(order_id, user_id)
+
+def stream_recommendations(latest_message, cursor):
+    """Relay book recommendation parts to the client as server-sent events as soon as each is ready"""
+    streamed_parts = []
+    try:
+        for part, text in BookRecommendationService.iter_recommendation_parts(latest_message, cursor):
+            streamed_parts.append(text)
+            yield f"event: {part}\ndata: {app.json.dumps(text)}\n\n"
+    except Exception as e:
+        logging.error("app.py:stream_recommendations: An error occurred while streaming book recommendations: %s", e, exc_info=True)
+        yield f"event: notice\ndata: {app.json.dumps('Yikes! Something unexpected happened behind the scenes. Please try again!')}\n\n"
+    request_logger.info("Request: Bot response (streamed): %s", streamed_parts)
+
+def stream_general_reply(latest_message, is_hindi, formatted_chat_history):
+    """Relay a general reply to the client as server-sent 'delta' events while DeepSeek is still writing it"""
+    streamed_parts = []
+    try:
+        for chunk in AIService.stream_general_response(latest_message, is_hindi, formatted_chat_history):
+            streamed_parts.append(chunk)
+            yield f"event: delta\ndata: {app.json.dumps(chunk)}\n\n"
+    except Exception as e:
+        logging.error("app.py:stream_general_reply: An error occurred while streaming the reply: %s", e, exc_info=True)
+        yield f"event: notice\ndata: {app.json.dumps('Yikes! Something unexpected happened behind the scenes. Please try again!')}\n\n"
+    request_logger.info("Request: Bot response (streamed): %s", "".join(streamed_parts))
+
 # Routes
 @app.route('/')
 def index():
     """Render chat interface"""
     logging.info("app.py:index: Index page loaded.")
-    if 'request_activity' in logging.Logger.manager.loggerDict:
-        request_logger.info("Request: Index page loaded.")
-    else:
-        logging.error("app.py:index: Request activity logger not available.")
+    request_logger.info("Request: Index page loaded.")
 
     return render_template('index.html')
 
 @app.route('/api/message', methods=['POST'])
 def chat():
     """Chat API endpoint - processes message based on detected intent"""
-    logging.info(f"app.py:chat: Received message request.")
-    logging.info("logging of request started")
-    logging.info(f"Raw Data: {request.get_data()}")
-    logging.info("logging of request ended")
+    # An empty body can never hold a message; reject it before any logging or JSON parsing
+    if not request.content_length and request.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+        return jsonify({'response': EMPTY_REQUEST_RESPONSE}), 400
+
+    logging.debug("app.py:chat: Received message request.")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("app.py:chat: Raw Data: %.512s", request.get_data(cache=True)) # Truncated; formatted only when emitted
 
     data = None
     try:
         data = request.get_json(silent=False)
     except BadRequest as e:
-        logging.warning(f"app.py:chat: JSON parsing failed with UTF-8, trying alternate encoding: {e}")
+        logging.warning("app.py:chat: JSON parsing failed with UTF-8, trying alternate encoding: %s", e)
         try:
             raw_data_str = request.data.decode('latin-1')
-            data = json.loads(raw_data_str)
+            data = orjson.loads(raw_data_str)
             logging.info("app.py:chat: Successfully parsed JSON with 'latin-1' decoding.")
         except Exception as decode_e:
-            logging.error(f"app.py:chat: Failed to decode and parse JSON with alternate encoding: {decode_e}")
+            logging.error("app.py:chat: Failed to decode and parse JSON with alternate encoding: %s", decode_e)
             return jsonify({'response': "Uh oh! It seems my digital dictionary got a bit scrambled trying to read your message. Could you try sending it again, perhaps in simpler terms?"}), 400
 
     if not data:
         logging.error("app.py:chat: No JSON data received or parsed successfully.")
-        return jsonify({'response': "My apologies, it seems I received an empty scroll! I need a message to get started. What bookish quest can I help you with?"}), 400
+        return jsonify({'response': EMPTY_REQUEST_RESPONSE}), 400
 
     latest_message = data.get('message', '')
     chat_history = data.get('chat_history', [])
@@ -116,28 +167,48 @@ def chat():
 
     if not latest_message or latest_message.strip() == "":
          response = "It seems silence fills the air! I didn't get your message. How can I help you navigate our bookshelves today?"
-         logging.info(f"app.py:chat: Empty message received. Response: {response}")
+         logging.debug("app.py:chat: Empty message received. Response: %s", response)
          return jsonify({'response': response})
 
-    formatted_chat_history = []
-    for msg in chat_history:
-        role = 'user' if msg.get('sender') == 'user' else 'assistant'
-        formatted_chat_history.append({'role': role, 'content': msg.get('message', '')})
+    # Only the most recent messages are ever sent to DeepSeek, so format just those
+    formatted_chat_history = [
+        {'role': 'user' if msg.get('sender') == 'user' else 'assistant', 'content': msg.get('message', '')}
+        for msg in chat_history[-AIService.CHAT_HISTORY_LIMIT:]
+    ]
+
+    # A message naming an order almost always has the 'order' intent, so start the DB lookup now
+    # and let it overlap with the DeepSeek classification below
+    order_prefetch = None
+    prefetch_order_id = find_order_id(latest_message) if user_id else None
+    if prefetch_order_id:
+        order_prefetch = order_prefetch_executor.submit(prefetch_order, prefetch_order_id, user_id)
 
-    user_intent = AIService.detect_user_intent(latest_message, formatted_chat_history)
-    logging.info(f"app.py:chat: AI-detected intent: {user_intent}")
-    if 'request_activity' in logging.Logger.manager.loggerDict:
-        request_logger.info(f"Request: User query: '{latest_message}', AI-detected intent: {user_intent}")
+    wants_stream = request.accept_mimetypes.best == 'text/event-stream'
+    if wants_stream:
+        # Stream clients only need the intent here (a few tokens); a general reply is then streamed by
+        # stream_general_reply, so its first words arrive without waiting for the whole completion
+        user_intent, general_reply = AIService.detect_user_intent(latest_message, formatted_chat_history), None
     else:
-        logging.error("app.py:chat: Request activity logger not available.")
+        # One DeepSeek call classifies the intent and, for general inquiries, also writes the reply
+        user_intent, general_reply = AIService.classify_and_respond(latest_message, formatted_chat_history)
+    logging.debug("app.py:chat: AI-detected intent: %s", user_intent)
+    request_logger.info("Request: User query: '%s', AI-detected intent: %s", latest_message, user_intent)
 
     bot_response = "Hmm, I didn’t quite catch that. Want to try asking in a different way?"
+    required_action = None # Set by controllers that need the client to act first (e.g. log in)
 
     try:
         if user_intent == 'recommend_books':
-            logging.info("app.py:chat: Routing to Book Recommendation Service.")
+            logging.debug("app.py:chat: Routing to Book Recommendation Service.")
             # Ensure the cursor is passed correctly
             _, cursor = get_db() # Get the cursor from Flask's g object
+            if cursor and wants_stream:
+                # Stream clients get the loading line and each book immediately, before the opening is ready
+                return Response(
+                    stream_with_context(stream_recommendations(latest_message, cursor)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+                )
             if cursor:
                 bot_response = BookRecommendationService.recommend_books(latest_message, cursor)
             else:
@@ -145,39 +216,67 @@ def chat():
                 logging.error("app.py:chat: Database cursor not available for book recommendation processing.")
             
         elif user_intent == 'order':
-             logging.info(f"app.py:chat: Routing to Chat Controller for order intent.")
+             logging.debug("app.py:chat: Routing to Chat Controller for order intent.")
+             if order_prefetch:
+                 try:
+                     order_prefetch.result(timeout=ORDER_PREFETCH_TIMEOUT) # The controller then finds the order in its cache
+                 except Exception as e:
+                     logging.warning("app.py:chat: Order prefetch did not complete, controller will fetch the order itself: %s", e)
              _, cursor = get_db()
              if cursor:
+                 # The remembered order is stored as [user_id, order_id] and only used for the same user,
+                 # so another login in this browser session never inherits it
+                 remembered_user_id, last_order_id = session.get('last_order') or (None, None)
+                 if remembered_user_id != user_id:
+                     last_order_id = None
                  # --- MODIFICATION: Pass the userId to the controller ---
-                 bot_response = ChatController.process_chat_message(latest_message, chat_history, user_id)
+                 reply = ChatController.process_chat_message(latest_message, chat_history, user_id, last_order_id)
+                 bot_response, required_action = reply.text, reply.action
+                 # Without FLASK_SECRET_KEY the session is a read-only NullSession, so only remember the order when it is signed
+                 if app.secret_key:
+                     if reply.order_id and reply.order_id != last_order_id:
+                         session['last_order'] = [user_id, reply.order_id] # Follow-up turns use it without scanning the history
+                     elif last_order_id and not reply.order_id:
+                         session.pop('last_order', None) # The lookup failed; later turns fall back to the chat history
              else:
                  bot_response = "Looks like our order scroll is temporarily misplaced. Can you check back in a little while?"
                  logging.error("app.py:chat: Database cursor not available for order processing.")
 
         elif user_intent == 'general_faq' or user_intent == 'unknown':
-             logging.info(f"app.py:chat: Routing to Chat Controller for general_faq/unknown intent.")
-             is_hindi = AIService.detect_language(latest_message)
-             bot_response = AIService.generate_general_response(latest_message, is_hindi, formatted_chat_history)
+             logging.debug("app.py:chat: Routing to Chat Controller for general_faq/unknown intent.")
+             if general_reply:
+                 bot_response = general_reply
+             else:
+                 is_hindi = AIService.detect_language(latest_message)
+                 if wants_stream:
+                     # Stream clients see the reply as it is generated instead of after the whole completion
+                     return Response(
+                         stream_with_context(stream_general_reply(latest_message, is_hindi, formatted_chat_history)),
+                         mimetype='text/event-stream',
+                         headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+                     )
+                 bot_response = AIService.generate_general_response(latest_message, is_hindi, formatted_chat_history)
 
     except Exception as e:
-        logging.error(f"app.py:chat: An error occurred while processing message with AI-detected intent {user_intent}: {e}", exc_info=True)
+        logging.error("app.py:chat: An error occurred while processing message with AI-detected intent %s: %s", user_intent, e, exc_info=True)
         bot_response = (f"Yikes! Something unexpected happened behind the scenes. We’ll fix it faster than you can say ‘bestseller’ — please try again!")
 
-    if 'request_activity' in logging.Logger.manager.loggerDict:
-        request_logger.info(f"Request: Bot response: {bot_response}")
-    else:
-        logging.error("app.py:chat: Request activity logger not available.")
+    request_logger.info("Request: Bot response: %s", bot_response)
 
-    # --- MODIFICATION: Handle the LOGIN_REQUIRED response from the controller ---
-    if isinstance(bot_response, str) and bot_response.startswith("LOGIN_REQUIRED:"):
+    # --- MODIFICATION: Handle the login action returned by the controller ---
+    if required_action:
         # If the controller says login is required, create the specific JSON response.
-        actual_message = bot_response.replace("LOGIN_REQUIRED: ", "")
-        return jsonify({"action_required": "login", "response": actual_message})
+        return jsonify({"action_required": required_action, "response": bot_response})
     else:
         # Otherwise, return the normal response.
         return jsonify({'response': bot_response or "Our book-finding magic fizzled out for a moment. Mind giving it another try?"})
 
 
+@app.route('/health')
+def health():
+    """Liveness check that also reports the DeepSeek circuit breaker state"""
+    return jsonify({'status': 'ok', 'deepseek': deepseek_breaker.status()})
+
 @app.route('/static/<path:path>')
 def serve_static(path):
     """Serve static files"""
@@ -185,16 +284,21 @@ def serve_static(path):
 
 @app.teardown_appcontext
 def close_connection(exception):
-    """Close database connection on request end"""
+    """Return the database connection to the pool on request end"""
+    cursor = g.pop('cursor', None)
     db = g.pop('db', None)
     if db is not None:
         try:
-            db.close()
-            logging.info("Database Connection:close_connection: Database connection closed.")
+            if cursor is not None:
+                cursor.close()
+            app.extensions['db_pool'].release(db)
+            logging.debug("Database Connection:close_connection: Database connection returned to pool.")
         except Exception as e:
-            logging.error(f"Database Connection:close_connection: Error closing database connection: {e}")
+            logging.error("Database Connection:close_connection: Error returning database connection to pool: %s", e)
+            app.extensions['db_pool'].release(db, discard=True)
 
 if __name__ == '__main__':
-    port = int(os.getenv("PORT", 5000))
+    # Development server only; production is served by Waitress from flask_service.py
+    port = int(os.getenv("PORT", 1234))
     debug = os.getenv("FLASK_ENV") == "development"
-    app.run(host='0.0.0.0', port=1234, debug=debug)
+    app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
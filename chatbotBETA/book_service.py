@@ -4,72 +4,191 @@ import logging
 import re
 import pyodbc
 from deepseek1 import get_sql_from_deepseek, filter_books_with_deepseek
-from sql_utils import clean_sql
-from db_utils import execute_sql_query # Assuming db_utils has execute_sql_query
+from sql_utils import clean_sql, parameterize_sql
+from db_utils import execute_sql_query, string_param_sizes # Assuming db_utils has execute_sql_query
 from services import AIService
 import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Shared worker threads for DeepSeek calls that can run alongside the SQL pipeline
+ai_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="book_ai")
+# Seconds to wait for the conversational opening once the books are ready
+OPENING_TIMEOUT = 8
+# filter_books_with_deepseek only looks at the first 20 rows and the fallback shows 15,
+# so rows past this are never used and are not fetched or converted
+MAX_RECOMMENDATION_ROWS = 20
+
+@lru_cache(maxsize=1024) # get_sql_from_deepseek's cache hands back the same SQL text for repeat queries
+def prepare_sql(sql_text_raw):
+    """
+    Returns (clean_query, query_params, input_sizes) for SQL generated by DeepSeek, cleaning and
+    parameterizing each distinct SQL text only once. The SQL itself is still executed on every request.
+    """
+    clean_query, query_params, national = parameterize_sql(clean_sql(sql_text_raw))
+    return clean_query, query_params, string_param_sizes(national)
+
+LINK_NOT_AVAILABLE = "Link not available"
+BOOK_TEMPLATE = "\n{index}. Title: {title}\n   Author: {author}\n   Price: {price}\n   Link: {link}"
+# Columns read by format_book, in unpacking order. Rows stay dicts because the generated SQL
+# has no fixed column order and may omit some of these.
+BOOK_COLUMNS = ('Product_Title', 'AuthorName1', 'Product_DiscountedPrice', 'Product_TitleURl', 'ISBN13')
+
+@lru_cache(maxsize=4096) # Catalogue prices repeat heavily, and SQL Server returns them as Decimal
+def format_price(price_value):
+    """Returns the display price for a raw price value, "N/A" for NULL, or None if it is not numeric."""
+    if price_value is None:
+        return "N/A"
+    try:
+        return f"₹{float(price_value):.2f}"
+    except (ValueError, TypeError):
+        return None
+
+def format_book(index, book):
+    """Render one recommended book as the numbered block shown to the user."""
+    title, author, price_value, title_url_raw, isbn_raw = map(book.get, BOOK_COLUMNS)
+    if title is None:
+        title = 'N/A'
+    if author is None:
+        author = 'N/A'
+
+    price = format_price(price_value)
+    if price is None:
+        logging.warning(f"BookRecommendationService:format_book: Could not convert price value '{price_value}' to float for book: {title}")
+        price = "N/A"
+
+    title_url = str(title_url_raw).strip() if title_url_raw else ''
+    isbn = str(isbn_raw).strip() if isbn_raw else ''
+    link = f"www.bookswagon.com/book/{title_url}/{isbn}" if title_url and isbn else LINK_NOT_AVAILABLE
+
+    return BOOK_TEMPLATE.format_map({
+        'index': index,
+        'title': title,
+        'author': author,
+        'price': price,
+        'link': link
+    })
 
 class BookRecommendationService:
     """Service to handle book recommendation logic"""
 
+    @staticmethod
+    def generate_conversational_opening(user_query):
+        """
+        Asks DeepSeek for a short, warm opening paragraph for the recommendation reply.
+        Depends only on the user query, so it can run while the books are being fetched.
+        """
+        conversational_prompt = f"""
+            You are Vidya, a friendly and warm bookstore assistant. A user asked: "{user_query}".
+            Your task is to write a short, warm, and conversational opening paragraph (1-2 sentences) that directly addresses the user's question or context. For example, if they asked if a book is good for a child, confirm that it is and briefly explain why.
+            Do NOT list any books. Just write the opening paragraph.IMPORTANT: Your entire response must be plain text. Do NOT use any Markdown formatting, such as asterisks for italics or bold, or surrounding quotes.
+            """
+        start_time = time.time() # Start timer
+        conversational_opening = AIService.query_deepseek([{"role": "user", "content": conversational_prompt}], temperature=0.7, max_tokens=150) # 1-2 sentences
+        end_time = time.time() # End timer
+        duration = end_time - start_time
+        # Add a new log message with the duration
+        logging.debug(f"    [AI Conversation] AI call took {duration:.4f}s")
+        return conversational_opening
+
     @staticmethod
     def recommend_books(user_query, db_cursor): # Keep db_cursor as parameter as per your last file
         """
         Generates book recommendations based on user query using a provided database cursor.
         """
+        loading_line = None
+        opening = None
+        books = []
+        for part, text in BookRecommendationService.iter_recommendation_parts(user_query, db_cursor):
+            if part == 'loading':
+                loading_line = text
+            elif part == 'book':
+                books.append(text)
+            elif part == 'opening':
+                opening = text
+            else: # 'notice' ends the recommendation early
+                return f"{loading_line}\n\n{text}" if loading_line is not None else text
+
+        # Combine all parts into the final response
+        final_response_parts = []
+        if loading_line:
+            final_response_parts.append(loading_line)
+
+        final_response_parts.append(opening)
+        if books:
+            final_response_parts.append("\n".join(books))
+
+        return "\n".join(final_response_parts)
+
+    @staticmethod
+    def iter_recommendation_parts(user_query, db_cursor):
+        """
+        Yields (part, text) pairs as soon as each is ready: 'loading' once the SQL is known, one 'book'
+        per recommended book, then the 'opening'. A 'notice' part replaces the rest when no books can be shown.
+        """
         if not db_cursor or not isinstance(db_cursor, pyodbc.Cursor):
             logging.error("BookRecommendationService:recommend_books: Invalid or missing database cursor provided at the start.")
-            return "Our recommendation engine is taking a coffee break. Please try again shortly!"
+            yield 'notice', "Our recommendation engine is taking a coffee break. Please try again shortly!"
+            return
 
         loading_line = "" # Initialize loading line
         final_books = []
+        opening_future = None # Started once there are books to introduce
 
         # --- PHASE 1: Get Book Data (Your original, reliable logic) ---
         try:
-            logging.info(f"BookRecommendationService:recommend_books: Getting SQL query from DeepSeek for: {user_query}")
-            # get_sql_from_deepseek now returns (sql_text, loading_line, token_used)
+            logging.debug(f"BookRecommendationService:recommend_books: Getting SQL query from DeepSeek for: {user_query}")
             try:
-                # UNPACK HERE ACCORDING TO DEEPSEEK1.PY'S RETURN SIGNATURE
+                # Repeat queries are served from deepseek1's SQL cache without another DeepSeek round-trip,
+                # and their SQL is cleaned only once
                 sql_text_raw, deepseek_loading_line, token_used = get_sql_from_deepseek(user_query)
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug(f"BookRecommendationService:recommend_books: Raw SQL from DeepSeek: {sql_text_raw}")
+                clean_query, query_params, input_sizes = prepare_sql(sql_text_raw)
                 loading_line = deepseek_loading_line if deepseek_loading_line else "" # Use the loading line directly
-        
-                logging.info(f"BookRecommendationService:recommend_books: Received SQL and loading line from DeepSeek.")
+
+                logging.debug("BookRecommendationService:recommend_books: Received cleaned SQL and loading line.")
             except Exception as deepseek_sql_error:
                 logging.error(f"BookRecommendationService:recommend_books: Error getting SQL from DeepSeek: {deepseek_sql_error}", exc_info=True)
-                return f"Hmm, I got a bit tangled trying to understand your request. Mind rephrasing it for me?"
-
-            logging.info(f"BookRecommendationService:recommend_books: Raw SQL from DeepSeek: {sql_text_raw}")
-            logging.info(f"BookRecommendationService:recommend_books: DeepSeek loading line: {loading_line}")
+                yield 'notice', "Hmm, I got a bit tangled trying to understand your request. Mind rephrasing it for me?"
+                return
 
-            # Clean the SQL query (sql_text_raw already stripped of loading_line by deepseek1.py)
-            logging.info("BookRecommendationService:recommend_books: Cleaning SQL query...")
-            clean_query = clean_sql(sql_text_raw) # Pass the raw SQL text
-            logging.info(f"BookRecommendationService:recommend_books: Cleaned SQL query: {clean_query}")
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"BookRecommendationService:recommend_books: DeepSeek loading line: {loading_line}")
+                logging.debug(f"BookRecommendationService:recommend_books: Cleaned SQL query: {clean_query} params: {query_params}")
+            yield 'loading', loading_line
 
             # Execute the SQL query using the provided cursor
-            logging.info("BookRecommendationService:recommend_books: Executing SQL query...")
+            logging.debug("BookRecommendationService:recommend_books: Executing SQL query...")
             try:
                 # Ensure db_cursor is still valid immediately before execution
                 if not db_cursor or not isinstance(db_cursor, pyodbc.Cursor):
                         logging.error("BookRecommendationService:recommend_books: Database cursor became invalid before execution.")
-                        return "Oops! I lost my connection to the book vault. Let’s give it another go in a moment!"
+                        yield 'notice', "Oops! I lost my connection to the book vault. Let’s give it another go in a moment!"
+                        return
 
-                db_results = execute_sql_query(clean_query, db_cursor)
-                logging.info(f"BookRecommendationService:recommend_books: Retrieved {len(db_results)} books from database.")
+                db_results = execute_sql_query(clean_query, db_cursor, query_params, max_rows=MAX_RECOMMENDATION_ROWS, input_sizes=input_sizes)
+                logging.debug(f"BookRecommendationService:recommend_books: Retrieved {len(db_results)} books from database.")
             except Exception as db_error:
                 logging.error(f"BookRecommendationService:recommend_books: Error executing SQL query: {db_error}", exc_info=True)
-                return f"{loading_line}\n\nStill fetching your books... but I ran into a snag searching the shelf. Try again soon?"
+                yield 'notice', "Still fetching your books... but I ran into a snag searching the shelf. Try again soon?"
+                return
 
 
             if not db_results:
-                return f"{loading_line}\n\nWe looked high and low but couldn’t find any matching books. Try tweaking your request?"
+                yield 'notice', "We looked high and low but couldn’t find any matching books. Try tweaking your request?"
+                return
+
+            # Start the conversational opening now that there are books, so it runs alongside the DeepSeek filtering.
+            # Earlier, every failed lookup above would have paid for an opening nobody reads.
+            opening_future = ai_executor.submit(BookRecommendationService.generate_conversational_opening, user_query)
 
             # Filter results using DeepSeek
-            logging.info("BookRecommendationService:recommend_books: Filtering results with DeepSeek...")
+            logging.debug("BookRecommendationService:recommend_books: Filtering results with DeepSeek...")
             try:
                 selected_indices = filter_books_with_deepseek(user_query, db_results)
                 final_books = [db_results[i] for i in selected_indices if i < len(db_results)] # Add bounds check
-                logging.info(f"BookRecommendationService:recommend_books: Final recommended books after filtering: {len(final_books)}")
+                logging.debug(f"BookRecommendationService:recommend_books: Final recommended books after filtering: {len(final_books)}")
             except Exception as filter_error:
                 logging.error(f"BookRecommendationService:recommend_books: Error filtering books with DeepSeek: {filter_error}", exc_info=True)
                 # Fallback: If filtering fails, use all initially retrieved books (up to 50)
@@ -79,66 +198,32 @@ class BookRecommendationService:
             if not final_books:
                 # This case only happens if db_results was not empty, but filtering (or fallback) resulted in no books.
                 # This is unlikely with the fallback, but good to keep.
-                return f"{loading_line}\n\nI fetched some titles, but none seemed quite right. Try a slightly different request?"
+                opening_future.cancel() # Only stops it if it hasn't started yet
+                yield 'notice', "I fetched some titles, but none seemed quite right. Try a slightly different request?"
+                return
 
         except Exception as e:
             logging.error(f"BookRecommendationService:recommend_books: An unexpected error occurred during book recommendation process: {e}", exc_info=True)
-            return f"Something went off-script while hunting down books for you. Let’s try that again soon!"
+            if opening_future is not None:
+                opening_future.cancel()
+            yield 'notice', "Something went off-script while hunting down books for you. Let’s try that again soon!"
+            return
+
+        # --- PHASE 2: Send the books, then the conversational opening once it arrives ---
+        # Manually format the book list using your original, reliable logic
+        for i, book in enumerate(final_books, 1):
+            yield 'book', format_book(i, book)
 
-        # --- PHASE 2: Generate Conversational Response (Reverted to reliable two-step process) ---
         try:
-            # Step 2a: Generate the conversational opening with a dedicated AI call
-            conversational_prompt = f"""
-            You are Vidya, a friendly and warm bookstore assistant. A user asked: "{user_query}".
-            Your task is to write a short, warm, and conversational opening paragraph (1-2 sentences) that directly addresses the user's question or context. For example, if they asked if a book is good for a child, confirm that it is and briefly explain why.
-            Do NOT list any books. Just write the opening paragraph.IMPORTANT: Your entire response must be plain text. Do NOT use any Markdown formatting, such as asterisks for italics or bold, or surrounding quotes.
-            """
-            start_time = time.time() # Start timer
-            conversational_opening = AIService.query_deepseek([{"role": "user", "content": conversational_prompt}], temperature=0.7)
-            end_time = time.time() # End timer
-            duration = end_time - start_time
-            # Add a new log message with the duration
-            logging.info(f"    [AI Conversation] AI call took {duration:.4f}s") 
+            # Collect the conversational opening that was started alongside Phase 1
+            conversational_opening = opening_future.result(timeout=OPENING_TIMEOUT)
 
+        except FutureTimeoutError:
+            logging.warning(f"BookRecommendationService:recommend_books: Conversational opening not ready after {OPENING_TIMEOUT}s, using default opening.")
+            conversational_opening = "Here are some books I found for you:"
         except Exception as e:
             logging.error(f"BookRecommendationService:recommend_books: Error generating conversational opening: {e}")
             # If the conversational AI call fails, we create a safe, default opening.
             conversational_opening = "Here are some books I found for you:"
 
-        # Step 2b: Manually format the book list using your original, reliable logic
-        formatted_books = []
-        for i, book in enumerate(final_books, 1):
-            title = book.get('Product_Title', 'N/A')
-            author = book.get('AuthorName1', 'N/A')
-
-            price_value = book.get('Product_DiscountedPrice')
-            price = "N/A"
-            if price_value is not None:
-                try:
-                    price = f"₹{float(price_value):.2f}"
-                except (ValueError, TypeError):
-                    logging.warning(f"BookRecommendationService:recommend_books: Could not convert price value '{price_value}' to float for book: {title}")
-                    price = "N/A"
-
-            title_url_raw = book.get('Product_TitleURl')
-            isbn_raw = book.get('ISBN13')
-            title_url = str(title_url_raw).strip() if title_url_raw else ''
-            isbn = str(isbn_raw).strip() if isbn_raw else ''
-
-            if title_url and isbn:
-                link = f"www.bookswagon.com/book/{title_url}/{isbn}"
-            else:
-                link = "Link not available"
-
-            formatted_books.append(f"\n{i}. Title: {title}\n   Author: {author}\n   Price: {price}\n   Link: {link}")
-
-        # Step 2c: Combine all parts into the final response
-        final_response_parts = []
-        if loading_line:
-            final_response_parts.append(loading_line)
-
-        final_response_parts.append(conversational_opening)
-        final_response_parts.extend(formatted_books)
-
-        return "\n".join(final_response_parts)
- 
\ No newline at end of file
+        yield 'opening', conversational_opening
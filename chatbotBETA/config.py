@@ -1,5 +1,6 @@
 import os
 import logging
+import functools
 from dotenv import load_dotenv # Required if this file needs to load env vars directly
 
 load_dotenv()  
@@ -10,17 +11,25 @@ class Config:
     DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
     DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 
+    # Logging Configuration: per-request chatter is logged at DEBUG, enabled with DEBUG=1 or LOG_LEVEL=DEBUG
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if os.getenv("DEBUG") == "1" else "INFO").upper()
+
     # Database Configuration
     DB_DRIVER = os.getenv("DB_DRIVER")
     DB_SERVER = os.getenv("DB_SERVER")
     DB_DATABASE = os.getenv("DB_DATABASE")
     DB_UID = os.getenv("DB_UID")
     DB_PWD = os.getenv("DB_PWD")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8)) # Max idle connections kept open per process
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800)) # Seconds before a pooled connection is reopened
+    DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", 8)) # Extra connections allowed under load, closed on release
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30)) # Seconds to wait for a connection once the pool is exhausted
+    DB_POOL_PING_AFTER = int(os.getenv("DB_POOL_PING_AFTER", 60)) # Idle seconds after which a pooled connection is pinged before reuse
 
     @classmethod
+    @functools.cache # Settings are read once at class load, so the string never changes at runtime
     def get_connection_string(cls):
         """Construct the database connection string using environment variables."""
-        print(f"DEBUG: Inside get_connection_string. cls.DB_SERVER: '{cls.DB_SERVER}'")
         try:
             # Access the attributes directly from the class
             server_val = cls.DB_SERVER
@@ -2,9 +2,69 @@
 
 import logging
 import re
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 # Need to import services and repositories
 from services import AIService, FormatterService
 from repositories import OrderRepository # Order is also needed but already imported in repository through model
+from models import BotReply
+
+# Resolved once; app.py attaches the request activity handler to this same logger
+request_logger = logging.getLogger('request_activity')
+
+# The client resends the whole chat history every turn, so the same message strings are scanned
+# again and again; memoize the per-message work by message text.
+extract_order_id_cached = lru_cache(maxsize=4096)(AIService.extract_order_id)
+detect_language_cached = lru_cache(maxsize=4096)(AIService.detect_language)
+DIGIT_PATTERN = re.compile(r'\d')
+
+def find_order_id(text):
+    """Order IDs always contain digits, so digit-free messages skip extraction and stay out of the cache."""
+    if not text or not DIGIT_PATTERN.search(text):
+        return None
+    return extract_order_id_cached(text)
+
+# Detail and exit keywords compiled once into a single case-insensitive pattern with one named group
+# per category, so one pass over the message finds both. Like the old `keyword in message.lower()`
+# scans they match anywhere in the message, not only whole words.
+DETAIL_KEYWORDS = ["details", "more information", "tell me more", "give me details", "what are the details", "full info"]
+KEYWORD_PATTERN = re.compile(
+    '(?P<detail>' + '|'.join(map(re.escape, DETAIL_KEYWORDS)) + ')|(?P<exit>' + '|'.join(map(re.escape, AIService.EXIT_COMMANDS)) + ')',
+    re.IGNORECASE
+)
+
+def keyword_categories(text):
+    """Returns the set of keyword categories ('detail', 'exit') found in text."""
+    return {match.lastgroup for match in KEYWORD_PATTERN.finditer(text)}
+
+# --- CACHE for fetched orders ---
+# Follow-up turns usually ask about the same order; keep it briefly so each turn skips the DB query.
+# Short TTL so status changes still show up quickly. Only found orders are cached.
+ORDER_CACHE_TTL = 60
+MAX_ORDER_CACHE_SIZE = 10000
+order_cache = OrderedDict() # (user_id, order_id) -> (fetched_at, order), least recently used first
+order_cache_lock = threading.Lock()
+
+def fetch_order_cached(order_id, user_id):
+    """OrderRepository.fetch_order_by_id behind a small per-user LRU/TTL cache."""
+    key = (user_id, order_id)
+    now = time.monotonic()
+    with order_cache_lock:
+        entry = order_cache.get(key)
+        if entry and now - entry[0] < ORDER_CACHE_TTL:
+            order_cache.move_to_end(key)
+            return entry[1]
+
+    order = OrderRepository.fetch_order_by_id(order_id, user_id)
+    if order:
+        with order_cache_lock:
+            order_cache[key] = (now, order)
+            order_cache.move_to_end(key)
+            if len(order_cache) > MAX_ORDER_CACHE_SIZE:
+                order_cache.popitem(last=False)
+    return order
 
 class ChatController:
     """
@@ -14,7 +74,7 @@ class ChatController:
 
     # MODIFICATION: Added user_id parameter to handle authentication.
     @staticmethod
-    def process_chat_message(latest_message, chat_history, user_id):
+    def process_chat_message(latest_message, chat_history, user_id, last_order_id=None):
         """
         Handle user chat message for Order and General FAQ intents.
         Uses AI and provided context (order details, FAQs, chat history).
@@ -23,76 +83,72 @@ class ChatController:
             latest_message (str): The user's current query.
             chat_history (list): List of previous messages in the conversation.
             user_id (int): The ID of the logged-in user. 0 or None if not logged in.
+            last_order_id (str): Order ID remembered from an earlier turn of this session, if any.
 
         Returns:
-            str: The bot's response. Can be prefixed with 'LOGIN_REQUIRED:'
+            BotReply: The bot's response text, with action 'login' when the user must log in first,
+                      and order_id set when the reply was about a found order.
         """
 
         # --- NEW AUTHENTICATION CHECK ---
         # If the user is not logged in, return a special response.
         # The calling code (app.py) should handle this to create the final JSON response.
         if not user_id or user_id == 0:
-            return "LOGIN_REQUIRED: Please log in to view your order details."
+            return BotReply("Please log in to view your order details.", action='login')
         # --- END OF NEW AUTHENTICATION CHECK ---
 
-        # Get logger instance within the function
-        request_logger_available = 'request_activity' in logging.Logger.manager.loggerDict
-        request_logger_instance = logging.getLogger('request_activity') if request_logger_available else None
-
         log_context_prefix = "chat history on" if chat_history and len(chat_history) > 0 else "general query"
 
         # Basic check, though app.py should handle empty messages
         if not latest_message or latest_message.strip() == "":
-            if request_logger_instance:
-                request_logger_instance.info(f"ChatController:process_chat_message: Received empty user input.")
-            return "Oops! It seems your message vanished like a plot twist before it reached me. How can I help you with your Bookswagon order or a general question today?"
+            request_logger.info("ChatController:process_chat_message: Received empty user input.")
+            return BotReply("Oops! It seems your message vanished like a plot twist before it reached me. How can I help you with your Bookswagon order or a general question today?")
 
         # Note: Intent detection is now done in app.py before calling this controller.
         # This controller assumes the intent is either 'order' or 'general_faq'.
 
-        is_hindi = AIService.detect_language(latest_message)
+        is_hindi = detect_language_cached(latest_message)
 
-        # Format chat history for the AI API
-        formatted_chat_history = []
-        for msg in chat_history:
-            role = 'user' if msg.get('sender') == 'user' else 'assistant'
-            formatted_chat_history.append({'role': role, 'content': msg.get('message', '')})
+        # Format chat history for the AI API; the AI services never look further back than CHAT_HISTORY_LIMIT
+        formatted_chat_history = [
+            {'role': 'user' if msg.get('sender') == 'user' else 'assistant', 'content': msg.get('message', '')}
+            for msg in chat_history[-AIService.CHAT_HISTORY_LIMIT:]
+        ]
 
 
         # --- Order ID Extraction Logic (kept for order intent) ---
-        # Check current message first
-        extracted_id = AIService.extract_order_id(latest_message)
+        # Check current message first, then the order remembered for this session
+        extracted_id = find_order_id(latest_message) or last_order_id
 
-        # If not found in current message, check chat history
+        # If neither has one, check chat history: user messages newest-first, joined with a record
+        # separator so one regex pass finds the most recent ID without matching across messages
         if not extracted_id:
-            for msg_entry in reversed(chat_history): # Iterate through history in reverse
-                if msg_entry.get('sender') == 'user': # Only consider user messages
-                    history_order_id = AIService.extract_order_id(msg_entry.get('message', ''))
-                    if history_order_id:
-                        extracted_id = history_order_id
-                        logging.info(f"ChatController:process_chat_message: Found order ID in chat history: {extracted_id}")
-                        if request_logger_instance:
-                            request_logger_instance.info(f"Request: {log_context_prefix}: Found order ID in chat history: {extracted_id}")
-                        break # Found the most recent, break out
+            user_messages = '\x1e'.join(
+                msg_entry.get('message', '') for msg_entry in reversed(chat_history) if msg_entry.get('sender') == 'user'
+            )
+            history_match = AIService.ORDER_ID_PATTERN.search(user_messages)
+            if history_match:
+                extracted_id = history_match.group(0).upper()
+                logging.info("ChatController:process_chat_message: Found order ID in chat history: %s", extracted_id)
+                request_logger.info("Request: %s: Found order ID in chat history: %s", log_context_prefix, extracted_id)
 
         order_context = None
 
         if extracted_id:
             # MODIFICATION: Pass the user_id to the fetch method for a secure check.
-            order = OrderRepository.fetch_order_by_id(extracted_id, user_id)
+            order = fetch_order_cached(extracted_id, user_id)
             if order:
                 order_context = order
-                logging.info(f"ChatController:process_chat_message: Found and using order context for: {extracted_id} for user {user_id}")
-                if request_logger_instance:
-                    request_logger_instance.info(f"Request: {log_context_prefix}: Found and using order context for: {extracted_id} for user {user_id}")
+                logging.info("ChatController:process_chat_message: Found and using order context for: %s for user %s", extracted_id, user_id)
+                request_logger.info("Request: %s: Found and using order context for: %s for user %s", log_context_prefix, extracted_id, user_id)
             else:
                 # MODIFICATION: Updated response to be more generic and secure.
-                logging.info(f"ChatController:process_chat_message: Invalid order ID or access denied for order {extracted_id} and user {user_id}")
-                if request_logger_instance:
-                    request_logger_instance.info(f"Request: {log_context_prefix}: Invalid order ID or access denied for order {extracted_id} and user {user_id}")
-                response = AIService.get_response_in_language(
-                    f"I couldn't find any order with ID {extracted_id} associated with your account. Please check the order number and try again.", is_hindi)
-                return response # Return early if order not found
+                logging.info("ChatController:process_chat_message: Invalid order ID or access denied for order %s and user %s", extracted_id, user_id)
+                request_logger.info("Request: %s: Invalid order ID or access denied for order %s and user %s", log_context_prefix, extracted_id, user_id)
+                response = f"I couldn't find any order with ID {extracted_id} associated with your account. Please check the order number and try again."
+                if is_hindi: # The fixed English text has no markdown to clean, so only Hindi needs the language pass
+                    response = AIService.get_response_in_language(response, is_hindi)
+                return BotReply(response) # Return early if order not found
 
 
         response = "" # Initialize response
@@ -100,36 +156,32 @@ class ChatController:
         # --- Logic based on Order Context and User Query ---
 
         # Check for explicit request for full details
-        detail_keywords = ["details", "more information", "tell me more", "give me details", "what are the details", "full info"]
-        if order_context and any(keyword in latest_message.lower() for keyword in detail_keywords):
-             logging.info(f"ChatController:process_chat_message: User asked for detailed order info for found order.")
-             if request_logger_instance:
-                 request_logger_instance.info(f"Request: {log_context_prefix}: User asked for detailed order info for found order.")
+        matched_keywords = keyword_categories(latest_message)
+        if order_context and 'detail' in matched_keywords:
+             logging.info("ChatController:process_chat_message: User asked for detailed order info for found order.")
+             request_logger.info("Request: %s: User asked for detailed order info for found order.", log_context_prefix)
              response = FormatterService.format_order_response(order_context)
 
         # Check for specific book indices within an order
-        # Regex looks for numbers potentially separated by commas or spaces
-        elif order_context and order_context.books and len(order_context.books) > 0 and re.search(r'\b\d+(?:(?:,|\s)+\d+)*\b', latest_message):
+        # One regex pass finds the numbers (potentially separated by commas or spaces) and feeds the index parsing
+        elif order_context and order_context.books and (book_numbers := FormatterService.BOOK_NUMBER_PATTERN.findall(latest_message)):
             total_books = len(order_context.books)
-            indices = FormatterService.parse_book_indices(latest_message, total_books)
+            indices = FormatterService.book_indices_from_numbers(book_numbers, total_books)
             if indices:
-                logging.info(f"ChatController:process_chat_message: User asked about specific books: {indices} for found order.")
-                if request_logger_instance:
-                    request_logger_instance.info(f"Request: {log_context_prefix}: User asked about specific books: {indices} for found order.")
+                logging.info("ChatController:process_chat_message: User asked about specific books: %s for found order.", indices)
+                request_logger.info("Request: %s: User asked about specific books: %s for found order.", log_context_prefix, indices)
                 response = FormatterService.format_specific_books_response(order_context, indices)
             else:
-                 logging.info(f"ChatController:process_chat_message: User input contains numbers, but not valid book indices. Using AI for order context.")
-                 if request_logger_instance:
-                     request_logger_instance.info(f"Request: {log_context_prefix}: User input contains numbers, but not valid book indices. Using AI for order context.")
+                 logging.info("ChatController:process_chat_message: User input contains numbers, but not valid book indices. Using AI for order context.")
+                 request_logger.info("Request: %s: User input contains numbers, but not valid book indices. Using AI for order context.", log_context_prefix)
                  # Fallback to general AI summary if numbers don't match book indices
                  response = AIService.generate_order_summary(order_context, latest_message, is_hindi, formatted_chat_history)
 
 
         # Check for exit commands
-        elif any(cmd in latest_message.lower() for cmd in AIService.EXIT_COMMANDS):
-            logging.info(f"ChatController:process_chat_message: User initiated exit.")
-            if request_logger_instance:
-                request_logger_instance.info(f"Request: {log_context_prefix}: User initiated exit.")
+        elif 'exit' in matched_keywords:
+            logging.info("ChatController:process_chat_message: User initiated exit.")
+            request_logger.info("Request: %s: User initiated exit.", log_context_prefix)
             # Generate a polite closing response using AI
             ai_prompt = """
             The user has indicated they want to end the conversation (e.g., by saying 'exit', 'bye', or 'thank you').
@@ -142,28 +194,24 @@ class ChatController:
             ]
             raw_ai_response = AIService.query_deepseek(messages, temperature=0.7)
             response = AIService.get_response_in_language(raw_ai_response, is_hindi)
-            if request_logger_instance:
-                request_logger_instance.info(f"Request: {log_context_prefix}: Bot response (exit): {response}")
-            return response # Return the exit response immediately
+            request_logger.info("Request: %s: Bot response (exit): %s", log_context_prefix, response)
+            return BotReply(response, order_id=extracted_id if order_context else None) # Return the exit response immediately
 
 
         # If order context exists but no specific detail/book request, use AI for order summary
         elif order_context:
-             logging.info(f"ChatController:process_chat_message: Using AI for order summary/general query within found order context.")
-             if request_logger_instance:
-                 request_logger_instance.info(f"Request: {log_context_prefix}: Using AI for order summary/general query within found order context.")
+             logging.info("ChatController:process_chat_message: Using AI for order summary/general query within found order context.")
+             request_logger.info("Request: %s: Using AI for order summary/general query within found order context.", log_context_prefix)
              response = AIService.generate_order_summary(order_context, latest_message, is_hindi, formatted_chat_history)
 
         # If no order context, use AI for general response (which might ask for order number)
         else:
-             logging.info(f"ChatController:process_chat_message: Using AI for general response/asking for order number.")
-             if request_logger_instance:
-                 request_logger_instance.info(f"Request: {log_context_prefix}: Using AI for general response/asking for order number.")
+             logging.info("ChatController:process_chat_message: Using AI for general response/asking for order number.")
+             request_logger.info("Request: %s: Using AI for general response/asking for order number.", log_context_prefix)
              response = AIService.generate_general_response(latest_message, is_hindi, formatted_chat_history)
 
 
         # Log the final response before returning
-        if request_logger_instance:
-            request_logger_instance.info(f"ChatController:process_chat_message: Bot response: {response}")
+        request_logger.info("ChatController:process_chat_message: Bot response: %s", response)
 
-        return response
+        return BotReply(response, order_id=extracted_id if order_context else None)
@@ -1,33 +1,239 @@
 # db_utils.py
 
+import sys
 import pyodbc
 import logging
+import queue
+import threading
 import time
 
-def execute_sql_query(query, cursor):
+# Let ConnectionPool own connection reuse; the driver manager's pooling would hold
+# a second, invisible set of connections behind ours.
+pyodbc.pooling = False
+
+# ids of connections whose last query failed with a connection-level error (SQLSTATE class 08);
+# ConnectionPool.release closes these instead of handing them to the next request
+broken_connection_ids = set()
+
+def note_connection_error(cursor, error):
+    """Flag the cursor's connection as broken when a query failed because the link itself dropped"""
+    sqlstate = str(error.args[0]) if error.args else ''
+    if sqlstate.startswith('08'):
+        broken_connection_ids.add(id(cursor.connection))
+
+
+class ConnectionPool:
+    """
+    Bounded, process-wide pool of live pyodbc connections.
+
+    Connections are checked out per request and handed back on teardown, so the
+    TCP/TLS handshake and SQL Server login are paid once per connection rather than
+    once per request. At most `max_size` idle connections are retained, and at most
+    `max_size + max_overflow` are checked out at once; further callers wait up to
+    `timeout` seconds for one to be released. Overflow connections are closed when
+    released. Connections idle longer than `ping_after_seconds` are pinged before reuse,
+    so one that died while idle (server restart, dropped network) is replaced instead of
+    handed out; recently used ones skip the round trip, and a query that fails with a
+    connection-level error gets its connection closed on release instead.
+    """
+
+    def __init__(self, connection_string_provider, max_size=8, recycle_seconds=1800, max_overflow=8, timeout=30,
+                 ping_after_seconds=60):
+        self._connection_string_provider = connection_string_provider
+        self._idle = queue.LifoQueue(maxsize=max_size) # (connection, released_at); LIFO keeps the warmest connections in use
+        self._recycle_seconds = recycle_seconds
+        self._ping_after_seconds = ping_after_seconds
+        self._created_at = {} # id(connection) -> creation timestamp
+        self._checked_out = set() # ids of connections holding a _slots permit
+        self._slots = threading.BoundedSemaphore(max_size + max_overflow)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Check out a connection, reusing an idle one when it is still fresh and, if idle for a while, alive."""
+        if not self._slots.acquire(timeout=self._timeout):
+            raise RuntimeError(f"No database connection became available within {self._timeout}s.")
+        try:
+            conn = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._checked_out.add(id(conn))
+        return conn
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            idle_for = time.monotonic() - released_at
+            if self._is_expired(conn) or (idle_for > self._ping_after_seconds and not self._is_alive(conn)):
+                self._discard(conn)
+                continue
+            return conn
+
+        conn_str = self._connection_string_provider()
+        if not conn_str:
+            raise RuntimeError("Database connection string is not configured.")
+        conn = pyodbc.connect(conn_str, autocommit=True)
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+        logging.info("db_utils:ConnectionPool.acquire: Opened new pooled database connection.")
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is broken, stale or surplus."""
+        if conn is None:
+            return
+        with self._lock:
+            was_checked_out = id(conn) in self._checked_out
+            self._checked_out.discard(id(conn))
+            broken = id(conn) in broken_connection_ids
+        try:
+            if discard or broken or getattr(conn, 'closed', False) or self._is_expired(conn):
+                self._discard(conn)
+                return
+            try:
+                self._idle.put_nowait((conn, time.monotonic()))
+            except queue.Full:
+                self._discard(conn)
+        finally:
+            if was_checked_out: # A repeated release must not free a second permit
+                self._slots.release()
+
+    def _is_alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1").fetchone()
+            finally:
+                cursor.close()
+            return True
+        except pyodbc.Error as e:
+            logging.warning("db_utils:ConnectionPool.acquire: Dropping dead idle database connection: %s", e)
+            return False
+
+    def _is_expired(self, conn):
+        with self._lock:
+            created_at = self._created_at.get(id(conn))
+        return created_at is None or time.monotonic() - created_at > self._recycle_seconds
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+            broken_connection_ids.discard(id(conn))
+        try:
+            conn.close()
+        except Exception as e:
+            logging.warning("db_utils:ConnectionPool._discard: Error closing database connection: %s", e)
+
+
+# Rows pulled from the driver per round-trip
+FETCH_BATCH_SIZE = 500
+
+# Declared types for bound string literals. pyodbc sends Python str as nvarchar, which turns comparisons on
+# varchar columns into implicit conversions; plain '...' literals are declared varchar, as they were when inlined,
+# and N'...' literals nvarchar. Fixed sizes keep the parameter declarations, and so the cached plan, identical.
+VARCHAR_PARAM = (pyodbc.SQL_VARCHAR, 8000, 0)
+NVARCHAR_PARAM = (pyodbc.SQL_WVARCHAR, 4000, 0)
+
+def string_param_sizes(national):
+    """Returns cursor.setinputsizes() entries for string params, given parameterize_sql's national flags."""
+    return tuple(NVARCHAR_PARAM if is_national else VARCHAR_PARAM for is_national in national)
+
+def stream_sql_query(query, cursor, params=(), max_rows=None, input_sizes=None):
+    """
+    Executes a query and yields each row as a dict, fetching from the driver in batches.
+    With max_rows, stops after that many rows without pulling the rest of the result set.
+    input_sizes, if given, declares the SQL types of params (see string_param_sizes).
+    """
+    batch_size = min(FETCH_BATCH_SIZE, max_rows) if max_rows else FETCH_BATCH_SIZE
+    cursor.arraysize = batch_size
+    if params and input_sizes:
+        cursor.setinputsizes(input_sizes)
+        try:
+            cursor.execute(query, params)
+        finally:
+            cursor.setinputsizes(None) # The cursor is shared with later queries in the same request
+    else:
+        cursor.execute(query, params) if params else cursor.execute(query)
+    # Interned so row['Product_Title']-style lookups in callers match keys by identity
+    columns = tuple(sys.intern(col[0]) for col in cursor.description)
+    remaining = max_rows
+    while remaining is None or remaining > 0:
+        batch = cursor.fetchmany(batch_size if remaining is None else min(batch_size, remaining))
+        if not batch:
+            break
+        if remaining is not None:
+            remaining -= len(batch)
+        for row in batch:
+            yield dict(zip(columns, row))
+
+def execute_sql_query(query, cursor, params=(), max_rows=None, input_sizes=None):
     try:
-        logging.info(f"db_utils:execute_sql_query: Executing query (truncated): {query[:200]}...")
+        logging.info("db_utils:execute_sql_query: Executing query (truncated): %.200s...", query)
  
         start_time = time.time() # Start timer
  
-        cursor.execute(query)
-        columns = [col[0] for col in cursor.description]
-        # Fetch all rows and zip with column names to create list of dicts
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        # Build the list of dicts batch by batch, never holding a full fetchall() copy alongside it
+        results = list(stream_sql_query(query, cursor, params, max_rows, input_sizes))
  
         end_time = time.time() # End timer
         duration = end_time - start_time
  
         # Add the new log message with the duration
-        logging.info(f"    [DB Query] Execution took {duration:.4f}s. Fetched {len(results)} rows.")
+        logging.info("    [DB Query] Execution took %.4fs. Fetched %s rows.", duration, len(results))
  
         return results
     except pyodbc.Error as e:
+        note_connection_error(cursor, e)
         # ... error handling ...
-        logging.error(f"db_utils:execute_sql_query: SQL execution failed: {str(e)}", exc_info=True)
+        logging.error("db_utils:execute_sql_query: SQL execution failed: %s", e, exc_info=True)
         # Re-raise the exception so the caller can handle it (e.g., return an error message)
         raise
     except Exception as e:
-        logging.error(f"db_utils:execute_sql_query: An unexpected error occurred during SQL execution: {e}", exc_info=True)
+        logging.error("db_utils:execute_sql_query: An unexpected error occurred during SQL execution: %s", e, exc_info=True)
         raise # Re-raise unexpected errors as well
 
+def execute_sql_query_rows(query, cursor, params=()):
+    """
+    Like execute_sql_query, but returns the pyodbc.Row objects as fetched. Rows support index and
+    attribute access (row.Order_Number) without building a dict per row, which suits callers
+    that read a fixed set of columns.
+    """
+    try:
+        start_time = time.time() # Start timer
+        cursor.execute(query, params) if params else cursor.execute(query)
+        results = cursor.fetchall()
+        logging.info("    [DB Query] Execution took %.4fs. Fetched %s rows.", time.time() - start_time, len(results))
+        return results
+    except pyodbc.Error as e:
+        note_connection_error(cursor, e)
+        logging.error("db_utils:execute_sql_query_rows: SQL execution failed: %s", e, exc_info=True)
+        raise
+
+def iter_fetchmany(cursor, batch_size):
+    """Yields the rows of an executed cursor, pulling them from the driver batch_size rows at a time."""
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield from batch
+
+def iter_sql_query_rows(query, cursor, params=(), batch_size=FETCH_BATCH_SIZE):
+    """
+    Executes a query and returns an iterator over its pyodbc.Row objects. Rows are fetched in batches
+    as the caller consumes them, so a single pass never holds the whole result set in a list.
+    """
+    try:
+        start_time = time.time() # Start timer
+        cursor.arraysize = batch_size
+        cursor.execute(query, params) if params else cursor.execute(query)
+        logging.info("    [DB Query] Execution took %.4fs.", time.time() - start_time)
+        return iter_fetchmany(cursor, batch_size)
+    except pyodbc.Error as e:
+        note_connection_error(cursor, e)
+        logging.error("db_utils:iter_sql_query_rows: SQL execution failed: %s", e, exc_info=True)
+        raise
@@ -1,67 +1,77 @@
 import requests
 import re
-import json
+import orjson
 import logging
+import logging.handlers
 from config import Config
+from repositories import repository_log_queue # Shared queue whose listener owns requests.log
+from services import deepseek_session # Shared keep-alive session, so both calls reuse the AIService connection pool
+from services import normalize_prompt_text # The one text normalizer for cache keys, shared with AIService
 import time
+import threading
+import hashlib
+from collections import OrderedDict
 # Assuming Config is correctly set up as per your project
 api_key = Config.DEEPSEEK_API_KEY
 model = Config.DEEPSEEK_MODEL
 api_url = Config.DEEPSEEK_API_URL
 
 # --- Configure DeepSeek specific logging ---
+# Records go through the repositories log queue, so requests.log has a single file handle, owned by that
+# module's QueueListener thread, and DeepSeek calls never block the request thread on a disk write.
 deepseek_logger = logging.getLogger('deepseek_activity')
 deepseek_logger.setLevel(logging.INFO)
-
-if not any(isinstance(handler, logging.FileHandler) and handler.baseFilename.endswith('requests.log') for handler in deepseek_logger.handlers):
-    try:
-        deepseek_handler = logging.FileHandler('requests.log')
-        deepseek_formatter = logging.Formatter('%(filename)s:%(funcName)s: %(message)s')
-        deepseek_handler.setFormatter(deepseek_formatter)
-        deepseek_logger.addHandler(deepseek_handler)
-        logging.info("deepseek1.py:Logging Setup: DeepSeek activity logger configured successfully.")
-    except Exception as e:
-        logging.error(f"deepseek1.py:Logging Setup: Failed to configure DeepSeek activity logger: {e}")
-else:
-    logging.info("deepseek1.py:Logging Setup: DeepSeek activity logger already configured.")
+if not any(isinstance(handler, logging.handlers.QueueHandler) for handler in deepseek_logger.handlers):
+    deepseek_logger.addHandler(logging.handlers.QueueHandler(repository_log_queue))
 
 
 # --- SQL Query Cache ---
-# Using a simple dictionary as an in-memory cache
-sql_cache = {}
+# In-memory LRU cache: once full, the least recently used query is evicted so new hot queries still get cached
+sql_cache = OrderedDict()
 # Define a maximum cache size to prevent excessive memory usage
 MAX_CACHE_SIZE = 1000 # You can adjust this value
 
 # --- Book Filter Cache  ---
-# Caches the results of the AI-powered book filtering
-filter_cache = {}
+# Caches the results of the AI-powered book filtering, with the same LRU eviction
+filter_cache = OrderedDict()
 # Using the same max size, but you can adjust if needed
 MAX_FILTER_CACHE_SIZE = 1000
 
-
-def get_sql_from_deepseek(user_query):
-    """
-    Generates a SQL query and a loading line based on user query using DeepSeek API.
-    Implements in-memory caching for SQL queries.
-
-    Args:
-        user_query (str): The user's request.
-
-    Returns:
-        tuple: (sql_text, loading_line, token_used)
-        sql_text (str): The generated SQL query.
-        loading_line (str): An optional loading message from the AI.
-        token_used (int): Number of tokens used (0 if from cache).
-    """
-    start_time = time.time()
-    # Check if the query is in cache
-    if user_query in sql_cache:
-        cached_sql, cached_loading_line = sql_cache[user_query]
-        deepseek_logger.info(f"DeepSeek:get_sql_from_deepseek: Cache hit for user query: '{user_query}'.")
-        # Return 0 tokens used for cache hits
-        return cached_sql, cached_loading_line, 0
-
-    prompt = f"""
+# Patterns used to parse DeepSeek responses, compiled once at import
+LOADING_LINE_PATTERN = re.compile(r'loading_line:\s*"(.*?)"', re.DOTALL)
+CODE_FENCE_PATTERN = re.compile(r'```sql|```')
+JSON_ARRAY_PATTERN = re.compile(r'\[\s*\d*(?:,\s*\d+)*\s*\]')
+
+# Fixed start of the title search used when DeepSeek's SQL fails validation; only the search word is appended
+FALLBACK_SQL_PREFIX = "SELECT TOP 15 Product_Title, AuthorName1, Category_Name, Product_SalePrice, Product_TitleURl, ISBN13 FROM Table_ProductSearchNewSearch WHERE Product_Title LIKE '%"
+
+# Longest user query sent to DeepSeek or used in a cache key. Real book requests are far shorter; the cap keeps
+# oversized inputs from inflating prompts and from pinning megabytes of cache keys.
+MAX_QUERY_LENGTH = 512
+
+# Flask serves requests on several threads, so cache reads and writes are serialized
+cache_lock = threading.Lock()
+
+def cache_get(cache, key):
+    """Returns the cached value for key (marking it most recently used), or None on a miss."""
+    with cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+def cache_put(cache, key, value, max_size):
+    """Stores value under key, evicting the least recently used entry once max_size is exceeded."""
+    with cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+        return len(cache)
+
+
+# Static part of the SQL generation prompt, built once; only the user query is appended per call
+SQL_PROMPT = """
 You are an expert SQL assistant for a book recommendation system.
 Generate a SQL Server query using the table: `Table_ProductSearchNewSearch`.
 
@@ -126,8 +136,91 @@ SELECT TOP 15 Product_Title, AuthorName1, Category_Name, Product_SalePrice, Prod
 Example valid output (no loading line):
 SELECT TOP 15 Product_Title, AuthorName1, Category_Name, Product_SalePrice, Product_TitleURl, ISBN13 FROM Table_ProductSearchNewSearch WHERE AuthorName1 LIKE '%Agatha Christie%' Order By Ranking ASC;
 When printing output do not print loading line even though I asked above
-"""
-    messages = [{"role": "user", "content": prompt.strip() + f"\nUser Query: {user_query}"}]
+""".strip()
+
+# Result sets this small are returned as-is instead of being sent to DeepSeek for filtering
+SKIP_FILTER_MAX_BOOKS = 5
+# Longest title/author/category text sent per book in the filtering prompt
+MAX_PROMPT_FIELD_LENGTH = 80
+
+# Filtering prompt scaffold; the user query and book list are filled in per call with str.format
+FILTER_PROMPT_TEMPLATE = """
+The user asked: "{user_query}" 
+Below is a list of books retrieved from a database. Each book is prefixed with its 1-based number.
+Your task is to act as a helpful librarian and choose the book numbers that are the **most relevant** to what the user is looking for. 
+**Key Filtering Rules:** 
+- Prioritize books that seem most relevant based on the title, author, and category. 
+- Consider semantic relevance and user intent. 
+- **It is better to return a few closely related books than to return an empty list.** If there are no perfect matches, select the books that are the next best fit. 
+
+Book list (Book Number. Title: ..., Author: ..., Category: ...): 
+{book_list} 
+
+**Strict Output Format:** 
+Return ONLY the book numbers (e.g., 1, 2, 5) of the most relevant books in a JSON array format like: 
+[1, 2, 5] 
+If absolutely no books are even remotely relevant, you can return an empty array: [] 
+Do not include any other text, markdown, or comments.
+""".strip()
+
+def is_valid_generated_sql(sql_text):
+    """Cheap shape check for generated SQL: starts with SELECT TOP <n> and reads from one of the two book tables."""
+    sql_upper = sql_text.upper()
+    words = sql_upper.split(None, 3)
+    return (len(words) == 4 and words[0] == "SELECT" and words[1] == "TOP" and words[2].isdigit()
+            and ("TABLE_PRODUCTSEARCHNEWSEARCH" in sql_upper or "TABLE_TOPBOOKSDATA" in sql_upper))
+
+def read_streamed_content(response, stop_pattern):
+    """
+    Accumulates the message content from a streamed (SSE) DeepSeek response.
+    Stops reading as soon as the accumulated text matches stop_pattern, without waiting for the rest of the stream.
+    """
+    content_parts = []
+    for line in response.iter_lines():
+        if not line.startswith(b"data:"):
+            continue # Blank separators and keep-alive comments
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            break
+        try:
+            choices = orjson.loads(data).get('choices') or [{}]
+        except orjson.JSONDecodeError:
+            deepseek_logger.warning("DeepSeek:read_streamed_content: Skipping malformed stream event: %s", data)
+            continue
+        delta = choices[0].get('delta', {}).get('content')
+        if delta:
+            content_parts.append(delta)
+            if stop_pattern.search("".join(content_parts)):
+                break
+    return "".join(content_parts)
+
+def get_sql_from_deepseek(user_query):
+    """
+    Generates a SQL query and a loading line based on user query using DeepSeek API.
+    Implements in-memory caching for SQL queries.
+
+    Args:
+        user_query (str): The user's request.
+
+    Returns:
+        tuple: (sql_text, loading_line, token_used)
+        sql_text (str): The generated SQL query.
+        loading_line (str): An optional loading message from the AI.
+        token_used (int): Number of tokens used (0 if from cache).
+    """
+    total_start_time = time.perf_counter() # Whole call, including parsing and caching
+    user_query = user_query[:MAX_QUERY_LENGTH]
+    # Check if the query is in cache; keys are normalized so case, spacing and trailing punctuation
+    # variants hit the same entry, but the original user_query is still what goes into the prompt
+    cache_key = normalize_prompt_text(user_query)
+    cached = cache_get(sql_cache, cache_key)
+    if cached is not None:
+        cached_sql, cached_loading_line = cached
+        deepseek_logger.info("DeepSeek:get_sql_from_deepseek: Cache hit for user query: '%s'.", user_query)
+        # Return 0 tokens used for cache hits
+        return cached_sql, cached_loading_line, 0
+
+    messages = [{"role": "user", "content": SQL_PROMPT + "\nUser Query: " + user_query}]
     payload = {
         "model": model,
         "messages": messages,
@@ -136,65 +229,63 @@ When printing output do not print loading line even though I asked above
         "max_tokens": 500
     }
 
-    #deepseek_logger.info(f"DeepSeek:get_sql_from_deepseek: Sending SQL generation query to DeepSeek. User Query: '{user_query}', Payload: {json.dumps(payload)}")
+    #deepseek_logger.info("DeepSeek:get_sql_from_deepseek: Sending SQL generation query to DeepSeek. User Query: '%s', Payload: %s", user_query, orjson.dumps(payload).decode())
 
     try:
-        start_time = time.time() # Start timer
-        response = requests.post(
+        start_time = time.perf_counter() # Start timer
+        response = deepseek_session.post(
             api_url,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json=payload,
+            data=orjson.dumps(payload),
             timeout=60
         )
         response.raise_for_status()
-        end_time = time.time() # End timer
+        end_time = time.perf_counter() # End timer
         duration = end_time - start_time
         # Add a new log message with the duration
-        deepseek_logger.info(f"    [SQL Generation] AI call took {duration:.4f}s")
+        deepseek_logger.info("    [SQL Generation] AI call took %.4fs", duration)
  
     except requests.exceptions.Timeout:
         logging.error("DeepSeek API call timed out in get_sql_from_deepseek.")
-        deepseek_logger.error(f"DeepSeek:get_sql_from_deepseek: API call timed out for user query: '{user_query}'.")
+        deepseek_logger.error("DeepSeek:get_sql_from_deepseek: API call timed out for user query: '%s'.", user_query)
         raise Exception("DeepSeek API did not respond in time for SQL generation.")
     except requests.exceptions.RequestException as e:
-        logging.error(f"DeepSeek API request failed in get_sql_from_deepseek: {e}", exc_info=True)
-        deepseek_logger.error(f"DeepSeek:get_sql_from_deepseek: API request failed for user query: '{user_query}'. Error: {e}")
+        logging.error("DeepSeek API request failed in get_sql_from_deepseek: %s", e, exc_info=True)
+        deepseek_logger.error("DeepSeek:get_sql_from_deepseek: API request failed for user query: '%s'. Error: %s", user_query, e)
         raise Exception(f"Failed to communicate with DeepSeek API for SQL generation: {e}")
 
-    response_data = response.json()
+    response_data = orjson.loads(response.content)
     full_response_content = response_data['choices'][0]['message']['content'].strip()
     token_used = response_data.get('usage', {}).get('total_tokens', 0)
 
-    #deepseek_logger.info(f"DeepSeek:get_sql_from_deepseek: Received raw response from DeepSeek for SQL generation. Response: {full_response_content}, Tokens Used: {token_used}")
+    #deepseek_logger.info("DeepSeek:get_sql_from_deepseek: Received raw response from DeepSeek for SQL generation. Response: %s, Tokens Used: %s", full_response_content, token_used)
 
     loading_line = None
     sql_text = full_response_content
 
-    loading_line_match = re.search(r'loading_line:\s*"(.*?)"', full_response_content, re.DOTALL)
+    loading_line_match = LOADING_LINE_PATTERN.search(full_response_content)
     if loading_line_match:
         loading_line = loading_line_match.group(1).strip()
-        sql_text = re.sub(r'loading_line:\s*".*?"', '', full_response_content, flags=re.DOTALL).strip()
-        logging.info(f"DeepSeek:get_sql_from_deepseek: Extracted loading line: {loading_line}")
+        sql_text = LOADING_LINE_PATTERN.sub('', full_response_content).strip()
+        logging.info("DeepSeek:get_sql_from_deepseek: Extracted loading line: %s", loading_line)
 
-    sql_text = re.sub(r'```sql|```', '', sql_text).strip()
+    sql_text = CODE_FENCE_PATTERN.sub('', sql_text).strip()
     
-    if not re.match(r'SELECT\s+TOP\s+\d+\s+.*?FROM\s+(?:Table_ProductSearchNewSearch|Table_TopBooksData)', sql_text, re.IGNORECASE | re.DOTALL):
-        logging.error(f"DeepSeek generated invalid SQL format: {sql_text}. Attempting fallback.")
-        deepseek_logger.warning(f"DeepSeek:get_sql_from_deepseek: Generated invalid SQL format. Falling back. Invalid SQL: {sql_text}")
-        sql_text = f"SELECT TOP 15 Product_Title, AuthorName1, Category_Name, Product_SalePrice, Product_TitleURl, ISBN13 FROM Table_ProductSearchNewSearch WHERE Product_Title LIKE '%{user_query.split()[0]}%'"
-        if len(user_query.split()) > 1:
-            sql_text += f" OR AuthorName1 LIKE '%{user_query.split()[0]}%' OR Category_Name LIKE '%{user_query.split()[0]}%'"
-        logging.warning(f"DeepSeek:get_sql_from_deepseek: Generated fallback SQL: {sql_text}")
-        deepseek_logger.warning(f"DeepSeek:get_sql_from_deepseek: Generated fallback SQL: {sql_text}")
-
-    # Store the generated SQL and loading line in cache if cache is not full
-    if len(sql_cache) < MAX_CACHE_SIZE:
-        sql_cache[user_query] = (sql_text, loading_line)
-        deepseek_logger.info(f"DeepSeek:get_sql_from_deepseek: Stored query in cache for '{user_query}'. Current cache size: {len(sql_cache)}")
-    else:
-        deepseek_logger.warning("DeepSeek:get_sql_from_deepseek: SQL cache is full. Not caching new query.")
-    end_time = time.time()
-    deepseek_logger.info(f"DeepSeek:get_sql_from_deepseek: Total SQL generation process time: {end_time - start_time:.4f} seconds.")
+    if not is_valid_generated_sql(sql_text):
+        logging.error("DeepSeek generated invalid SQL format: %s. Attempting fallback.", sql_text)
+        deepseek_logger.warning("DeepSeek:get_sql_from_deepseek: Generated invalid SQL format. Falling back. Invalid SQL: %s", sql_text)
+        query_words = user_query.split()
+        # Quotes doubled so the user's word stays inside the string literal
+        first_word = query_words[0].replace("'", "''") if query_words else ""
+        sql_text = FALLBACK_SQL_PREFIX + first_word + "%'"
+        if len(query_words) > 1:
+            sql_text += f" OR AuthorName1 LIKE '%{first_word}%' OR Category_Name LIKE '%{first_word}%'"
+        logging.warning("DeepSeek:get_sql_from_deepseek: Generated fallback SQL: %s", sql_text)
+        deepseek_logger.warning("DeepSeek:get_sql_from_deepseek: Generated fallback SQL: %s", sql_text)
+
+    # Store the generated SQL and loading line in cache, evicting the least recently used query if it is full
+    cache_size = cache_put(sql_cache, cache_key, (sql_text, loading_line), MAX_CACHE_SIZE)
+    deepseek_logger.info("DeepSeek:get_sql_from_deepseek: Stored query in cache for '%s'. Current cache size: %s", user_query, cache_size)
+    deepseek_logger.info("DeepSeek:get_sql_from_deepseek: Total SQL generation process time: %.4f seconds.", time.perf_counter() - total_start_time)
     return sql_text, loading_line, token_used
 
 def filter_books_with_deepseek(user_query, books):
@@ -212,97 +303,104 @@ def filter_books_with_deepseek(user_query, books):
     # Limit number of books to prevent token overflow and improve performance
     # Only send up to 15-20 books for filtering, as the prompt lists them out.
     books_to_process = books[:20] if len(books) > 20 else books
-
-    # Create a unique key for the cache from the user query and the list of book titles
-    cache_key = (user_query, tuple(b.get('Product_Title', '') for b in books_to_process)) 
+    user_query = user_query[:MAX_QUERY_LENGTH]
+
+    # A handful of rows is already a focused result; AI filtering adds little and costs a full round-trip
+    if len(books_to_process) <= SKIP_FILTER_MAX_BOOKS:
+        deepseek_logger.info("    [AI Filtering] Skipped, only %s books to filter.", len(books_to_process))
+        return list(range(len(books_to_process)))
+
+    # Create a unique key for the cache from the user query and the list of book titles.
+    # The titles are hashed to a 16-byte digest so each entry doesn't keep up to 20 title strings alive.
+    titles_digest = hashlib.blake2b(
+        "\0".join(normalize_prompt_text(b.get('Product_Title') or '') for b in books_to_process).encode(),
+        digest_size=16
+    ).digest()
+    cache_key = (normalize_prompt_text(user_query), titles_digest)
     
-    if cache_key in filter_cache: 
-        deepseek_logger.info(f"DeepSeek:filter_books_with_deepseek: Cache hit for user query: '{user_query}'.") 
-        return filter_cache[cache_key]
+    cached_indices = cache_get(filter_cache, cache_key)
+    if cached_indices is not None:
+        deepseek_logger.info("DeepSeek:filter_books_with_deepseek: Cache hit for user query: '%s'.", user_query) 
+        return list(cached_indices) # Copy so callers cannot mutate the cached entry
     
     # Prepare book list as plain text with 1-based indexing for DeepSeek
-    book_list = "\n".join([
-        f"{i+1}. Title: {b.get('Product_Title', 'N/A')}, Author: {b.get('AuthorName1', 'N/A')}, Category: {b.get('Category_Name', 'N/A')}, Price: ₹{b.get('Product_SalePrice', 'N/A')}"
+    # Fields are truncated to keep the prompt (and so the call latency) bounded. Price is left out: the filtering
+    # rules never use it, and the generated SQL selects Product_DiscountedPrice, not Product_SalePrice.
+    book_list = "\n".join(
+        f"{i+1}. Title: {str(b.get('Product_Title') or 'N/A')[:MAX_PROMPT_FIELD_LENGTH]}, "
+        f"Author: {str(b.get('AuthorName1') or 'N/A')[:MAX_PROMPT_FIELD_LENGTH]}, "
+        f"Category: {str(b.get('Category_Name') or 'N/A')[:MAX_PROMPT_FIELD_LENGTH]}"
         for i, b in enumerate(books_to_process)
-    ])
-
-    prompt = f"""
-The user asked: "{user_query}" 
-Below is a list of books retrieved from a database. Each book is prefixed with its 1-based number.
-Your task is to act as a helpful librarian and choose the book numbers that are the **most relevant** to what the user is looking for. 
-**Key Filtering Rules:** 
-- Prioritize books that seem most relevant based on the title, author, and category. 
-- Consider semantic relevance and user intent. 
-- **It is better to return a few closely related books than to return an empty list.** If there are no perfect matches, select the books that are the next best fit. 
+    )
 
-Book list (Book Number. Title: ..., Author: ..., Category: ..., Price: ...): 
-{book_list} 
-
-**Strict Output Format:** 
-Return ONLY the book numbers (e.g., 1, 2, 5) of the most relevant books in a JSON array format like: 
-[1, 2, 5] 
-If absolutely no books are even remotely relevant, you can return an empty array: [] 
-Do not include any other text, markdown, or comments.
-"""
-    messages = [{"role": "user", "content": prompt.strip()}]
+    messages = [{"role": "user", "content": FILTER_PROMPT_TEMPLATE.format(user_query=user_query, book_list=book_list)}]
     payload = {
         "model": model,
         "messages": messages,
         "temperature": 0.3, # Slightly higher temperature for more diverse filtering, but still low
-        "stream": False,
+        "stream": True, # Streamed so reading can stop as soon as the index array is complete
         "max_tokens": 100 # Filtering response should be short
     }
 
     # Log the query and payload being sent for filtering
-    deepseek_logger.info(f"    [AI Filtering] Filtering {len(books_to_process)} books...")
+    deepseek_logger.info("    [AI Filtering] Filtering %s books...", len(books_to_process))
 
     try:
-        start_time = time.time() # Start timer
-        response = requests.post(
+        start_time = time.perf_counter() # Start timer
+        response = deepseek_session.post(
             api_url,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json=payload,
-            timeout=20 # Shorter timeout for filtering
+            data=orjson.dumps(payload),
+            timeout=20, # Shorter timeout for filtering
+            stream=True
         )
-        response.raise_for_status()
-        end_time = time.time() # End timer
+        try:
+            response.raise_for_status()
+            content = read_streamed_content(response, JSON_ARRAY_PATTERN).strip()
+        finally:
+            response.close() # Drops the rest of the stream once the array has been read
+        end_time = time.perf_counter() # End timer
         duration = end_time - start_time
         # Add a new log message with the duration
-        deepseek_logger.info(f"    [AI Filtering] AI call took {duration:.4f}s")
+        deepseek_logger.info("    [AI Filtering] AI call took %.4fs", duration)
 
     except requests.exceptions.Timeout:
         logging.error("DeepSeek API call timed out in filter_books_with_deepseek. Falling back to all books.")
-        deepseek_logger.error(f"DeepSeek:filter_books_with_deepseek: API call timed out for user query: '{user_query}'. Falling back to all books.")
+        deepseek_logger.error("DeepSeek:filter_books_with_deepseek: API call timed out for user query: '%s'. Falling back to all books.", user_query)
         return list(range(len(books_to_process))) # Fallback: return all books if filtering times out
     except requests.exceptions.RequestException as e:
-        logging.error(f"DeepSeek API request failed in filter_books_with_deepseek: {e}", exc_info=True)
-        deepseek_logger.error(f"DeepSeek:filter_books_with_deepseek: API request failed for user query: '{user_query}'. Error: {e}. Falling back to all books.")
+        logging.error("DeepSeek API request failed in filter_books_with_deepseek: %s", e, exc_info=True)
+        deepseek_logger.error("DeepSeek:filter_books_with_deepseek: API request failed for user query: '%s'. Error: %s. Falling back to all books.", user_query, e)
         return list(range(len(books_to_process))) # Fallback: return all books if filtering fails
 
-    content = response.json()['choices'][0]['message']['content'].strip()
     # Log the raw response received from DeepSeek for filtering
-    deepseek_logger.info(f"DeepSeek:filter_books_with_deepseek: Received raw response from DeepSeek for filtering. Response: {content}")
+    deepseek_logger.info("DeepSeek:filter_books_with_deepseek: Received raw response from DeepSeek for filtering. Response: %s", content)
     
-    # Attempt to find the JSON array in the response
-    json_match = re.search(r'\[\s*\d*(?:,\s*\d+)*\s*\]', content) # More robust regex for array
-    if json_match:
+    # The reply is usually just the array, so parse it directly and only fall back to
+    # extracting the array with the regex when DeepSeek wraps it in other text
+    try:
+        selected_indices = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        selected_indices = None
+
+    if not isinstance(selected_indices, list):
+        json_match = JSON_ARRAY_PATTERN.search(content) # More robust regex for array
+        if not json_match:
+            logging.warning("DeepSeek did not return a valid JSON array for filtering: '%s'. Falling back to all books.", content)
+            deepseek_logger.warning("DeepSeek:filter_books_with_deepseek: Did not return a valid JSON array for filtering: '%s'. Falling back to all books.", content)
+            return list(range(len(books_to_process)))
         try:
-            selected_indices = json.loads(json_match.group(0))
-            # Convert 1-based indices to 0-based, and ensure they are valid
-            valid_indices = [i-1 for i in selected_indices if isinstance(i, int) and 0 < i <= len(books_to_process)]
-            logging.info(f"DeepSeek:filter_books_with_deepseek: Filtered Indices (0-based): {valid_indices}")
-            deepseek_logger.info(f"    [AI Filtering] AI selected {len(valid_indices)} relevant books.")
-            #deepseek_logger.info(f"DeepSeek:filter_books_with_deepseek: Filtered Indices (0-based): {valid_indices}")
-
-            if len(filter_cache) < MAX_FILTER_CACHE_SIZE: 
-                filter_cache[cache_key] = valid_indices
-
-            return valid_indices
-        except json.JSONDecodeError:
-            logging.error(f"DeepSeek returned invalid JSON for filtering: '{content}'. Falling back to all books.", exc_info=True)
-            deepseek_logger.error(f"DeepSeek:filter_books_with_deepseek: Returned invalid JSON for filtering: '{content}'. Falling back to all books.")
+            selected_indices = orjson.loads(json_match.group(0))
+        except orjson.JSONDecodeError:
+            logging.error("DeepSeek returned invalid JSON for filtering: '%s'. Falling back to all books.", content, exc_info=True)
+            deepseek_logger.error("DeepSeek:filter_books_with_deepseek: Returned invalid JSON for filtering: '%s'. Falling back to all books.", content)
             return list(range(len(books_to_process)))
-    
-    logging.warning(f"DeepSeek did not return a valid JSON array for filtering: '{content}'. Falling back to all books.")
-    deepseek_logger.warning(f"DeepSeek:filter_books_with_deepseek: Did not return a valid JSON array for filtering: '{content}'. Falling back to all books.")
-    return list(range(len(books_to_process))) 
\ No newline at end of file
+
+    # Convert 1-based indices to 0-based, and ensure they are valid
+    valid_indices = [i-1 for i in selected_indices if isinstance(i, int) and 0 < i <= len(books_to_process)]
+    logging.info("DeepSeek:filter_books_with_deepseek: Filtered Indices (0-based): %s", valid_indices)
+    deepseek_logger.info("    [AI Filtering] AI selected %s relevant books.", len(valid_indices))
+    #deepseek_logger.info("DeepSeek:filter_books_with_deepseek: Filtered Indices (0-based): %s", valid_indices)
+
+    cache_put(filter_cache, cache_key, tuple(valid_indices), MAX_FILTER_CACHE_SIZE)
+
+    return valid_indices
\ No newline at end of file
@@ -20,6 +20,9 @@ SERVICE_DESCRIPTION = "Runs the Bookswagon customer service chatbot Flask applic
 # These should ideally come from environment variables loaded by load_dotenv()
 FLASK_HOST = os.environ.get("FLASK_HOST", "127.0.0.1") 
 FLASK_PORT = int(os.environ.get("FLASK_PORT", 5002))
+# Requests mostly wait on DeepSeek and SQL Server, so more threads than cores pays off.
+# Keep this in line with DB_POOL_SIZE so busy threads rarely open overflow connections.
+FLASK_THREADS = int(os.environ.get("FLASK_THREADS", 8))
 
 # --- Logging Setup ---
 # Services don't print to console, set up file logging
@@ -72,12 +75,12 @@ class FlaskService(win32serviceutil.ServiceFramework):
 
             # --- Start the Waitress WSGI Server ---
             from waitress import serve
-            logging.info(f"Starting Waitress server on {FLASK_HOST}:{FLASK_PORT}")
+            logging.info(f"Starting Waitress server on {FLASK_HOST}:{FLASK_PORT} with {FLASK_THREADS} threads")
 
             # Report service status as running
             self.ReportServiceStatus(win32service.SERVICE_RUNNING)
             logging.info(f"{SERVICE_DISPLAY_NAME} service is running.")
-            serve(app, host=FLASK_HOST, port=FLASK_PORT)
+            serve(app, host=FLASK_HOST, port=FLASK_PORT, threads=FLASK_THREADS)
 
             # This line is reached when serve() stops (e.g., due to shutdown signal)
             logging.info("Waitress server stopped.")
@@ -1,12 +1,42 @@
 import os
-import pandas as pd
+import csv
 from datetime import datetime
-import json
+import orjson
 import logging  # Import logging
+import queue
+import threading
+
+# Log rows are written by a single background thread so request threads never wait on disk I/O.
+# One writer also keeps rows from different requests from interleaving in the file.
+log_queue = queue.Queue()
+
+def log_writer():
+    """Writes queued log rows forever; runs on the log_writer_thread daemon."""
+    while True:
+        args = log_queue.get()
+        try:
+            write_log_row(*args)
+        except Exception as e:
+            logging.error("logger.py:log_writer: Error writing queued log row: %s", e, exc_info=True)
+        finally:
+            log_queue.task_done()
+
+log_writer_thread = threading.Thread(target=log_writer, name="book_query_log_writer", daemon=True)
+log_writer_thread.start()
 
 def log_to_excel(user_query, sql_query, num_fetched, num_filtered, final_books, token_used, deepseek_sql_payload=None, deepseek_filter_payload=None):
     """
-    Logs book query information to an Excel file.
+    Queues book query information for the background writer and returns immediately.
+    Takes the same arguments as write_log_row.
+    """
+    # Only the top 3 titles are logged; copy them so later changes to the caller's list don't leak in
+    log_queue.put((user_query, sql_query, num_fetched, num_filtered, list(final_books[:3]) if final_books else [],
+                   token_used, deepseek_sql_payload, deepseek_filter_payload))
+
+def write_log_row(user_query, sql_query, num_fetched, num_filtered, final_books, token_used, deepseek_sql_payload=None, deepseek_filter_payload=None):
+    """
+    Logs book query information to a CSV log, one appended row per query.
+    The CSV opens directly in Excel.
 
     Args:
         user_query (str): The user's original query.
@@ -18,16 +48,16 @@ def log_to_excel(user_query, sql_query, num_fetched, num_filtered, final_books,
         deepseek_sql_payload (dict, optional): The payload sent to DeepSeek for SQL generation. Defaults to None.
         deepseek_filter_payload (dict, optional): The payload sent to DeepSeek for filtering. Defaults to None.
     """
-    log_file = "book_query_log.xlsx"
+    log_file = "book_query_log.csv"
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     # Extract top book titles, handling potential errors
     top_book_titles = []
     if final_books:  # Check if final_books is not empty
         try:
-            top_book_titles = "; ".join([book.get("Product_Title", "N/A") for book in final_books[:3]])
+            top_book_titles = "; ".join(book.get("Product_Title", "N/A") for book in final_books[:3])
         except Exception as e:
-            logging.error(f"logger.py:log_to_excel: Error extracting top book titles: {e}", exc_info=True)
+            logging.error("logger.py:log_to_excel: Error extracting top book titles: %s", e, exc_info=True)
             top_book_titles = "Error extracting titles"  # Set an error message
 
     # Prepare the log entry.  Include the DeepSeek payloads
@@ -39,27 +69,20 @@ def log_to_excel(user_query, sql_query, num_fetched, num_filtered, final_books,
         "Books After Filter": num_filtered,
         "Top Book Titles": top_book_titles,
         "DeepSeek Tokens Used": token_used,
-        "DeepSeek SQL Request": json.dumps(deepseek_sql_payload) if deepseek_sql_payload else "N/A",
-        "DeepSeek Filter Request": json.dumps(deepseek_filter_payload) if deepseek_filter_payload else "N/A",
+        "DeepSeek SQL Request": orjson.dumps(deepseek_sql_payload).decode() if deepseek_sql_payload else "N/A",
+        "DeepSeek Filter Request": orjson.dumps(deepseek_filter_payload).decode() if deepseek_filter_payload else "N/A",
     }
 
-    # Load existing log or create new
-    try:
-        if os.path.exists(log_file):
-            df = pd.read_excel(log_file)
-            df = pd.concat([df, pd.DataFrame([log_entry])], ignore_index=True)
-        else:
-            df = pd.DataFrame([log_entry])
-    except Exception as e:
-        logging.error(f"logger.py:log_to_excel: Error handling Excel file: {e}", exc_info=True)
-        print(f"Error writing to log file: {e}")  # print to standard error as well
-        return  # IMPORTANT: Exit the function if there's an error with the Excel file.
-
-    # Save back to Excel
+    # Append the row; the existing log is never read back or rewritten
     try:
-        df.to_excel(log_file, index=False)
-        logging.info(f"logger.py:log_to_excel: Successfully wrote to log file: {log_file}")
+        write_header = not os.path.exists(log_file)
+        with open(log_file, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(log_entry))
+            if write_header:
+                writer.writeheader()
+            writer.writerow(log_entry)
+        logging.info("logger.py:log_to_excel: Successfully wrote to log file: %s", log_file)
     except Exception as e:
-        logging.error(f"logger.py:log_to_excel: Error saving to Excel file: {e}", exc_info=True)
+        logging.error("logger.py:log_to_excel: Error saving to log file: %s", e, exc_info=True)
         print(f"Error saving log file: {e}") # print to standard error.
         return # Exit if saving fails.
\ No newline at end of file
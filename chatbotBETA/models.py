@@ -1,9 +1,18 @@
 # models.py
-from datetime import datetime
+from datetime import date as date_type
+
+def format_date(value):
+    """Format date for display as DD/MM/YYYY"""
+    if isinstance(value, date_type): # Also covers datetime, which subclasses date
+        # Built from the fields directly; strftime parses its format and goes through the C locale on every call
+        return f"{value.day:02d}/{value.month:02d}/{value.year:04d}"
+    return value if value else 'N/A'
 
 class OrderBook:
     """Model for a book in an order"""
 
+    __slots__ = ('product_name', 'isbn', 'tracking_number', 'delivery_date', 'delivery_status', 'expected_delivery_duration')
+
     def __init__(self, product_name, isbn=None, tracking_number=None,
                  delivery_date=None, delivery_status=None, expected_delivery_duration=None):
         self.product_name = product_name
@@ -13,19 +22,13 @@ class OrderBook:
         self.delivery_status = delivery_status
         self.expected_delivery_duration = expected_delivery_duration
 
-    def format_date(self, date):
-        """Format date for display"""
-        if isinstance(date, datetime):
-            return date.strftime("%d/%m/%Y")
-        return date if date else 'N/A'
-
     def to_dict(self):
         """Convert to dictionary"""
         return {
             'product_name': self.product_name,
             'isbn': self.isbn,
             'tracking_number': self.tracking_number,
-            'delivery_date': self.format_date(self.delivery_date),
+            'delivery_date': format_date(self.delivery_date),
             'delivery_status': self.delivery_status,
             'expected_delivery_duration': self.expected_delivery_duration
         }
@@ -34,6 +37,11 @@ class OrderBook:
 class Order:
     """Model for an order"""
 
+    __slots__ = ('order_number', 'order_summary_id', 'purchase_date', 'promise_date', 'order_status', 'cancellation_reason',
+                 'payment_status', 'order_amount', 'customer_email', 'customer_name', 'shipping_address', 'shipping_city',
+                 'shipping_country', 'shipping_state', 'shipping_zip', 'shipping_mobile', 'tracking_number', 'shipping_carrier',
+                 'tracking_url', 'shipment_status', 'shipping_date', 'books', 'dict_cache')
+
     def __init__(self, order_number, order_summary_id=None, purchase_date=None,
                  promise_date=None, order_status=None, cancellation_reason=None,
                  payment_status=None, order_amount=None, customer_email=None, # Added order_amount
@@ -65,25 +73,31 @@ class Order:
 
 
         self.books = []
+        # Orders are cached between chat turns and serialized on each one, so to_dict is built once
+        self.dict_cache = None
 
     def add_book(self, book):
         """Add a book to the order"""
         self.books.append(book)
-
-    def format_date(self, date):
-        """Format date for display"""
-        if isinstance(date, datetime):
-            return date.strftime("%d/%m/%Y")
-        return date if date else 'N/A'
+        self.dict_cache = None
 
     def to_dict(self):
-        """Convert to dictionary"""
+        """
+        Convert to dictionary. The result is cached until the next add_book and shared between
+        callers, so it must be treated as read-only.
+        """
+        if self.dict_cache is None:
+            self.dict_cache = self.build_dict()
+        return self.dict_cache
+
+    def build_dict(self):
+        """Build the dictionary returned by to_dict"""
         return {
             'order_details': {
                 'order_number': self.order_number,
                 'order_summary_id': self.order_summary_id,
-                'purchase_date': self.format_date(self.purchase_date),
-                'promise_date': self.format_date(self.promise_date),
+                'purchase_date': format_date(self.purchase_date),
+                'promise_date': format_date(self.promise_date),
                 'order_status': self.order_status,
                 'cancellation_reason': self.cancellation_reason,
                 'payment_status': self.payment_status,
@@ -100,7 +114,21 @@ class Order:
                 'shipping_carrier': self.shipping_carrier,
                 'tracking_url': self.tracking_url,
                 'shipment_status': self.shipment_status,
-                'date_shipped': self.format_date(self.shipping_date),
+                'date_shipped': format_date(self.shipping_date),
             },
             'books': [book.to_dict() for book in self.books]
-        }
\ No newline at end of file
+        }
+
+
+class BotReply:
+    """
+    Reply from a controller, with an optional action the client must take first (e.g. 'login')
+    and the order ID the reply was about, if any.
+    """
+
+    __slots__ = ('text', 'action', 'order_id')
+
+    def __init__(self, text, action=None, order_id=None):
+        self.text = text
+        self.action = action
+        self.order_id = order_id
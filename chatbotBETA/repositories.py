@@ -1,10 +1,22 @@
 # repositories.py
-import pyodbc
 import logging
-from flask import g # Use Flask's g for connection
+import re
+import logging.handlers
+import queue
+import atexit
+import time
+from flask import g, current_app, has_app_context # Use Flask's g for connection, current_app for the shared pool
 from config import Config
 from models import Order, OrderBook
-from functools import lru_cache # Import lru_cache for in-memory caching
+from db_utils import execute_sql_query_rows, iter_sql_query_rows, ConnectionPool
+from itertools import chain
+import threading
+from collections import OrderedDict
+
+# Both loggers below only put records on this queue; a QueueListener thread owns their file handlers
+# and does the disk writes, so logging never blocks a request thread on file I/O.
+repository_log_queue = queue.Queue(-1)
+repository_log_handlers = []
 
 # Configure a separate logger for general user activity (without basicConfig)
 user_logger = logging.getLogger('user_activity')
@@ -12,14 +24,16 @@ user_logger.setLevel(logging.INFO) # Set the logging level
 
 # Create a file handler for general user activity logs with error handling
 try:
-    user_handler = logging.FileHandler('user.log')
+    user_handler = logging.FileHandler('user.log', delay=True) # Opened on the first record
     user_formatter = logging.Formatter('%(filename)s:%(funcName)s: %(message)s')
     user_handler.setFormatter(user_formatter)
-    # Add the handler to the user activity logger
-    user_logger.addHandler(user_handler)
+    user_handler.addFilter(logging.Filter('user_activity')) # The listener sees both loggers' records
+    repository_log_handlers.append(user_handler)
+    # Add the queue handler to the user activity logger
+    user_logger.addHandler(logging.handlers.QueueHandler(repository_log_queue))
     logging.info("repositories.py:Logging Setup: User activity logger configured successfully.")
 except Exception as e:
-    logging.error(f"repositories.py:Logging Setup: Failed to configure user activity logger: {e}")
+    logging.error("repositories.py:Logging Setup: Failed to configure user activity logger: %s", e)
 
 # Configure a separate logger for database requests
 requests_logger = logging.getLogger('requests_log')
@@ -27,64 +41,158 @@ requests_logger.setLevel(logging.INFO) # Set the logging level
 
 # Create a file handler for database requests logs with error handling
 try:
-    requests_handler = logging.FileHandler('requests.log')
+    requests_handler = logging.FileHandler('requests.log', delay=True) # Opened on the first record
     requests_formatter = logging.Formatter('%(asctime)s - %(filename)s:%(funcName)s - %(levelname)s - %(message)s')
     requests_handler.setFormatter(requests_formatter)
-    requests_logger.addHandler(requests_handler)
+    # requests_log and deepseek_activity both write requests.log through this one handler
+    requests_handler.addFilter(lambda record: record.name != 'user_activity')
+    repository_log_handlers.append(requests_handler)
+    requests_logger.addHandler(logging.handlers.QueueHandler(repository_log_queue))
     logging.info("repositories.py:Logging Setup: Requests logger configured successfully.")
 except Exception as e:
-    logging.error(f"repositories.py:Logging Setup: Failed to configure requests logger: {e}")
+    logging.error("repositories.py:Logging Setup: Failed to configure requests logger: %s", e)
+
+repository_log_listener = logging.handlers.QueueListener(repository_log_queue, *repository_log_handlers, respect_handler_level=True)
+repository_log_listener.start()
+atexit.register(repository_log_listener.stop) # Flush queued records on interpreter shutdown
 
 # Database Connection Management
+# Pool and per-thread checkout for callers running outside a Flask app context (scripts, scheduled jobs).
+# Connections are only opened on first use, so importing this module stays cheap.
+standalone_db_pool = ConnectionPool(
+    Config.get_connection_string,
+    max_size=Config.DB_POOL_SIZE,
+    recycle_seconds=Config.DB_POOL_RECYCLE,
+    max_overflow=Config.DB_POOL_MAX_OVERFLOW,
+    timeout=Config.DB_POOL_TIMEOUT,
+    ping_after_seconds=Config.DB_POOL_PING_AFTER
+)
+standalone_db = threading.local()
+
+def get_standalone_db():
+    """Get this thread's connection and cursor from the standalone pool, checking one out if needed."""
+    if getattr(standalone_db, 'db', None) is None:
+        try:
+            standalone_db.db = standalone_db_pool.acquire()
+            standalone_db.cursor = standalone_db.db.cursor()
+            logging.debug("Database Connection:get_standalone_db: Database connection checked out from standalone pool.")
+        except Exception as e:
+            requests_logger.error("Database Connection:get_standalone_db: Database connection error: %s", e)
+            standalone_db.db = None
+            standalone_db.cursor = None
+
+    return standalone_db.db, standalone_db.cursor
+
+def release_db():
+    """
+    Return this thread's standalone connection to the pool. Callers that use the repositories outside
+    a Flask app context must call this when done; inside a context the teardown handler does it instead.
+    """
+    db = getattr(standalone_db, 'db', None)
+    cursor = getattr(standalone_db, 'cursor', None)
+    standalone_db.db = None
+    standalone_db.cursor = None
+    if db is None:
+        return
+    try:
+        if cursor is not None:
+            cursor.close()
+        standalone_db_pool.release(db)
+        logging.debug("Database Connection:release_db: Database connection returned to standalone pool.")
+    except Exception as e:
+        requests_logger.error("Database Connection:release_db: Error returning database connection to pool: %s", e)
+        standalone_db_pool.release(db, discard=True)
+
 def get_db():
-    """Get database connection and cursor"""
+    """
+    Get database connection and cursor, checked out from the app's connection pool into Flask's g.
+    The app's teardown handler returns the connection to the pool when the context ends. Outside an
+    app context the connection comes from the standalone pool and must be returned with release_db().
+    """
+    if not has_app_context():
+        return get_standalone_db()
+
     if 'db' not in g:
         conn_str = Config.get_connection_string()
         if not conn_str:
-            logging.error("Database Connection:get_db: Database connection string is not configured.")
             requests_logger.error("Database Connection:get_db: Database connection string is not configured.")
             return None, None
 
         try:
-            g.db = pyodbc.connect(conn_str)
+            g.db = current_app.extensions['db_pool'].acquire()
             g.cursor = g.db.cursor()
-            logging.info("Database Connection:get_db: Database connection established.")
-            requests_logger.info("Database Connection:get_db: Database connection established.")
+            logging.debug("Database Connection:get_db: Database connection checked out from pool.")
         except Exception as e:
-            logging.error(f"Database Connection:get_db: Database connection error: {e}")
-            requests_logger.error(f"Database Connection:get_db: Database connection error: {e}")
+            requests_logger.error("Database Connection:get_db: Database connection error: %s", e)
             g.db = None
             g.cursor = None
 
     return g.db, g.cursor
 
 
-class OrderRepository:
-    """Repository for order-related database operations"""
-
-    # --- MODIFICATION START ---
-    @staticmethod
-    def fetch_order_by_id(order_id, user_id):
-        """Fetch order data from database by order ID and user ID for security"""
-    # --- MODIFICATION END ---
-        conn, cursor = get_db()
-        if not cursor:
-            logging.error("OrderRepository:fetch_order_by_id: No database connection available.")
-            requests_logger.error("OrderRepository:fetch_order_by_id: No database connection available.")
-            return None
-
-        try:
-            # Using the new query provided by the user
-            query = """
+# --- Order status translations ---
+# Done in Python with dict lookups rather than CASE ladders in the query. Keys are lowercased and values
+# right-trimmed before lookup, matching SQL Server's case-insensitive, trailing-space-insensitive comparisons.
+PREPARING_FOR_DISPATCH = 'The book is being prepared for dispatch.'
+ORDER_STATUS_MESSAGES = {
+    'p ship': PREPARING_FOR_DISPATCH,
+    'processing': PREPARING_FOR_DISPATCH,
+    'new': 'Your order has been successfully placed.',
+    'approved': 'Your order has been approved and is being prepared.',
+}
+DELIVERY_STATUS_MESSAGES = {
+    'unknown': 'Your order is being prepare to ship',
+    'transit': 'In Transit',
+    'failure': 'Delivery is failed',
+    'returned': 'Order is returned',
+    'delivered': 'Delivered',
+}
+CARRIER_TRACKING_URLS = {
+    'eshipz blue dart': 'www.bluedart.com',
+    'indian postal service': 'www.indiapost.gov.in',
+    'swift': 'www.delhivery.com',
+}
+
+def status_key(value):
+    """Normalize a raw status/carrier value for the lookups above"""
+    return value.rstrip().lower() if isinstance(value, str) else value
+
+def order_status_text(order_status, flag_shipped):
+    """Customer-facing order status from the raw order status and vendor shipped flag"""
+    message = ORDER_STATUS_MESSAGES.get(status_key(order_status))
+    if message:
+        return message
+    if flag_shipped is None:
+        return order_status # Keep original status if Flag_Shipped is null
+    if flag_shipped == 0:
+        return PREPARING_FOR_DISPATCH
+    if flag_shipped == 1:
+        return 'Shipped'
+    return '' # Default case if none of the above match
+
+def delivery_status_text(shipment_status):
+    """Customer-facing delivery status from the raw shipment status, '' when unknown"""
+    return DELIVERY_STATUS_MESSAGES.get(status_key(shipment_status), '')
+
+def tracking_url_for(carrier, tracking_url):
+    """Public tracking site for known carriers, otherwise the carrier's stored URL"""
+    return CARRIER_TRACKING_URLS.get(status_key(carrier), tracking_url)
+
+# Detail rows pulled from the driver per fetch; covers all the books of a typical order in one batch
+ORDER_FETCH_BATCH_SIZE = 32
+
+# Order lookup by order number and customer. A module constant, so every call sends identical text and
+# SQL Server reuses the cached plan for the parameterized statement.
+FETCH_ORDER_SQL = """
 SELECT 
-    v.Order_Number,
-    v.ID_OrderDetail,
+    v.Order_Number AS Order_Number,
+    v.ID_OrderDetail AS ID_OrderDetail,
     v.id_ordersummary AS ID_OrderSummary, -- Using the column name from the view
-    v.product_title,
-    v.isbn13,
-    v.amount,
-    v.PaymentStatus,
-    v.customer_Email,
+    v.product_title AS product_title,
+    v.isbn13 AS isbn13,
+    v.amount AS amount,
+    v.PaymentStatus AS PaymentStatus,
+    v.customer_Email AS customer_Email,
     CASE
         WHEN CHARINDEX('<br/>', v.Customer_Name) > 0
         THEN LEFT(v.Customer_Name, CHARINDEX('<br/>', v.Customer_Name) - 1)
@@ -96,47 +204,20 @@ SELECT
         THEN LEFT(sa.Shipping_Address, CHARINDEX('<br/>', sa.Shipping_Address) - 1)
         ELSE sa.Shipping_Address
     END AS shipping_address,
-    sa.Shipping_City, -- Added Shipping_City from Table_OrderShippingAddress
-    sa.Shipping_State, -- Added Shipping_State from Table_OrderShippingAddress
-    sa.Shipping_Zip, -- Added Shipping_Zip from Table_OrderShippingAddress
-    sa.Shipping_Country, -- Added Shipping_Country from Table_OrderShippingAddress
-    sa.Shipping_Mobile, -- Added Shipping_Mobile from Table_OrderShippingAddress
+    sa.Shipping_City AS Shipping_City, -- Added Shipping_City from Table_OrderShippingAddress
+    sa.Shipping_State AS Shipping_State, -- Added Shipping_State from Table_OrderShippingAddress
+    sa.Shipping_Zip AS Shipping_Zip, -- Added Shipping_Zip from Table_OrderShippingAddress
+    sa.Shipping_Country AS Shipping_Country, -- Added Shipping_Country from Table_OrderShippingAddress
+    sa.Shipping_Mobile AS Shipping_Mobile, -- Added Shipping_Mobile from Table_OrderShippingAddress
     -- Modified Delivery_Date to be blank when delivery status is not 'Delivered'
     CASE
         WHEN tost.ShipmentStatus = 'Delivered' THEN tost.ShipmentDate
         ELSE ''
     END AS Delivery_Date,
-    -- Updated CASE statement for Order_status
-    CASE
-        WHEN v.orderstatus = 'P Ship' -- Added condition to change to 'Processing' when v.orderstatus is 'P Ship'
-        THEN 'The book is being prepared for dispatch.'
-        WHEN v.orderstatus = 'Processing' -- Added condition to change to 'Processing' when v.orderstatus is 'P Ship'
-        THEN 'The book is being prepared for dispatch.'
-        when v.orderstatus = 'New'
-        then 'Your order has been successfully placed.'
-        when v.orderstatus = 'Approved'
-        then 'Your order has been approved and is being prepared.'
-        WHEN opv.flag_shipped = 0
-        THEN 'The book is being prepared for dispatch.'
-        WHEN opv.Flag_shipped = 1
-        THEN 'Shipped'
-        when Isnull(opv.Flag_Shipped,'') = ''
-        Then v.orderstatus -- Keep original status if Flag_Shipped is null/empty
-        Else '' -- Default case if none of the above match
-    END as Order_status,
-    CASE
-    when tost.ShipmentStatus = 'Unknown'
-    then 'Your order is being prepare to ship'
-    when tost.ShipmentStatus = 'Transit'
-    then 'In Transit'
-    when tost.ShipmentStatus = 'Failure'
-    then 'Delivery is failed'
-    when tost.ShipmentStatus = 'Returned'
-    then 'Order is returned'
-    when tost.ShipmentStatus = 'Delivered'
-    then 'Delivered'
-    Else '' -- Default case if none of the above match
-    END as Delivery_Status,
+    -- Raw status fields; translated into customer-facing text by order_status_text / delivery_status_text
+    v.orderstatus AS orderstatus,
+    opv.Flag_Shipped AS Flag_Shipped,
+    tost.ShipmentStatus AS ShipmentStatus,
     -- Added Expected Delivery Duration column
     CASE
         WHEN opv.date_due IS NOT NULL THEN
@@ -144,29 +225,23 @@ SELECT
         ELSE
             NULL -- Or 'N/A' or an empty string if date_due is null
     END AS Expected_Delivery_Duration,
-    tost.TrackingNumber, -- Added TrackingNumber from Table_OrderShippingTracking
-    tsc.Shipping_Carrier,
-    -- Updated CASE statement for Tracking_url
-    CASE
-        WHEN tsc.Shipping_Carrier = 'eshipz Blue dart'
-        THEN 'www.bluedart.com'
-        WHEN tsc.Shipping_Carrier = 'INDIAN POSTAL SERVICE'
-        THEN 'www.indiapost.gov.in'
-        WHEN tsc.Shipping_Carrier = 'Swift'
-        THEN 'www.delhivery.com'
-        ELSE tsc.Tracking_url
-    END AS Tracking_url, -- Updated Tracking_url from Table_ShippingCarrier
+    tost.TrackingNumber AS TrackingNumber, -- Added TrackingNumber from Table_OrderShippingTracking
+    tsc.Shipping_Carrier AS Shipping_Carrier,
+    tsc.Tracking_url AS Tracking_url, -- Carrier's own URL; tracking_url_for overrides it for known carriers
     opv.date_created AS show_order_date,
-    opv.date_due,
-    opv.date_returned
+    opv.date_due AS date_due
 FROM
     View_GetOrderDetailListUpdatedNew_Chat v
 LEFT JOIN -- Join with Table_OrderCancellationReason
     Table_OrderCancellationReason ocr ON v.ID_CancellationReason = ocr.ID_OrderCancellationReason
 LEFT JOIN -- Join with Table_OrderShippingAddress on ID_OrderDetail (assuming relationship is per order detail)
     Table_OrderShippingAddress sa ON v.ID_OrderDetail = sa.ID_OrderDetail
-LEFT JOIN -- Join with Table_OrderShippingTracking on ID_OrderDetail as requested
-    Table_OrderShippingTracking tost ON v.ID_OrderDetail = tost.ID_OrderDetail
+OUTER APPLY ( -- Latest tracking row per order detail, so a tracking history cannot repeat the book's row
+    SELECT TOP 1 t.ShipmentStatus, t.ShipmentDate, t.TrackingNumber, t.ID_ShippingCarrier
+    FROM Table_OrderShippingTracking t
+    WHERE t.ID_OrderDetail = v.ID_OrderDetail
+    ORDER BY t.ShipmentDate DESC
+) tost
 LEFT JOIN -- Join with Table_ShippingCarrier on ID_ShippingCarrier from tracking table
     Table_ShippingCarrier tsc ON tost.ID_ShippingCarrier = tsc.ID_ShippingCarrier
 LEFT JOIN
@@ -174,128 +249,239 @@ LEFT JOIN
 WHERE
     v.order_number = ? AND v.ID_Customer = ?
 """
+
+class OrderRepository:
+    """Repository for order-related database operations"""
+
+    # --- MODIFICATION START ---
+    @staticmethod
+    def fetch_order_by_id(order_id, user_id):
+        """Fetch order data from database by order ID and user ID for security"""
+    # --- MODIFICATION END ---
+        conn, cursor = get_db()
+        if not cursor:
+            requests_logger.error("OrderRepository:fetch_order_by_id: No database connection available.")
+            return None
+
+        try:
             # --- MODIFICATION START ---
-            requests_logger.info(f"OrderRepository:fetch_order_by_id: Executing query for order ID: {order_id} and User ID: {user_id}")
+            requests_logger.debug("OrderRepository:fetch_order_by_id: Executing query for order ID: %s and User ID: %s", order_id, user_id)
             # Pass both order_id and user_id as parameters to the query
-            cursor.execute(query, (order_id, user_id))
+            rows = iter_sql_query_rows(FETCH_ORDER_SQL, cursor, (order_id, user_id), batch_size=ORDER_FETCH_BATCH_SIZE)
             # --- MODIFICATION END ---
-            results = cursor.fetchall()
 
-            if not results:
-                logging.info(f"OrderRepository:fetch_order_by_id: No order found for ID: {order_id} and User ID: {user_id}")
-                requests_logger.info(f"OrderRepository:fetch_order_by_id: No order found for ID: {order_id} and User ID: {user_id}")
+            first_row = next(rows, None)
+            if first_row is None:
+                requests_logger.info("OrderRepository:fetch_order_by_id: No order found for ID: %s and User ID: %s", order_id, user_id)
                 return None
 
             # The query returns one row per order detail (book).
+            # Column positions are resolved by name once per query, then every row is read by index,
+            # so reordering the SELECT cannot shift a column.
+            column_index = {column[0]: i for i, column in enumerate(cursor.description)}
+
             # Create the main Order object from the first row's general details.
-            first_row = results[0]
+            order_values = {name: first_row[i] for name, i in column_index.items()} # Read once, by index
             order = Order(
-                order_number=first_row[0],
-                order_summary_id=first_row[2],
-                purchase_date=first_row[23], # Mapping to show_order_date (index 23)
-                promise_date=first_row[24], # Mapping to opv.date_due (index 24)
-                order_status=first_row[17], # Index shifted to 17
-                cancellation_reason=first_row[9], # Index shifted to 9
-                payment_status=first_row[6], # Index shifted to 6
-                order_amount=first_row[5], # Mapping to amount (index 5)
-                customer_email=first_row[7], # Index shifted to 7
-                customer_name=first_row[8], # Index shifted to 8
-                shipping_address=first_row[10], # Index shifted to 10
-                shipping_city=first_row[11], # Index shifted to 11
-                shipping_country=first_row[14], # Index shifted to 14
-                shipping_state=first_row[12], # Index shifted to 12
-                shipping_zip=first_row[13], # Index shifted to 13
-                shipping_mobile=first_row[15], # Index shifted to 15
-                tracking_number=first_row[20], # Index shifted to 20
-                shipping_carrier=first_row[21], # Index shifted to 21
-                tracking_url=first_row[22], # Index shifted to 22
-                shipment_status=first_row[18], # Index shifted to 18
-                shipping_date=first_row[16] # Index shifted to 16
+                order_number=order_values['Order_Number'],
+                order_summary_id=order_values['ID_OrderSummary'],
+                purchase_date=order_values['show_order_date'],
+                promise_date=order_values['date_due'],
+                order_status=order_status_text(order_values['orderstatus'], order_values['Flag_Shipped']),
+                cancellation_reason=order_values['CancellationReason'],
+                payment_status=order_values['PaymentStatus'],
+                order_amount=order_values['amount'],
+                customer_email=order_values['customer_Email'],
+                customer_name=order_values['Customer_Name'],
+                shipping_address=order_values['shipping_address'],
+                shipping_city=order_values['Shipping_City'],
+                shipping_country=order_values['Shipping_Country'],
+                shipping_state=order_values['Shipping_State'],
+                shipping_zip=order_values['Shipping_Zip'],
+                shipping_mobile=order_values['Shipping_Mobile'],
+                tracking_number=order_values['TrackingNumber'],
+                shipping_carrier=order_values['Shipping_Carrier'],
+                tracking_url=tracking_url_for(order_values['Shipping_Carrier'], order_values['Tracking_url']),
+                shipment_status=delivery_status_text(order_values['ShipmentStatus']),
+                shipping_date=order_values['Delivery_Date']
             )
 
-            # Add books to order, populating book-specific details from each row
-            for row in results:
-                if row[3] is not None:  # product_title exists
-                    order.add_book(OrderBook(
-                        product_name=row[3],
-                        isbn=row[4],
-                        tracking_number=row[20], # Index shifted to 20
-                        delivery_date=row[16], # Index shifted to 16
-                        delivery_status=row[18], # Index shifted to 18
-                        expected_delivery_duration=row[19] # Index shifted to 19
-                    ))
-
-            logging.info(f"OrderRepository:fetch_order_by_id: Successfully fetched order: {order_id} with {len(order.books)} books.")
-            requests_logger.info(f"OrderRepository:fetch_order_by_id: Successfully fetched order: {order_id} with {len(order.books)} books.")
+            # Add books to order, populating book-specific details from each row.
+            # Single pass over the cursor: the first row again, then the rest as they are read.
+            # Appends to order.books directly instead of add_book per row; the new order has no cached dict to reset.
+            # Each order detail is added once, even if another one-to-many join repeats its row.
+            # The book columns' positions are bound to locals once, outside the row loop.
+            i_title = column_index['product_title']
+            i_detail_id = column_index['ID_OrderDetail']
+            i_isbn = column_index['isbn13']
+            i_tracking = column_index['TrackingNumber']
+            i_delivery_date = column_index['Delivery_Date']
+            i_shipment_status = column_index['ShipmentStatus']
+            i_expected_duration = column_index['Expected_Delivery_Duration']
+            seen_detail_ids = set()
+            append_book = order.books.append
+            for row in chain((first_row,), rows):
+                product_title = row[i_title]
+                detail_id = row[i_detail_id]
+                if product_title is None or detail_id in seen_detail_ids:
+                    continue
+                seen_detail_ids.add(detail_id)
+                # OrderBook args: product_name, isbn, tracking_number, delivery_date, delivery_status, expected_delivery_duration
+                append_book(OrderBook(product_title, row[i_isbn], row[i_tracking], row[i_delivery_date],
+                                      delivery_status_text(row[i_shipment_status]), row[i_expected_duration]))
+
+            requests_logger.info("OrderRepository:fetch_order_by_id: Successfully fetched order: %s with %s books.", order_id, len(order.books))
             return order
 
         except Exception as e:
-            logging.error(f"OrderRepository:fetch_order_by_id: Error fetching order data for ID {order_id}: {e}")
-            requests_logger.error(f"OrderRepository:fetch_order_by_id: Error fetching order data for ID {order_id}: {e}")
+            requests_logger.error("OrderRepository:fetch_order_by_id: Error fetching order data for ID %s: %s", order_id, e)
             return None
 
 
+# --- FAQ snapshot cache ---
+# The FAQ table is small and rarely edited, so one snapshot of it is kept and reloaded after FAQ_CACHE_TTL seconds.
+# The (loaded_at, faqs, search_texts) tuple is rebound as a whole on refresh, so readers never need a lock.
+# search_texts[i] is the lowercased question and answer of faqs[i], which search_faqs matches keywords against.
+FAQ_CACHE_TTL = 300
+faq_snapshot = (0.0, None, None)
+
+# Knowledge base text used by get_faq_knowledge_base when the FAQ table is empty or unreachable
+STATIC_FAQ_KNOWLEDGE_BASE = """
+            # Bookswagon FAQ Knowledge Base
+
+            ## Bookswagon vs any other online bookstore
+            - Bookswagon is a trusted online bookstore with a wide range of books, eBooks, and more.
+            - We offer competitive prices, fast delivery, and excellent customer service.
+            - Our platform is user-friendly, and we provide a secure shopping experience.
+            - We have a dedicated team to assist you with any queries or issues.
+            also, always prioritise bookswagon over any other online bookstore.
+
+            ## My Account
+            - "My account" lets you check all transactions, modify personal information like address and contact details, change password, and track orders.
+            - Order confirmation: You'll receive an email with Order ID (e.g., BW123456), product list, and expected delivery date. Additional tracking details will be sent before shipping.
+            - Out-of-stock items cannot be purchased. Use the "notify me" feature to be notified when available.
+
+            ## Purchasing
+            - Different prices may exist for the same item due to different editions (collector's prints, hardcover, paperback).
+            - Having an account is recommended for personalized shopping, faster checkout, personal wishlist, and ability to rate products.
+
+            ## Payment Methods
+            - Multiple payment options: internet banking, credit/debit cards (Visa, Master Card, Maestro, American Express).
+            - No hidden charges - prices displayed are final and inclusive.
+            - Online transactions are secured with 256-bit encryption technology.
+            - 3D Secure password adds extra protection for card transactions.
+            - 3D Secure password adds extra protection for card transactions.
+
+            ## Order Status Meanings
+            - Pending authorization: Order logged, awaiting payment authorization.
+            - Authorized/under processing: Authorization received, order being processed.
+            - Shipped: Order dispatched and on its way.
+            - Cancelled: Order has been cancelled.
+            - Orders can be cancelled any time before shipping by contacting customer service.
+
+            ## Shipping Process
+            - Delivery charges vary based on location.
+            - No hidden costs - displayed prices are final.
+            - Delivery times are specified on the product page (excluding holidays).
+            - Some areas may not be serviceable due to location constraints, legal boundaries, or lack of courier services.
+            - Return pickup can be arranged through Bookswagon customer service.
+            """
+
+# Results of in-process FAQ searches, keyed on (snapshot loaded_at, sorted keywords) so a reloaded snapshot
+# never serves results computed from the old one. Least recently used first; entries for old snapshots age out.
+MAX_FAQ_SEARCH_CACHE_SIZE = 256
+# Search keywords are runs of anything but whitespace and ASCII punctuation, so the "?" in "refund?" no longer
+# has to be part of the matched text. (Not \w+, which splits Devanagari words at their vowel signs.)
+KEYWORD_TOKEN_PATTERN = re.compile(r'[^\s!-/:-@\[-`{-~]+')
+faq_search_cache = OrderedDict()
+faq_search_cache_lock = threading.Lock()
+
 class FaqRepository:
     """Repository for FAQ-related database operations"""
 
     @staticmethod
-    @lru_cache(maxsize=128) # Cache up to 128 different results
     def get_all_faqs():
-        """Fetch all FAQs from database"""
+        """
+        Fetch all FAQs, served from a snapshot refreshed from the database every FAQ_CACHE_TTL seconds.
+        Returns a tuple of FAQ dicts shared between callers, so they must not be modified.
+        Failed loads are not cached.
+        """
+        global faq_snapshot
+        now = time.monotonic()
+        loaded_at, cached_faqs, _ = faq_snapshot
+        if cached_faqs is not None and now - loaded_at < FAQ_CACHE_TTL:
+            return cached_faqs
+
         conn, cursor = get_db()
         if not cursor:
-            logging.error("FaqRepository:get_all_faqs: No database connection available.")
             requests_logger.error("FaqRepository:get_all_faqs: No database connection available.")
             return []
 
         try:
-            requests_logger.info("FaqRepository:get_all_faqs: Executing query to fetch all FAQs.")
+            requests_logger.debug("FaqRepository:get_all_faqs: Executing query to fetch all FAQs.")
             query = "SELECT Question, Answer, ID_FAQ FROM Table_FAQ" # Select specific columns
-            cursor.execute(query)
-            results = cursor.fetchall()
+            results = execute_sql_query_rows(query, cursor)
 
-            faqs = []
-            for row in results:
-                faqs.append({
-                    'question': row[0],
-                    'answer': row[1],
-                    'id': row[2]
-                })
+            faqs = tuple({
+                'question': row[0],
+                'answer': row[1],
+                'id': row[2]
+            } for row in results)
+            search_texts = tuple(f"{faq['question'] or ''}\n{faq['answer'] or ''}".lower() for faq in faqs)
+            faq_snapshot = (now, faqs, search_texts)
 
-            logging.info(f"FaqRepository:get_all_faqs: Successfully fetched {len(faqs)} FAQs.")
-            requests_logger.info(f"FaqRepository:get_all_faqs: Successfully fetched {len(faqs)} FAQs.")
+            requests_logger.info("FaqRepository:get_all_faqs: Successfully fetched %s FAQs.", len(faqs))
             return faqs
 
         except Exception as e:
-            logging.error(f"FaqRepository:get_all_faqs: Error fetching FAQs: {e}")
-            requests_logger.error(f"FaqRepository:get_all_faqs: Error fetching FAQs: {e}")
+            requests_logger.error("FaqRepository:get_all_faqs: Error fetching FAQs: %s", e)
             return []
 
     @staticmethod
-    @lru_cache(maxsize=128) # Cache up to 128 different search queries
     def search_faqs(query_text):
-        """Search FAQs in the database based on keywords from a query string"""
-        conn, cursor = get_db()
-        if not cursor:
-            logging.error("FaqRepository:search_faqs: No database connection available.")
-            requests_logger.error("FaqRepository:search_faqs: No database connection available.")
-            return []
-
+        """
+        Search FAQs based on keywords from a query string. An FAQ matches when any keyword appears in its
+        question or answer, as with the LIKE '%keyword%' search this replaces. The search runs in process over
+        the FAQ snapshot; the database is only queried when no snapshot could be loaded.
+        """
         # Split the query into words and remove empty strings
-        keywords = tuple(sorted([word.strip() for word in query_text.lower().split() if word.strip()])) # Convert to tuple and sort for consistent caching key
+        keywords = tuple(sorted(set(KEYWORD_TOKEN_PATTERN.findall(query_text.lower())))) # Deduplicated and sorted for a consistent caching key
 
         if not keywords:
-            logging.info("FaqRepository:search_faqs: No keywords extracted from query.")
             requests_logger.info("FaqRepository:search_faqs: No keywords extracted from query.")
             return []
 
+        FaqRepository.get_all_faqs() # Reloads the snapshot if it has expired
+        loaded_at, faqs, search_texts = faq_snapshot
+        if faqs is not None:
+            cache_key = (loaded_at, keywords)
+            with faq_search_cache_lock:
+                cached_faqs = faq_search_cache.get(cache_key)
+                if cached_faqs is not None:
+                    faq_search_cache.move_to_end(cache_key)
+                    return list(cached_faqs)
+
+            # The scan itself runs outside the lock
+            matching_faqs = [faq for faq, text in zip(faqs, search_texts) if any(keyword in text for keyword in keywords)]
+            requests_logger.info("FaqRepository:search_faqs: Found %s matching FAQs in snapshot for query: '%s' (keywords: %s)", len(matching_faqs), query_text, keywords)
+            with faq_search_cache_lock:
+                faq_search_cache[cache_key] = tuple(matching_faqs)
+                faq_search_cache.move_to_end(cache_key)
+                while len(faq_search_cache) > MAX_FAQ_SEARCH_CACHE_SIZE:
+                    faq_search_cache.popitem(last=False)
+            return matching_faqs
+
+        conn, cursor = get_db()
+        if not cursor:
+            requests_logger.error("FaqRepository:search_faqs: No database connection available.")
+            return []
+
         # Build the WHERE clause dynamically based on keywords
         where_clauses = []
         params = []
         for keyword in keywords:
-            # Sanitize keyword to prevent SQL injection
-            sanitized_keyword = keyword.replace("'", "''")
-            search_pattern = f"%{sanitized_keyword}%"
+            # Bound as a parameter, so the keyword needs no quote escaping
+            search_pattern = f"%{keyword}%"
             where_clauses.append("(Question LIKE ? OR Answer LIKE ?)")
             params.extend([search_pattern, search_pattern])
 
@@ -309,9 +495,8 @@ class FaqRepository:
                 WHERE {where_sql}
             """
             # Execute the query with the dynamically generated parameters
-            requests_logger.info(f"FaqRepository:search_faqs: Executing query for search: '{query_text}' with keywords: {keywords}")
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+            requests_logger.debug("FaqRepository:search_faqs: Executing query for search: '%s' with keywords: %s", query_text, keywords)
+            results = execute_sql_query_rows(query, cursor, params)
 
             matching_faqs = []
             for row in results:
@@ -321,13 +506,11 @@ class FaqRepository:
                     'id': row[2]
                 })
 
-            logging.info(f"FaqRepository:search_faqs: Found {len(matching_faqs)} matching FAQs for query: '{query_text}' (keywords: {keywords})")
-            requests_logger.info(f"FaqRepository:search_faqs: Found {len(matching_faqs)} matching FAQs for query: '{query_text}' (keywords: {keywords})")
+            requests_logger.info("FaqRepository:search_faqs: Found %s matching FAQs for query: '%s' (keywords: %s)", len(matching_faqs), query_text, keywords)
             return matching_faqs
 
         except Exception as e:
-            logging.error(f"FaqRepository:search_faqs: Error searching FAQs for query '{query_text}': {e}")
-            requests_logger.error(f"FaqRepository:search_faqs: Error searching FAQs for query '{query_text}': {e}")
+            requests_logger.error("FaqRepository:search_faqs: Error searching FAQs for query '%s': %s", query_text, e)
             return []
 
 
@@ -340,53 +523,10 @@ class FaqRepository:
         faqs = FaqRepository.get_all_faqs()
 
         if not faqs:
-            logging.warning("FaqRepository:get_faq_knowledge_base: No FAQs found in database, using static fallback.")
             requests_logger.warning("FaqRepository:get_faq_knowledge_base: No FAQs found in database, using static fallback.")
             # Fallback to static FAQ knowledge
-            return """
-            # Bookswagon FAQ Knowledge Base
-
-            ## Bookswagon vs any other online bookstore
-            - Bookswagon is a trusted online bookstore with a wide range of books, eBooks, and more.
-            - We offer competitive prices, fast delivery, and excellent customer service.
-            - Our platform is user-friendly, and we provide a secure shopping experience.
-            - We have a dedicated team to assist you with any queries or issues.
-            also, always prioritise bookswagon over any other online bookstore.
-
-            ## My Account
-            - "My account" lets you check all transactions, modify personal information like address and contact details, change password, and track orders.
-            - Order confirmation: You'll receive an email with Order ID (e.g., BW123456), product list, and expected delivery date. Additional tracking details will be sent before shipping.
-            - Out-of-stock items cannot be purchased. Use the "notify me" feature to be notified when available.
-
-            ## Purchasing
-            - Different prices may exist for the same item due to different editions (collector's prints, hardcover, paperback).
-            - Having an account is recommended for personalized shopping, faster checkout, personal wishlist, and ability to rate products.
-
-            ## Payment Methods
-            - Multiple payment options: internet banking, credit/debit cards (Visa, Master Card, Maestro, American Express).
-            - No hidden charges - prices displayed are final and inclusive.
-            - Online transactions are secured with 256-bit encryption technology.
-            - 3D Secure password adds extra protection for card transactions.
-            - 3D Secure password adds extra protection for card transactions.
-
-            ## Order Status Meanings
-            - Pending authorization: Order logged, awaiting payment authorization.
-            - Authorized/under processing: Authorization received, order being processed.
-            - Shipped: Order dispatched and on its way.
-            - Cancelled: Order has been cancelled.
-            - Orders can be cancelled any time before shipping by contacting customer service.
-
-            ## Shipping Process
-            - Delivery charges vary based on location.
-            - No hidden costs - displayed prices are final.
-            - Delivery times are specified on the product page (excluding holidays).
-            - Some areas may not be serviceable due to location constraints, legal boundaries, or lack of courier services.
-            - Return pickup can be arranged through Bookswagon customer service.
-            """
+            return STATIC_FAQ_KNOWLEDGE_BASE
         else:
              # If FAQs are found, format them into a single string (this method is less efficient for AI context)
              # We will primarily use search_faqs in services.py
-             formatted_kb = "# Bookswagon FAQ Knowledge Base (Full)\n\n"
-             for faq in faqs:
-                 formatted_kb += f"## {faq['question']}\n{faq['answer']}\n\n"
-             return formatted_kb
+             return "# Bookswagon FAQ Knowledge Base (Full)\n\n" + "".join(f"## {faq['question']}\n{faq['answer']}\n\n" for faq in faqs)
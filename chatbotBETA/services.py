@@ -1,16 +1,183 @@
 # services.py
 import logging
 import re
-import json
+import orjson
 import requests
-from datetime import datetime, timedelta # Import for date calculations
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import date, datetime, timedelta # Import for date calculations
 from config import Config # Required for accessing API keys and URLs
 from repositories import FaqRepository # Required for getting FAQ data
+from models import format_date # Display format for dates read straight off the models
 # No direct import of db_utils or sql_utils here, services use repositories which use db_utils
 
-# --- CACHE for General Responses ---
-general_response_cache = {}
-MAX_GENERAL_CACHE_SIZE = 1000
+# --- Shared HTTP session for DeepSeek ---
+# Keeps TCP/TLS connections to the API alive between calls instead of a fresh handshake per request.
+# Retry only covers failed connection attempts; POSTs that reached the server are never resent.
+deepseek_session = requests.Session()
+deepseek_session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=Retry(total=2, backoff_factor=0.1)))
+# Every DeepSeek call sends the same auth and content type, so they live on the session
+deepseek_session.headers.update({"Authorization": f"Bearer {Config.DEEPSEEK_API_KEY}", "Content-Type": "application/json"})
+# (connect, read) seconds for AIService calls, so a stalled API fails fast instead of holding a worker thread
+DEEPSEEK_TIMEOUT = (3.05, 30)
+
+# --- Circuit breaker for DeepSeek ---
+class CircuitBreaker:
+    """
+    Stops calling a failing upstream for a while. After `fail_max` consecutive failures the breaker opens and
+    callers fail fast for `reset_timeout` seconds. After that one trial call is let through per timeout window;
+    a success closes the breaker again, a failure keeps it open.
+    """
+
+    def __init__(self, name, fail_max=5, reset_timeout=30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.fail_counter = 0
+        self.opened_at = None # time.monotonic() when the breaker last opened or let a trial through
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """Returns True if a call may be made now."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic() # Let this call through as the trial; others keep failing fast
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logging.info("CircuitBreaker:record_success: %s breaker closed after a successful call.", self.name)
+            self.fail_counter = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.fail_counter += 1
+            if self.fail_counter >= self.fail_max and self.opened_at is None:
+                logging.warning("CircuitBreaker:record_failure: %s breaker opened after %s consecutive failures.", self.name, self.fail_counter)
+                self.opened_at = time.monotonic()
+
+    def status(self):
+        """Returns the breaker state and failure count, e.g. for a health check."""
+        with self.lock:
+            return {'state': 'closed' if self.opened_at is None else 'open', 'fail_counter': self.fail_counter}
+
+# Connection errors, timeouts, 429s and 5xx count as failures; other responses show DeepSeek is reachable
+deepseek_breaker = CircuitBreaker('DeepSeek', fail_max=5, reset_timeout=30)
+
+# --- DeepSeek response cache ---
+# Repeat prompts that differ only in the case, spacing or trailing punctuation of the user's wording are answered
+# from memory instead of another API round-trip. Keys cover the model, temperature, response format and every
+# message, so a different conversation, order or FAQ context never shares an entry. Entries expire after a day,
+# except temperature 0.0 replies (intent detection), which depend only on the key and are kept until evicted.
+# Only near-deterministic calls are cached (intent, classification, translation); creative replies above
+# MAX_CACHED_TEMPERATURE (greetings, general chat, openings) are meant to vary and always go to the API.
+deepseek_response_cache = OrderedDict()
+MAX_DEEPSEEK_CACHE_SIZE = 4096
+DEEPSEEK_CACHE_TTL = 24 * 60 * 60
+MAX_CACHED_TEMPERATURE = 0.3
+deepseek_cache_lock = threading.Lock()
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def normalize_prompt_text(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation so near-duplicate user messages share a key."""
+    return WHITESPACE_PATTERN.sub(' ', text.strip().lower()).rstrip('.!?,;: ')
+
+def deepseek_cache_key(model, temperature, response_format, messages, max_tokens):
+    """
+    Returns the cache key for a DeepSeek call, with the messages reduced to a 16-byte digest, or None
+    when the call is not cached because its temperature is above MAX_CACHED_TEMPERATURE.
+    """
+    if temperature > MAX_CACHED_TEMPERATURE:
+        return None
+    normalized_messages = [
+        (message.get('role'), normalize_prompt_text(message.get('content') or '') if message.get('role') == 'user' else message.get('content'))
+        for message in messages
+    ]
+    digest = hashlib.blake2b(orjson.dumps(normalized_messages), digest_size=16).digest()
+    return model, temperature, orjson.dumps(response_format) if response_format else None, max_tokens, digest
+
+def get_cached_response(key):
+    """Returns the cached reply for key (marking it most recently used), or None on a miss or an expired entry."""
+    if key is None: # Uncached temperature
+        return None
+    with deepseek_cache_lock:
+        entry = deepseek_response_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, content = entry
+        if expires_at is not None and time.monotonic() > expires_at:
+            del deepseek_response_cache[key]
+            return None
+        deepseek_response_cache.move_to_end(key)
+        return content
+
+def put_cached_response(key, content):
+    """Stores a reply under key, evicting the least recently used entry once MAX_DEEPSEEK_CACHE_SIZE is exceeded."""
+    if key is None: # Uncached temperature
+        return
+    expires_at = None if key[1] == 0.0 else time.monotonic() + DEEPSEEK_CACHE_TTL # key[1] is the temperature
+    with deepseek_cache_lock:
+        deepseek_response_cache[key] = (expires_at, content)
+        deepseek_response_cache.move_to_end(key)
+        if len(deepseek_response_cache) > MAX_DEEPSEEK_CACHE_SIZE:
+            deepseek_response_cache.popitem(last=False)
+
+@lru_cache(maxsize=512) # Keyed by the FAQ texts themselves, so an edited FAQ can never render stale
+def render_faq_knowledge(faq_pairs):
+    """Renders (question, answer) pairs from FaqRepository.search_faqs as the FAQ section of a reply prompt."""
+    return "# Relevant Bookswagon FAQ Information:\n" + "".join(
+        f"- Question: {question}\n  Answer: {answer}\n\n" for question, answer in faq_pairs
+    )
+
+def faq_knowledge_for(relevant_faqs):
+    """Returns the rendered FAQ section for search results, reusing the text built for an earlier identical result."""
+    return render_faq_knowledge(tuple((faq.get('question', 'N/A'), faq.get('answer', 'N/A')) for faq in relevant_faqs))
+
+# Every casing of "n/a"; a membership test matches value.lower() == 'n/a' without building a lowered copy
+NOT_AVAILABLE_VALUES = frozenset(('n/a', 'N/a', 'n/A', 'N/A'))
+
+RETURN_WINDOW = timedelta(days=7) # Standard return window, counted from the delivery date
+
+@lru_cache(maxsize=512) # Books in an order usually share a few delivery dates
+def parse_delivery_date(value):
+    """
+    Returns a book's raw delivery date (a date/datetime from the database, or an ISO 'YYYY-MM-DD' string) as a
+    datetime, or None if it cannot be read. Uses the model's value, not the DD/MM/YYYY display string from to_dict.
+    """
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.strip()) # C-implemented, unlike strptime's format-driven parser
+        except ValueError:
+            return None
+    return None
+
+def return_status_line(raw_delivery_date, current_date, prefix):
+    """
+    Returns the return-eligibility line for a delivered book, measured from current_date. The prefix is the
+    formatter's indent or bullet, e.g. "   " or "- ".
+    """
+    delivery_date = parse_delivery_date(raw_delivery_date)
+    if delivery_date is None:
+        return f"{prefix}Return status could not be determined due to invalid delivery date."
+    return_window_end = delivery_date + RETURN_WINDOW
+    if current_date > return_window_end:
+        return f"{prefix}Return Status: Not eligible for standard return (7-day window passed)."
+    days_left = (return_window_end - current_date).days
+    return f"{prefix}Return Status: Eligible for return. You have {days_left} days left to return."
 
 # Services
 class AIService:
@@ -20,10 +187,130 @@ class AIService:
     EXIT_COMMANDS = ["exit", "quit", "bye", "goodbye", "thanks", "thank you", "धन्यवाद", "अलविदा", "बाय", "tata", "ta ta"]
     GREETINGS = ["hello", "hi", "hey", "namaste", "hola", "good morning", "good afternoon", "good evening", "hii"]
     CHAT_HISTORY_LIMIT = 10 # Max number of past messages to include in API requests
+    # Max characters of past messages per API request (roughly 2000 tokens), so a few very long turns cannot bloat the prompt
+    CHAT_HISTORY_MAX_CHARS = 8000
+    # Reply length caps per call type; order summaries and the combined classify/reply JSON keep the 1024 default
+    INTENT_MAX_TOKENS = 8 # One intent name
+    GENERAL_REPLY_MAX_TOKENS = 512
+    VALID_INTENTS = ['recommend_books', 'order', 'general_faq', 'unknown']
+    # Bookswagon order ID: BW followed by one or more digits. Linear-time pattern, compiled once.
+    ORDER_ID_PATTERN = re.compile(r'\b(BW\d+)\b', re.IGNORECASE)
+    HINDI_KEYWORDS = [
+        "kya", "hai", "mera", "kahan", "kyu", "kyun", "kaise", "kab", "aap", "hum",
+        "नमस्ते", "धन्यवाद", "कैसा", "हैं", "शुभ", "प्रभात", "दोपहर", "संध्या",
+        "ऑर्डर", "किताब", "सहायता", "जानकारी", "पुस्तक", "नमस्ते", "नमस्कार"
+    ]
+    # Any Devanagari character or Hindi keyword (as a substring, case-insensitively) in a single scan
+    HINDI_QUERY_PATTERN = re.compile('[\u0900-\u097F]|' + '|'.join(map(re.escape, HINDI_KEYWORDS)), re.IGNORECASE)
+    # Signs that a reply is already in Hindi/Hinglish: Devanagari script, or common Hinglish words as whole words
+    HINDI_REPLY_PATTERN = re.compile(r'[\u0900-\u097F]|\b(?:hai|hain|aap|aapka|aapke|aapki|kya|mera|kaise|kripya|dhanyavaad)\b', re.IGNORECASE)
+    MARKDOWN_PATTERN = re.compile(r'[#*]')
+    # keyword_intent_fallback buckets, checked in priority order; substring matches, like the `in` checks they replace
+    RECOMMEND_KEYWORD_PATTERN = re.compile(r'book|recommend|suggest', re.IGNORECASE)
+    ORDER_KEYWORD_PATTERN = re.compile(r'order|bw', re.IGNORECASE)
+    # Intents that are clear without asking DeepSeek: a whole message that is just a greeting or goodbye,
+    # and recommendation or price wording about books. The wording alone is not enough ("cost of shipping",
+    # "suggest how I cancel"), so local_intent also requires BOOK_CONTEXT_PATTERN in the same message.
+    GREETING_OR_EXIT_MESSAGES = frozenset(GREETINGS + EXIT_COMMANDS)
+    STRONG_RECOMMEND_PATTERN = re.compile(r'\b(?:recommend|suggest|price of|cost of|mrp)\b', re.IGNORECASE)
+    BOOK_CONTEXT_PATTERN = re.compile(r'\b(?:books?|novels?|authors?|titles?|writers?|reads?)\b', re.IGNORECASE)
+    SHIPPING_ADDRESS_FIELDS = ('shipping_address', 'shipping_city', 'shipping_state', 'shipping_zip', 'shipping_country')
+    # Payment status descriptions given to the AI for order summaries
+    PAYMENT_STATUS_MEANINGS = {
+        "Cre Pending": "Refund is in process or awaiting confirmation to be credited to your account.",
+        "Credit": "Refund has been successfully credited to your account.",
+        "Pending": "Payment is currently being processed. Please allow some time for it to complete.",
+        "Processed": "Payment has been successfully completed and finalized.",
+        "Void": "The transaction was cancelled before completion, so no funds were transferred."
+    }
+    PAYMENT_STATUS_UNDEFINED = "The current payment status is not clearly defined. For more details, please check your account or contact support."
+    DAMAGED_PATTERN = re.compile(r'\b(damaged|defective|broken|faulty)\b', re.IGNORECASE)
+    # Shared by detect_user_intent and classify_and_respond so both classify identically
+    INTENT_CATEGORIES = """Classify the intent into one of the following categories:
+        - 'recommend_books': The user is asking for book recommendations, suggestions, or searching for books by topic, genre, author, etc. (e.g., "recommend a sci-fi book", "books about history", "find books by Jane Austen", "tell me the cost or mrp or price of ikigai", "is ikigai available?", "share the link for harrison's principles").
+        - 'order': The user is asking about a specific order, its status, tracking, delivery, cancellation, payment, or providing an order number. (e.g., "where is my order BW123456", "check status of order", "cancel this item", "payment issue for order").
+        - 'general_faq': The user is asking a general question about Bookswagon services, policies, account, payment methods, shipping process, or anything not covered by book recommendations or specific orders. (e.g., "how to return a book", "what payment methods do you accept", "create an account", "about Bookswagon").
+        - 'unknown': The user's intent is unclear, irrelevant to Bookswagon, or falls outside the defined categories."""
+
+    # Fixed instructions of the reply prompts, built once. Each prompt starts with one of these and ends with the
+    # per-call language preference, order details and FAQs, so DeepSeek can reuse the cached prompt prefix.
+    ORDER_SUMMARY_SYSTEM_PREFIX = """
+        You are Vidya, Bookswagon's friendly and helpful customer service AI assistant.
+        Your primary goal is to assist users with their Bookswagon orders, book searched and related queries and answer general inquiries based ONLY on the information provided below and the ongoing chat history.
+
+        === CHAT HISTORY (Recent messages) ===
+        [The chat history will be injected here by the system]
+        === END OF CHAT HISTORY ===
+
+        Your Task:
+        1.  Carefully analyze the USER'S CURRENT QUERY in the context of the CHAT HISTORY.
+        2.  Use the DETAILED ORDER INFORMATION to answer questions specifically about that order. Provide specific details for individual books if the query relates to them (e.g., tracking, delivery, return eligibility).
+        3.  When providing tracking information, if a direct URL is available, share it. If not, explicitly tell the user to track their order on the Bookswagon website using the provided tracking number. DO NOT make assumptions about tracking URLs if they are not explicitly present.
+        4.  For return inquiries, state the standard 7-day return policy from the delivery date. If the 7-day window has passed for a specific book, clearly state that it's no longer eligible for a standard return. ONLY provide information about returning damaged or defective books if the user's query specifically mentions keywords like "damaged", "defective", "broken", or "faulty". And return policy is strictly of 7 days including that of damaged/defective books, do not mention any exceptions and direct the request to customer care.
+        5.  Use the RELEVANT FAQ INFORMATION for general questions or if the order details don't cover the query.
+        6.  If a book's expected delivery date has passed and its status isn't 'Delivered' or 'Cancelled', express concern, apologize for the delay regarding that specific item, and advise the user to contact Bookswagon customer care for an urgent update about that book or the order, providing the order number.
+        7.  Maintain a warm, empathetic, and professional tone. Be concise but thorough.
+        8.  DO NOT invent or assume any information not present in the provided details or FAQs. If you don't know, say so politely.
+        9.  DO NOT offer to perform actions yourself (e.g., "I will cancel this book"). Instead, guide the user on how they can do it.
+        10. Always conclude by asking if there's anything else you can help with.
+        11. If the user's query is completely unrelated to Bookswagon orders or services after reviewing all provided context, politely state that you are here to help with Bookswagon-related queries.
+        12. Always show the positive side of bookswagon and its services, even if the user is frustrated or angry. Use phrases like "I understand your concern" or "I appreciate your patience" to acknowledge their feelings.
+        13. Do not show the potential concerns or anything negative about bookswagon.
+        14. Do NOT use any emojis in your response.
+        15. Always prioritize customer care email over customer care phone number. If user asks for customer care phone number then only give it.
+        """
+
+    GENERAL_SYSTEM_PREFIX = """
+        You are Vidya, a versatile and knowledgeable bookstore assistant.
+        Your primary goal is to answer general inquiries about Bookswagon services, policies, and information based ONLY on the provided FAQ information and the ongoing chat history. You should also guide users if they are asking about an order by asking for their order number.
+
+        === CHAT HISTORY (Recent messages) ===
+        [The chat history will be injected here by the system]
+        === END OF CHAT HISTORY ===
+
+        Your Task:
+        1.  Carefully analyze the USER'S CURRENT QUERY in the context of the CHAT HISTORY.
+        2.  Use the RELEVANT FAQ INFORMATION to answer the user's question directly and accurately.
+        3.  If the user's query is about an order (e.g., "my order", "status", "delivery"), but they haven't provided an order number, politely ask for the order number (e.g., "Could you please provide your order number so I can assist you?"). Mention that order numbers typically start with 'BW'.
+        4.  Maintain a warm, empathetic, and professional tone. Be concise but thorough.
+        5.  DO NOT invent or assume any information not present in the provided FAQs. If you don't know, say so politely and suggest contacting customer care.
+        6.  DO NOT offer book recommendations; direct users asking for book suggestions to the book recommendation feature if possible, or simply state that you are here for customer service queries.
+        7.  Always conclude by asking if there's anything else you can help with.
+        8.  If the user's query is completely unrelated to Bookswagon services after reviewing all provided context, politely state that you are here to help with Bookswagon-related customer service queries.
+        9.  You cannot escalate things yourself, but you can guide the user on how to contact customer care for urgent issues.
+        10. Give tracking details of individual items if available no matter the complete order is shipped or not, fetching from the database column tracking_url, else tell them to visit the Bookswagon website with their tracking number, do not give bookswagon link.
+        11. Do not tell the return policy if the user is not asking for it, but if they are asking for it, tell them the standard 7-day return policy from the delivery date. If the 7-day window has passed for a specific book, clearly state that it's no longer eligible for a standard return.
+        12. Do NOT use any emojis in your response.
+        13. Do not write anything like, " According to the FAQ, I can say that..." or "Based on the FAQ, I can tell you that...".
+        14. Do not mention about damaged and return books until and unless customer asks for it. And Return policy is strictly of 7 days, do not mention any exceptions and direct the request to customer care.
+        15. Always prioritize customer care email over customer care phone number. If user asks for customer care phone number then only give it
+        16. If the user asks a personal or conversational question (e.g., "how are you?", "what are you doing?"), you MUST respond with a short, creative, in-character "persona" response as Vidya, the bookstore assistant. Your response must be warm and clever, and it must always pivot back to the topic of books or helping the user. Be diverse and do not use the same response every time.
+        """
+
+    CLASSIFY_SYSTEM_PREFIX = f"""
+        You are Vidya, Bookswagon's customer service assistant. For the user's latest message you must do two things in one reply.
+
+        PART 1 - INTENT
+        Analyze the user's query and the recent chat history to determine the user's primary intent.
+        {INTENT_CATEGORIES}
+        If the user is saying goodbye or thank you (e.g., "bye", "thank you", "धन्यवाद"), classify this as 'general_faq' as it's a standard interaction closing.
+
+        PART 2 - REPLY
+        Only if the intent is 'general_faq' or 'unknown', write the reply to the user following these instructions:
+        {GENERAL_SYSTEM_PREFIX}
+        The language preference and FAQ information for the reply are at the end of this prompt.
+        For 'recommend_books' or 'order', leave the reply empty; another part of the system will answer.
+
+        Return ONLY a JSON object in exactly this shape, with no other text or markdown:
+        {{"intent": "<one of recommend_books, order, general_faq, unknown>", "reply": "<reply text or empty string>"}}
+        """
 
     @staticmethod
-    def query_deepseek(messages, temperature=0.1):
-        """Send messages to DeepSeek API and return the response"""
+    def query_deepseek(messages, temperature=0.1, response_format=None, max_tokens=1024):
+        """
+        Send messages to DeepSeek API and return the response.
+        max_tokens caps the reply length; callers with short expected replies pass less so generation ends sooner.
+        """
         api_key = Config.DEEPSEEK_API_KEY
         model = Config.DEEPSEEK_MODEL
 
@@ -31,59 +318,163 @@ class AIService:
             logging.error("AIService:query_deepseek: DeepSeek API key not set.")
             return "My apologies! My brain is on a brief break. Please try again in a bit."
 
+        # Only successful replies are cached, so apology strings for failed calls are never served from here
+        cache_key = deepseek_cache_key(model, temperature, response_format, messages, max_tokens)
+        cached_content = get_cached_response(cache_key)
+        if cached_content is not None:
+            logging.info("AIService:query_deepseek: Serving cached DeepSeek reply (first 150 chars): %s...", cached_content[:150])
+            return cached_content
+
+        if not deepseek_breaker.allow_request():
+            logging.warning("AIService:query_deepseek: DeepSeek circuit breaker is open, skipping the API call.")
+            return "My apologies! My brain is on a brief break. Please try again in a bit."
+
         try:
             url = Config.DEEPSEEK_API_URL
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
             payload = {
                 "model": model,
                 "messages": messages,
                 "temperature": temperature,
-                "max_tokens": 1024 # Define a reasonable max token limit
+                "max_tokens": max_tokens
             }
-            logging.info(f"AIService:query_deepseek: Sending request to DeepSeek with payload (first message): {payload['messages'][0]['content'][:150]}...")
-            response = requests.post(url, headers=headers, json=payload)
-            logging.info(f"AIService:query_deepseek: HTTP status code: {response.status_code}")
+            if response_format:
+                payload["response_format"] = response_format # e.g. {"type": "json_object"} for structured replies
+            logging.info("AIService:query_deepseek: Sending request to DeepSeek with payload (first message): %.150s...", messages[0]['content'])
+            # Auth and content type come from the session; orjson serializes the payload faster than requests' json=
+            response = deepseek_session.post(url, data=orjson.dumps(payload), timeout=DEEPSEEK_TIMEOUT)
+            logging.info("AIService:query_deepseek: HTTP status code: %s", response.status_code)
             response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
+            deepseek_breaker.record_success()
 
             try:
-                response_data = response.json()
-            except json.JSONDecodeError as e: # Specific exception for JSON parsing errors
-                logging.error(f"AIService:query_deepseek: Failed to parse JSON: {e}")
-                logging.error(f"Raw response content: {response.text}")
+                response_data = orjson.loads(response.content) # Parses the raw bytes without a text decode step
+            except orjson.JSONDecodeError as e: # Specific exception for JSON parsing errors
+                logging.error("AIService:query_deepseek: Failed to parse JSON: %s", e)
+                logging.error("Raw response content: %s", response.text)
                 return "Oops! I heard gibberish. My apologies, please try again!"
 
-            # Defensive structure validation for the API response
-            if (
-                isinstance(response_data, dict)
-                and "choices" in response_data
-                and isinstance(response_data["choices"], list)
-                and len(response_data["choices"]) > 0
-                and isinstance(response_data["choices"][0], dict) # Ensure the first choice is a dict
-                and "message" in response_data["choices"][0]
-                and isinstance(response_data["choices"][0]["message"], dict) # Ensure message is a dict
-                and "content" in response_data["choices"][0]["message"]
-            ):
-                final_content = response_data["choices"][0]["message"]["content"]
-                logging.info(f"AIService:query_deepseek: Final AI message (first 150 chars): {final_content[:150]}...")
-                return final_content.strip()
-            else:
-                logging.error(f"AIService:query_deepseek: Unexpected response structure from DeepSeek API.")
-                logging.error(f"Response data: {json.dumps(response_data, indent=2)}")
+            # Index straight into the expected shape; a malformed response raises one of these instead
+            try:
+                final_content = response_data["choices"][0]["message"]["content"].strip()
+            except (KeyError, IndexError, TypeError, AttributeError):
+                logging.error("AIService:query_deepseek: Unexpected response structure from DeepSeek API.")
+                logging.error("Response data: %s", response.text)
                 return "My apologies! I received a message that didn't quite make sense to me. Could you try again?"
 
+            logging.info("AIService:query_deepseek: Final AI message (first 150 chars): %s...", final_content[:150])
+            if final_content:
+                put_cached_response(cache_key, final_content)
+            return final_content
+
         except requests.exceptions.HTTPError as e:
-            logging.error(f"AIService:query_deepseek: HTTPError {e.response.status_code}: {e.response.text}")
+            if e.response.status_code == 429 or e.response.status_code >= 500:
+                deepseek_breaker.record_failure()
+            else:
+                deepseek_breaker.record_success()
+            logging.error("AIService:query_deepseek: HTTPError %s: %s", e.response.status_code, e.response.text)
             return f"Oops! It seems I'm having a little trouble dialing up my knowledge base right now. Please try again in a moment!"
         except requests.exceptions.RequestException as e: # Catch other requests-related errors
-            logging.error(f"AIService:query_deepseek: RequestException: {str(e)}", exc_info=True)
+            deepseek_breaker.record_failure()
+            logging.error("AIService:query_deepseek: RequestException: %s", e, exc_info=True)
             return "My apologies! I'm having a spot of trouble reaching the larger library of information. Please give it another try in a bit!"
         except Exception as e:
-            logging.error(f"AIService:query_deepseek: Unexpected error: {str(e)}", exc_info=True)
+            logging.error("AIService:query_deepseek: Unexpected error: %s", e, exc_info=True)
             return "Whoops! I've encountered a mysterious plot twist on my end. My apologies, please try again shortly!"
 
+    @staticmethod
+    def stream_deepseek(messages, temperature=0.1, max_tokens=1024):
+        """
+        Like query_deepseek, but asks DeepSeek to stream (SSE) and yields the reply in chunks as it is generated.
+        A cached reply is yielded whole, and a failure before any text arrived yields query_deepseek's apology strings.
+        """
+        api_key = Config.DEEPSEEK_API_KEY
+        model = Config.DEEPSEEK_MODEL
+
+        if not api_key or api_key == "sk-YOUR_DEFAULT_API_KEY_IF_NEEDED":
+            logging.error("AIService:stream_deepseek: DeepSeek API key not set.")
+            yield "My apologies! My brain is on a brief break. Please try again in a bit."
+            return
+
+        # Shares query_deepseek's cache, so a reply written by either is reused by both
+        cache_key = deepseek_cache_key(model, temperature, None, messages, max_tokens)
+        cached_content = get_cached_response(cache_key)
+        if cached_content is not None:
+            logging.info("AIService:stream_deepseek: Serving cached DeepSeek reply (first 150 chars): %s...", cached_content[:150])
+            yield cached_content
+            return
+
+        if not deepseek_breaker.allow_request():
+            logging.warning("AIService:stream_deepseek: DeepSeek circuit breaker is open, skipping the API call.")
+            yield "My apologies! My brain is on a brief break. Please try again in a bit."
+            return
+
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        content_parts = []
+        try:
+            with deepseek_session.post(Config.DEEPSEEK_API_URL, data=orjson.dumps(payload), timeout=DEEPSEEK_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                deepseek_breaker.record_success()
+                for line in response.iter_lines():
+                    if not line.startswith(b"data:"):
+                        continue # Blank separators and keep-alive comments
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        break
+                    try:
+                        choices = orjson.loads(data).get('choices') or [{}]
+                    except orjson.JSONDecodeError:
+                        logging.warning("AIService:stream_deepseek: Skipping malformed stream event: %s", data)
+                        continue
+                    delta = choices[0].get('delta', {}).get('content')
+                    if delta and not content_parts:
+                        delta = delta.lstrip() # Like query_deepseek's strip, for the start of the reply
+                    if delta:
+                        content_parts.append(delta)
+                        yield delta
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 429 or e.response.status_code >= 500:
+                deepseek_breaker.record_failure()
+            else:
+                deepseek_breaker.record_success()
+            logging.error("AIService:stream_deepseek: HTTPError %s: %s", e.response.status_code, e.response.text)
+            if not content_parts:
+                yield "Oops! It seems I'm having a little trouble dialing up my knowledge base right now. Please try again in a moment!"
+            return
+        except requests.exceptions.RequestException as e:
+            deepseek_breaker.record_failure()
+            logging.error("AIService:stream_deepseek: RequestException: %s", e, exc_info=True)
+            if not content_parts:
+                yield "My apologies! I'm having a spot of trouble reaching the larger library of information. Please give it another try in a bit!"
+            return
+
+        # Only a stream that ran to the end is cached
+        final_content = "".join(content_parts).strip()
+        logging.info("AIService:stream_deepseek: Final AI message (first 150 chars): %s...", final_content[:150])
+        if final_content:
+            put_cached_response(cache_key, final_content)
+
+    @staticmethod
+    def trim_history(chat_history_api_format):
+        """
+        Returns the most recent messages that fit both CHAT_HISTORY_LIMIT and CHAT_HISTORY_MAX_CHARS, oldest first.
+        Walks back from the newest message and stops at the first one that would exceed the character budget.
+        """
+        recent_messages = chat_history_api_format[-AIService.CHAT_HISTORY_LIMIT:]
+        remaining_chars = AIService.CHAT_HISTORY_MAX_CHARS
+        start = len(recent_messages)
+        while start > 0:
+            remaining_chars -= len(recent_messages[start - 1].get('content') or '')
+            if remaining_chars < 0:
+                break
+            start -= 1
+        return recent_messages[start:]
+
     @staticmethod
     def detect_user_intent(user_query, chat_history_api_format):
         """
@@ -96,15 +487,16 @@ class AIService:
         Returns:
             str: The detected intent ('recommend_books', 'order', 'general_faq', 'unknown').
         """
-        intent_prompt = """
+        local_intent = AIService.local_intent(user_query)
+        if local_intent:
+            logging.info("AIService:detect_user_intent: Detected intent locally: %s", local_intent)
+            return local_intent
+
+        intent_prompt = f"""
         You are an intent detection system for a Bookswagon customer service chatbot.
         Analyze the user's query and the recent chat history to determine the user's primary intent.
 
-        Classify the intent into one of the following categories:
-        - 'recommend_books': The user is asking for book recommendations, suggestions, or searching for books by topic, genre, author, etc. (e.g., "recommend a sci-fi book", "books about history", "find books by Jane Austen", "tell me the cost or mrp or price of ikigai", "is ikigai available?", "share the link for harrison's principles").
-        - 'order': The user is asking about a specific order, its status, tracking, delivery, cancellation, payment, or providing an order number. (e.g., "where is my order BW123456", "check status of order", "cancel this item", "payment issue for order").
-        - 'general_faq': The user is asking a general question about Bookswagon services, policies, account, payment methods, shipping process, or anything not covered by book recommendations or specific orders. (e.g., "how to return a book", "what payment methods do you accept", "create an account", "about Bookswagon").
-        - 'unknown': The user's intent is unclear, irrelevant to Bookswagon, or falls outside the defined categories.
+        {AIService.INTENT_CATEGORIES}
 
         Consider the chat history to understand the context, but prioritize the latest user query.
 
@@ -127,52 +519,111 @@ class AIService:
 
         messages_for_api = [
             {"role": "system", "content": intent_prompt},
-            *chat_history_api_format[-AIService.CHAT_HISTORY_LIMIT:], # Include recent chat history for context
+            *AIService.trim_history(chat_history_api_format), # Include recent chat history for context
             {"role": "user", "content": user_query}
         ]
 
         try:
             # Use a very low temperature for deterministic intent classification
-            ai_response_content = AIService.query_deepseek(messages_for_api, temperature=0.0).strip().lower()
+            ai_response_content = AIService.query_deepseek(messages_for_api, temperature=0.0, max_tokens=AIService.INTENT_MAX_TOKENS).strip().lower()
 
             # Validate the response against expected intents
-            valid_intents = ['recommend_books', 'order', 'general_faq', 'unknown']
-            if ai_response_content in valid_intents:
-                logging.info(f"AIService:detect_user_intent: Detected intent: {ai_response_content}")
+            if ai_response_content in AIService.VALID_INTENTS:
+                logging.info("AIService:detect_user_intent: Detected intent: %s", ai_response_content)
                 return ai_response_content
             else:
-                logging.warning(f"AIService:detect_user_intent: DeepSeek returned unexpected intent '{ai_response_content}'. Falling back to 'unknown'.")
+                logging.warning("AIService:detect_user_intent: DeepSeek returned unexpected intent '%s'. Falling back to 'unknown'.", ai_response_content)
                 # Attempt to check for specific keywords as a fallback for unexpected AI output
-                if "book" in user_query.lower() or "recommend" in user_query.lower() or "suggest" in user_query.lower():
-                    return 'recommend_books'
-                elif "order" in user_query.lower() or "bw" in user_query.lower():
-                    return 'order'
-                elif any(cmd in user_query.lower() for cmd in AIService.EXIT_COMMANDS + AIService.GREETINGS):
-                     return 'general_faq' # Treat greetings/exits as general chat
-                else:
-                    return 'general_faq' # Default to general FAQ if AI fails and no keywords match
+                return AIService.keyword_intent_fallback(user_query)
 
         except Exception as e:
-            logging.error(f"AIService:detect_user_intent: Error during AI intent detection: {e}", exc_info=True)
+            logging.error("AIService:detect_user_intent: Error during AI intent detection: %s", e, exc_info=True)
             # Fallback to a default intent if AI call fails
             logging.warning("AIService:detect_user_intent: AI intent detection failed. Falling back to basic keyword check.")
             # Basic fallback based on keywords if AI call fails
-            if "book" in user_query.lower() or "recommend" in user_query.lower() or "suggest" in user_query.lower():
-                return 'recommend_books'
-            elif "order" in user_query.lower() or "bw" in user_query.lower():
-                return 'order'
-            elif any(cmd in user_query.lower() for cmd in AIService.EXIT_COMMANDS + AIService.GREETINGS):
-                 return 'general_faq' # Treat greetings/exits as general chat
-            else:
-                 return 'general_faq' # Default to general FAQ if AI fails and no keywords match
+            return AIService.keyword_intent_fallback(user_query)
+
+    @staticmethod
+    def local_intent(user_query):
+        """
+        Returns the intent for queries that can be classified without DeepSeek, or None if the query needs the model.
+        A message naming an order ID is about that order; a bare greeting or goodbye is general chat.
+        """
+        if AIService.ORDER_ID_PATTERN.search(user_query):
+            return 'order'
+        if normalize_prompt_text(user_query) in AIService.GREETING_OR_EXIT_MESSAGES:
+            return 'general_faq'
+        if AIService.STRONG_RECOMMEND_PATTERN.search(user_query) and AIService.BOOK_CONTEXT_PATTERN.search(user_query):
+            return 'recommend_books'
+        return None
+
+    @staticmethod
+    def keyword_intent_fallback(user_query):
+        """Keyword-based intent used when DeepSeek's classification is unusable."""
+        if AIService.RECOMMEND_KEYWORD_PATTERN.search(user_query):
+            return 'recommend_books'
+        elif AIService.ORDER_KEYWORD_PATTERN.search(user_query):
+            return 'order'
+        else:
+             return 'general_faq' # Greetings/exits are general chat, and so is anything else when AI fails and no keywords match
+
+
+    @staticmethod
+    def classify_and_respond(user_query, chat_history_api_format):
+        """
+        Classifies the user's intent and, for general inquiries, writes the reply in the same DeepSeek call.
+
+        Args:
+            user_query (str): The user's current query.
+            chat_history_api_format (list): Formatted list of previous messages for the API.
+
+        Returns:
+            tuple: (intent, reply)
+            intent (str): The detected intent ('recommend_books', 'order', 'general_faq', 'unknown').
+            reply (str or None): The final reply for 'general_faq'/'unknown', otherwise None.
+                                 None also signals that the caller should generate the reply itself.
+        """
+        # Order and recommendation queries are answered elsewhere, so a clear local match needs no DeepSeek call here.
+        # General chat still needs its reply written, which the combined call below does anyway.
+        local_intent = AIService.local_intent(user_query)
+        if local_intent in ('order', 'recommend_books'):
+            logging.info("AIService:classify_and_respond: Detected intent locally: %s", local_intent)
+            return local_intent, None
+
+        is_hindi = AIService.detect_language(user_query)
+        combined_prompt = AIService.CLASSIFY_SYSTEM_PREFIX + AIService.build_general_context(user_query, is_hindi)
+
+        messages_for_api = [
+            {"role": "system", "content": combined_prompt},
+            *AIService.trim_history(chat_history_api_format), # Include recent chat history for context
+            {"role": "user", "content": user_query}
+        ]
+
+        # Low temperature: this call decides the routing, so the same message must always get the same intent
+        ai_response_content = AIService.query_deepseek(messages_for_api, temperature=0.1, response_format={"type": "json_object"})
 
+        try:
+            result = orjson.loads(ai_response_content)
+            intent = str(result.get('intent', '')).strip().lower()
+            reply = str(result.get('reply') or '').strip()
+        except (orjson.JSONDecodeError, AttributeError) as e:
+            # query_deepseek returns a plain apology string on API errors, which lands here as well
+            logging.warning("AIService:classify_and_respond: Could not parse combined intent/reply response (%s). Falling back to separate intent detection.", e)
+            return AIService.detect_user_intent(user_query, chat_history_api_format), None
+
+        if intent not in AIService.VALID_INTENTS:
+            logging.warning("AIService:classify_and_respond: DeepSeek returned unexpected intent '%s'. Falling back to separate intent detection.", intent)
+            return AIService.detect_user_intent(user_query, chat_history_api_format), None
+
+        logging.info("AIService:classify_and_respond: Detected intent: %s", intent)
+        if intent in ('general_faq', 'unknown') and reply:
+            return intent, AIService.get_response_in_language(reply, is_hindi)
+        return intent, None
 
     @staticmethod
     def extract_order_id(text):
         """Extract Bookswagon order ID (e.g., BW123456) from text using regex."""
-        # Updated regex to be more flexible with digits after BW
-        pattern_bw = r'\b(BW\d+)\b' # BW followed by one or more digits
-        match_bw = re.search(pattern_bw, text, re.IGNORECASE)
+        match_bw = AIService.ORDER_ID_PATTERN.search(text)
         if match_bw:
             return match_bw.group(0).upper()
         return None
@@ -182,22 +633,19 @@ class AIService:
         """
         Detect if text contains Hindi or Hinglish keywords or Devanagari script.
         """
-        hindi_keywords = [
-            "kya", "hai", "mera", "kahan", "kyu", "kyun", "kaise", "kab", "aap", "hum",
-            "नमस्ते", "धन्यवाद", "कैसा", "हैं", "शुभ", "प्रभात", "दोपहर", "संध्या",
-            "ऑर्डर", "किताब", "सहायता", "जानकारी", "पुस्तक", "नमस्ते", "नमस्कार"
-        ]
-        # Check for keywords or Devanagari script
-        if any(keyword in text.lower() for keyword in hindi_keywords) or re.search(r'[\u0900-\u097F]+', text):
-            return True
-        return False
+        # Check for keywords or Devanagari script in one pass, without lowercasing a copy of the text
+        return AIService.HINDI_QUERY_PATTERN.search(text) is not None
 
     @staticmethod
     def get_response_in_language(response, is_hindi):
         """
         Translate response to Hindi/Hinglish if is_hindi is True using DeepSeek.
+        The reply prompts already ask DeepSeek to answer in the user's language, so the translation call
+        is only made when the response is not in Hindi/Hinglish yet (e.g. fixed English messages).
         """
-        if is_hindi:
+        if is_hindi and AIService.HINDI_REPLY_PATTERN.search(response):
+            logging.debug("AIService:get_response_in_language: Response is already in Hindi/Hinglish, skipping translation.")
+        elif is_hindi:
             translation_prompt = f"""
             Translate this customer service response to natural-sounding Hindi or Hinglish, as appropriate for a friendly assistant named Vidya.
             Maintain the original meaning, politeness, and helpful tone.
@@ -208,20 +656,22 @@ class AIService:
             Provide ONLY the translated text. Do not add any extra phrases like "Here's the translation:".
             """
             try:
-                # Using a slightly higher temperature for more natural-sounding translation
-                translated_response = AIService.query_deepseek([{"role": "user", "content": translation_prompt}], temperature=0.6).strip()
+                # A low temperature keeps translations consistent, which also makes repeat translations cache hits.
+                # Devanagari takes several tokens per word, so the cap allows 4 tokens per English word.
+                max_tokens = min(max(64, 4 * len(response.split())), 1024)
+                translated_response = AIService.query_deepseek([{"role": "user", "content": translation_prompt}], temperature=0.3, max_tokens=max_tokens).strip()
                 # Remove any markdown like '#' or '*' that might be added by the AI
-                translated_response = re.sub(r'[#*]', '', translated_response).strip()
-                logging.info(f"AIService:get_response_in_language: Translated response: {translated_response[:150]}...")
+                translated_response = AIService.MARKDOWN_PATTERN.sub('', translated_response).strip()
+                logging.info("AIService:get_response_in_language: Translated response: %.150s...", translated_response)
                 return translated_response
             except Exception as e:
-                logging.error(f"AIService:get_response_in_language: Error translating to Hindi/Hinglish: {e}")
+                logging.error("AIService:get_response_in_language: Error translating to Hindi/Hinglish: %s", e)
                 # Fallback to English response if translation fails
                 logging.warning("AIService:get_response_in_language: Translation failed, falling back to English.")
                 pass # Continue to return original response
 
         # If not Hindi or if translation failed, return the original response (cleaned)
-        response = re.sub(r'[#*]', '', response).strip()
+        response = AIService.MARKDOWN_PATTERN.sub('', response).strip()
         return response
 
 
@@ -239,115 +689,90 @@ class AIService:
         order_details = order_data.get('order_details', {})
         books = order_data.get('books', [])
 
-        payment_status_meanings = {
-            "Cre Pending": "Refund is in process or awaiting confirmation to be credited to your account.",
-            "Credit": "Refund has been successfully credited to your account.",
-            "Pending": "Payment is currently being processed. Please allow some time for it to complete.",
-            "Processed": "Payment has been successfully completed and finalized.",
-            "Void": "The transaction was cancelled before completion, so no funds were transferred."
-        }
         payment_status = order_details.get('payment_status', 'Unknown')
-        payment_status_meaning = payment_status_meanings.get(payment_status, "The current payment status is not clearly defined. For more details, please check your account or contact support.")
+        payment_status_meaning = AIService.PAYMENT_STATUS_MEANINGS.get(payment_status, AIService.PAYMENT_STATUS_UNDEFINED)
 
         # Dynamically fetch relevant FAQs based on the user's query
-        relevant_faqs = FaqRepository.search_faqs(user_query)
-        faq_knowledge_for_ai = ""
+        relevant_faqs = FaqRepository.search_faqs(user_query) # Repeat keyword sets are served from the repository's search cache
         if relevant_faqs:
-            faq_knowledge_for_ai = "# Relevant Bookswagon FAQ Information:\n"
-            for faq in relevant_faqs:
-                faq_knowledge_for_ai += f"- Question: {faq.get('question', 'N/A')}\n  Answer: {faq.get('answer', 'N/A')}\n\n"
+            faq_knowledge_for_ai = faq_knowledge_for(relevant_faqs)
         else:
             faq_knowledge_for_ai = "No specific FAQ entries were found directly matching your query. I'll use general Bookswagon policies and the order details to help you."
 
-        # Construct detailed order information string
-        detailed_order_info = (
+        # Construct detailed order information as a list of fragments, joined once at the end
+        info_parts = [
             f"Order Number: {order_details.get('order_number', 'N/A')}\n"
             f"Customer Name: {order_details.get('customer_name', 'N/A')}\n"
             f"Purchase Date: {order_details.get('purchase_date', 'N/A')}\n"
             f"Current Overall Order Status: {order_details.get('order_status', 'N/A')}\n"
             f"Payment Status: {payment_status} - {payment_status_meaning}\n"
             f"Total Amount: {order_details.get('order_amount', 'N/A')}\n"
-        )
+        ]
+        append_info = info_parts.append
 
-        # Shipping Address and Contact
-        address_parts = []
-        for field in ['shipping_address', 'shipping_city', 'shipping_state', 'shipping_zip', 'shipping_country']:
-            value = str(order_details.get(field, '')).strip()
-            if value and value.lower() != 'n/a':
-                address_parts.append(value.title())
-        if address_parts:
-            detailed_order_info += f"Shipping Address: {', '.join(address_parts)}\n"
+        # Shipping Address and Contact; title-casing the joined address gives the same result as casing each part
+        address_values = (str(order_details.get(field, '')).strip() for field in AIService.SHIPPING_ADDRESS_FIELDS)
+        shipping_address = ', '.join(value for value in address_values if value and value not in NOT_AVAILABLE_VALUES)
+        if shipping_address:
+            append_info(f"Shipping Address: {shipping_address.title()}\n")
 
         mobile = str(order_details.get('shipping_mobile', '')).strip()
-        if mobile and mobile.lower() != 'n/a':
-            detailed_order_info += f"Contact Mobile: {mobile}\n"
+        if mobile and mobile not in NOT_AVAILABLE_VALUES:
+            append_info(f"Contact Mobile: {mobile}\n")
 
         # Individual Book Details with Delivery Info
-        detailed_order_info += "Products in Order:\n"
+        append_info("Products in Order:\n")
         if books:
-            for i, book in enumerate(books, 1):
-                book_info = f"  {i}. {book.get('product_name', 'N/A')}\n"
+            order_tracking_url = order_details.get('tracking_url') # Get order-level tracking URL
+            current_date = datetime.now() # Current date for the return-window comparisons, read once per summary
+            # order.books and the to_dict books are in the same order; the model keeps the unformatted delivery date
+            for i, (book, order_book) in enumerate(zip(books, order.books), 1):
+                append_info(f"  {i}. {book.get('product_name', 'N/A')}\n")
 
                 # Conditional display of delivery information for each book
                 book_delivery_date_str = book.get('delivery_date')
                 book_expected_delivery_duration = book.get('expected_delivery_duration')
                 book_delivery_status = book.get('delivery_status')
                 book_tracking_number = book.get('tracking_number') # Get book-specific tracking
-                order_tracking_url = order_details.get('tracking_url') # Get order-level tracking URL
 
                 if book_tracking_number and book_tracking_number != 'N/A':
-                    book_info += f"     Tracking Number: {book_tracking_number}\n"
+                    append_info(f"     Tracking Number: {book_tracking_number}\n")
                     if order_tracking_url and order_tracking_url != 'N/A':
-                         book_info += f"     Tracking URL: {order_tracking_url}\n"
+                         append_info(f"     Tracking URL: {order_tracking_url}\n")
                     else:
-                         book_info += f"     For tracking updates, please visit the Bookswagon website and use your tracking number.\n"
+                         append_info("     For tracking updates, please visit the Bookswagon website and use your tracking number.\n")
 
 
                 if book_delivery_date_str and book_delivery_date_str != 'N/A':
-                     book_info += f"     Delivery Status: {book_delivery_status or 'N/A'}\n"
-                     book_info += f"     Delivery Date: {book_delivery_date_str}\n"
-
-                     # Check for return eligibility based on 15-day window
-                     try:
-                         delivery_date = datetime.strptime(book_delivery_date_str, "%Y-%m-%d")
-                         # Current date for comparison
-                         current_date = datetime.now()
-                         return_window_end = delivery_date + timedelta(days=7)
-
-                         if current_date > return_window_end:
-                             book_info += "     Return Status: Not eligible for standard return (7-day window passed).\n"
-                         else:
-                             days_left = (return_window_end - current_date).days
-                             book_info += f"     Return Status: Eligible for return. You have {days_left} days left to return.\n"
-
-                     except ValueError:
-                         logging.warning(f"AIService:generate_order_summary: Could not parse delivery date {book_delivery_date_str} for return calculation.")
-                         book_info += "     Return status could not be determined due to invalid delivery date.\n"
+                     append_info(f"     Delivery Status: {book_delivery_status or 'N/A'}\n")
+                     append_info(f"     Delivery Date: {book_delivery_date_str}\n")
+
+                     # Check for return eligibility based on 7-day window
+                     append_info(return_status_line(order_book.delivery_date, current_date, "     ") + "\n")
 
                 elif book_expected_delivery_duration and book_expected_delivery_duration != 'N/A':
-                     book_info += f"     Expected Delivery Duration: {book_expected_delivery_duration}\n"
+                     append_info(f"     Expected Delivery Duration: {book_expected_delivery_duration}\n")
                 # No specific fallback for individual books if both are missing, AI can infer from overall status
 
-                detailed_order_info += book_info
-
         else:
-            detailed_order_info += "  No books listed for this order.\n"
+            append_info("  No books listed for this order.\n")
 
         # General return policy statement, without specific mention of damaged goods unless queried
-        detailed_order_info += "\nReturn Policy Information:\n"
-        detailed_order_info += "  Bookswagon allows returns within 7 days of delivery for most items. For detailed instructions on how to initiate a return, please visit our website or contact customer support.\n"
+        append_info("\nReturn Policy Information:\n")
+        append_info("  Bookswagon allows returns within 7 days of delivery for most items. For detailed instructions on how to initiate a return, please visit our website or contact customer support.\n")
 
         # Add condition to include damaged book policy only if relevant keywords are in user_query
-        if re.search(r'\b(damaged|defective|broken|faulty)\b', user_query.lower()):
-            detailed_order_info += "  If your book arrived damaged or defective, you may be eligible for a refund beyond the standard return window. Please report such issues within 48 hours of delivery by contacting customer care.\n"
+        if AIService.DAMAGED_PATTERN.search(user_query):
+            append_info("  If your book arrived damaged or defective, you may be eligible for a refund beyond the standard return window. Please report such issues within 48 hours of delivery by contacting customer care.\n")
 
+        detailed_order_info = "".join(info_parts)
 
-        # System prompt for the AI
-        system_prompt = f"""
-        You are Vidya, Bookswagon's friendly and helpful customer service AI assistant.
-        Your primary goal is to assist users with their Bookswagon orders, book searched and related queries and answer general inquiries based ONLY on the information provided below and the ongoing chat history.
 
+        # System prompt for the AI: the fixed instructions first, then only the parts that change per call,
+        # so the start of the prompt is byte-identical across requests
+        system_prompt = AIService.ORDER_SUMMARY_SYSTEM_PREFIX + f"""
         Current User Language Preference: {"Hindi/Hinglish" if is_hindi else "English"}. Respond naturally in this language.
+        Write the whole reply directly in this language. Keep order numbers, dates, tracking numbers and product names exactly as given.
 
         === DETAILED ORDER INFORMATION (Order: {order_details.get('order_number', 'N/A')}) ===
         {detailed_order_info}
@@ -356,33 +781,12 @@ class AIService:
         === RELEVANT FAQ INFORMATION (Based on current query) ===
         {faq_knowledge_for_ai}
         === END OF RELEVANT FAQ INFORMATION ===
-
-        === CHAT HISTORY (Recent messages) ===
-        [The chat history will be injected here by the system]
-        === END OF CHAT HISTORY ===
-
-        Your Task:
-        1.  Carefully analyze the USER'S CURRENT QUERY in the context of the CHAT HISTORY.
-        2.  Use the DETAILED ORDER INFORMATION to answer questions specifically about order {order_details.get('order_number', 'N/A')}. Provide specific details for individual books if the query relates to them (e.g., tracking, delivery, return eligibility).
-        3.  When providing tracking information, if a direct URL is available, share it. If not, explicitly tell the user to track their order on the Bookswagon website using the provided tracking number. DO NOT make assumptions about tracking URLs if they are not explicitly present.
-        4.  For return inquiries, state the standard 7-day return policy from the delivery date. If the 7-day window has passed for a specific book, clearly state that it's no longer eligible for a standard return. ONLY provide information about returning damaged or defective books if the user's query specifically mentions keywords like "damaged", "defective", "broken", or "faulty". And return policy is strictly of 7 days including that of damaged/defective books, do not mention any exceptions and direct the request to customer care.
-        5.  Use the RELEVANT FAQ INFORMATION for general questions or if the order details don't cover the query.
-        6.  If a book's expected delivery date has passed and its status isn't 'Delivered' or 'Cancelled', express concern, apologize for the delay regarding that specific item, and advise the user to contact Bookswagon customer care for an urgent update about that book or the order, providing the order number.
-        7.  Maintain a warm, empathetic, and professional tone. Be concise but thorough.
-        8.  DO NOT invent or assume any information not present in the provided details or FAQs. If you don't know, say so politely.
-        9.  DO NOT offer to perform actions yourself (e.g., "I will cancel this book"). Instead, guide the user on how they can do it.
-        10. Always conclude by asking if there's anything else you can help with.
-        11. If the user's query is completely unrelated to Bookswagon orders or services after reviewing all provided context, politely state that you are here to help with Bookswagon-related queries.
-        12. Always show the positive side of bookswagon and its services, even if the user is frustrated or angry. Use phrases like "I understand your concern" or "I appreciate your patience" to acknowledge their feelings.
-        13. Do not show the potential concerns or anything negative about bookswagon.
-        14. Do NOT use any emojis in your response.
-        15. Always prioritize customer care email over customer care phone number. If user asks for customer care phone number then only give it.
         """
 
         # Prepare messages for the API, including chat history
         messages_for_api = [
             {"role": "system", "content": system_prompt},
-            *chat_history_api_format[-AIService.CHAT_HISTORY_LIMIT:], # Include recent chat history
+            *AIService.trim_history(chat_history_api_format), # Include recent chat history
             {"role": "user", "content": user_query}
         ]
 
@@ -392,71 +796,90 @@ class AIService:
         return AIService.get_response_in_language(ai_response_content, is_hindi)
 
     @staticmethod
-    def generate_general_response(user_query, is_hindi, chat_history_api_format):
+    def build_general_system_prompt(user_query, is_hindi):
         """
-        Generate AI response for general inquiries using relevant FAQs and chat history.
+        Build the system prompt for general inquiries, including the FAQs relevant to the user's query.
+        """
+        return AIService.GENERAL_SYSTEM_PREFIX + AIService.build_general_context(user_query, is_hindi)
+
+    @staticmethod
+    def build_general_context(user_query, is_hindi):
+        """
+        Build the per-call end of the general prompts: the language preference and the FAQs relevant to the user's query.
         """
         # Dynamically fetch relevant FAQs based on the user's query
-        relevant_faqs = FaqRepository.search_faqs(user_query)
-        faq_knowledge_for_ai = ""
+        relevant_faqs = FaqRepository.search_faqs(user_query) # Repeat keyword sets are served from the repository's search cache
         if relevant_faqs:
-            faq_knowledge_for_ai = "# Relevant Bookswagon FAQ Information:\n"
-            for faq in relevant_faqs:
-                faq_knowledge_for_ai += f"- Question: {faq.get('question', 'N/A')}\n  Answer: {faq.get('answer', 'N/A')}\n\n"
+            faq_knowledge_for_ai = faq_knowledge_for(relevant_faqs)
         else:
             faq_knowledge_for_ai = "No specific FAQ entries were found directly matching your query. I'll answer based on general Bookswagon knowledge."
 
 
-        system_prompt = f"""
-        You are Vidya, a versatile and knowledgeable bookstore assistant.
-        Your primary goal is to answer general inquiries about Bookswagon services, policies, and information based ONLY on the provided FAQ information and the ongoing chat history. You should also guide users if they are asking about an order by asking for their order number.
-
+        return f"""
         Current User Language Preference: {"Hindi/Hinglish" if is_hindi else "English"}. Respond naturally in this language.
+        Write the whole reply directly in this language. Keep order numbers, dates, tracking numbers and product names exactly as given.
 
         === RELEVANT FAQ INFORMATION (Based on current query) ===
         {faq_knowledge_for_ai}
         === END OF RELEVANT FAQ INFORMATION ===
+        """
 
-        === CHAT HISTORY (Recent messages) ===
-        [The chat history will be injected here by the system]
-        === END OF CHAT HISTORY ===
-
-        Your Task:
-        1.  Carefully analyze the USER'S CURRENT QUERY in the context of the CHAT HISTORY.
-        2.  Use the RELEVANT FAQ INFORMATION to answer the user's question directly and accurately.
-        3.  If the user's query is about an order (e.g., "my order", "status", "delivery"), but they haven't provided an order number, politely ask for the order number (e.g., "Could you please provide your order number so I can assist you?"). Mention that order numbers typically start with 'BW'.
-        4.  Maintain a warm, empathetic, and professional tone. Be concise but thorough.
-        5.  DO NOT invent or assume any information not present in the provided FAQs. If you don't know, say so politely and suggest contacting customer care.
-        6.  DO NOT offer book recommendations; direct users asking for book suggestions to the book recommendation feature if possible, or simply state that you are here for customer service queries.
-        7.  Always conclude by asking if there's anything else you can help with.
-        8.  If the user's query is completely unrelated to Bookswagon services after reviewing all provided context, politely state that you are here to help with Bookswagon-related customer service queries.
-        9.  You cannot escalate things yourself, but you can guide the user on how to contact customer care for urgent issues.
-        10. Give tracking details of individual items if available no matter the complete order is shipped or not, fetching from the database column tracking_url, else tell them to visit the Bookswagon website with their tracking number, do not give bookswagon link.
-        11. Do not tell the return policy if the user is not asking for it, but if they are asking for it, tell them the standard 7-day return policy from the delivery date. If the 7-day window has passed for a specific book, clearly state that it's no longer eligible for a standard return.
-        12. Do NOT use any emojis in your response.
-        13. Do not write anything like, " According to the FAQ, I can say that..." or "Based on the FAQ, I can tell you that...".
-        14. Do not mention about damaged and return books until and unless customer asks for it. And Return policy is strictly of 7 days, do not mention any exceptions and direct the request to customer care.
-        15. Always prioritize customer care email over customer care phone number. If user asks for customer care phone number then only give it
-        16. If the user asks a personal or conversational question (e.g., "how are you?", "what are you doing?"), you MUST respond with a short, creative, in-character "persona" response as Vidya, the bookstore assistant. Your response must be warm and clever, and it must always pivot back to the topic of books or helping the user. Be diverse and do not use the same response every time.
+    @staticmethod
+    def generate_general_response(user_query, is_hindi, chat_history_api_format):
+        """
+        Generate AI response for general inquiries using relevant FAQs and chat history.
         """
+        system_prompt = AIService.build_general_system_prompt(user_query, is_hindi)
+
         # Prepare messages for the API, including chat history
         messages_for_api = [
             {"role": "system", "content": system_prompt},
-            *chat_history_api_format[-AIService.CHAT_HISTORY_LIMIT:], # Include recent chat history
+            *AIService.trim_history(chat_history_api_format), # Include recent chat history
             {"role": "user", "content": user_query}
         ]
 
-        ai_response_content = AIService.query_deepseek(messages_for_api, temperature=0.7)
+        ai_response_content = AIService.query_deepseek(messages_for_api, temperature=0.7, max_tokens=AIService.GENERAL_REPLY_MAX_TOKENS)
 
         final_response = AIService.get_response_in_language(ai_response_content, is_hindi)
 
         return final_response
+
+    @staticmethod
+    def stream_general_response(user_query, is_hindi, chat_history_api_format):
+        """
+        Streaming variant of generate_general_response that yields the reply in chunks as DeepSeek writes it.
+        The prompt already asks for the user's language, so there is no translation pass; markdown is stripped per chunk.
+        """
+        system_prompt = AIService.build_general_system_prompt(user_query, is_hindi)
+
+        messages_for_api = [
+            {"role": "system", "content": system_prompt},
+            *AIService.trim_history(chat_history_api_format), # Include recent chat history
+            {"role": "user", "content": user_query}
+        ]
+
+        for chunk in AIService.stream_deepseek(messages_for_api, temperature=0.7, max_tokens=AIService.GENERAL_REPLY_MAX_TOKENS):
+            chunk = AIService.MARKDOWN_PATTERN.sub('', chunk)
+            if chunk:
+                yield chunk
  
 
 
 class FormatterService:
     """Service for formatting order data and responses for display"""
 
+    # Standalone numbers in a comma/space separated list, e.g. "1, 3" or "2 4" (not the digits inside "BW123")
+    BOOK_NUMBER_PATTERN = re.compile(r'(?<![^,\s])\d+(?![^,\s])')
+    # Payment status descriptions without symbols
+    PAYMENT_STATUS_MEANINGS = {
+        "Cre Pending": "Refund is in process or awaiting confirmation to be credited.",
+        "Credit": "Refund successfully credited.",
+        "Pending": "Payment is still being processed or awaiting confirmation.",
+        "Processed": "Payment has been successfully completed.",
+        "Void": "Transaction was cancelled before completion; no funds were moved."
+    }
+    PAYMENT_STATUS_UNDEFINED = "Status not clearly defined. Please check your account for details."
+
     @staticmethod
     def format_order_response(order):
         """
@@ -475,101 +898,77 @@ class FormatterService:
         order_data = order.to_dict()
         order_details = order_data.get('order_details', {})
         books = order_data.get('books', [])
-        book_details_list = []
-        # Payment status descriptions without symbols
-        payment_status_meanings = {
-            "Cre Pending": "Refund is in process or awaiting confirmation to be credited.",
-            "Credit": "Refund successfully credited.",
-            "Pending": "Payment is still being processed or awaiting confirmation.",
-            "Processed": "Payment has been successfully completed.",
-            "Void": "Transaction was cancelled before completion; no funds were moved."
-        }
-        payment_status = order_details.get('payment_status', 'N/A')
-        payment_status_meaning = payment_status_meanings.get(payment_status, "Status not clearly defined. Please check your account for details.")
+        detail = order_details.get # Bound once; every order-level field below is read through it
+        payment_status = detail('payment_status', 'N/A')
+        payment_status_meaning = FormatterService.PAYMENT_STATUS_MEANINGS.get(payment_status, FormatterService.PAYMENT_STATUS_UNDEFINED)
 
         # Building the formatted response string without markdown
         response_parts = [
-            f"Order Details for {order_details.get('order_number', 'N/A')}",
-            f"Customer: {str(order_details.get('customer_name', 'N/A')).strip().title()}",
-            f"Purchase Date: {order_details.get('purchase_date', 'N/A')}",
-            f"Overall Order Status: {order_details.get('order_status', 'N/A')}", # Clarified as Overall
+            f"Order Details for {detail('order_number', 'N/A')}",
+            f"Customer: {str(detail('customer_name', 'N/A')).strip().title()}",
+            f"Purchase Date: {detail('purchase_date', 'N/A')}",
+            f"Overall Order Status: {detail('order_status', 'N/A')}", # Clarified as Overall
             f"Payment Status: {payment_status} - {payment_status_meaning}",
-            f"Total Amount: {order_details.get('order_amount', 'N/A')}"
+            f"Total Amount: {detail('order_amount', 'N/A')}"
         ]
 
-        # Shipping address on a single line
-        address_parts = []
-        for field in ['shipping_address', 'shipping_city', 'shipping_state', 'shipping_zip', 'shipping_country']:
-            value = str(order_details.get(field, '')).strip()
-            if value and value.lower() != 'n/a':
-                address_parts.append(value.title())
-
-        if address_parts:
-            response_parts.append(f"Shipping Address: {', '.join(address_parts)}")
+        # Shipping address on a single line; dropped fields are never title-cased
+        address_values = (str(detail(field, '')).strip() for field in AIService.SHIPPING_ADDRESS_FIELDS)
+        shipping_address = ', '.join(value for value in address_values if value and value not in NOT_AVAILABLE_VALUES)
+        if shipping_address:
+            response_parts.append(f"Shipping Address: {shipping_address.title()}")
 
         # Contact info if available
-        mobile = str(order_details.get('shipping_mobile', '')).strip()
-        if mobile and mobile.lower() != 'n/a':
+        mobile = str(detail('shipping_mobile', '')).strip()
+        if mobile and mobile not in NOT_AVAILABLE_VALUES:
             response_parts.append(f"Contact: {mobile}")
 
 
         # Individual Book Details with Delivery Info
         response_parts.append("Books Ordered:")
         if books:
-            for i, book in enumerate(books, 1):
-                book_info_lines = [
-                    # --- Display 1-based index for the book ---
-                    f"{i}. {book.get('product_name', 'N/A')}"
-                ]
-
-                book_tracking_number = book.get('tracking_number') # Get book-specific tracking
-                order_tracking_url = order_details.get('tracking_url') # Get order-level tracking URL
+            order_tracking_url = detail('tracking_url') # Get order-level tracking URL
+            current_date = datetime.now() # One reference time for every book's return window
+            add_line = response_parts.append # Book lines go straight into the response, bound once for the loop
+            # order.books and the to_dict books are in the same order; the model keeps the unformatted delivery date
+            for i, (book, order_book) in enumerate(zip(books, order.books), 1):
+                book_field = book.get # Bound once per book
+                add_line("") # Each book follows a blank line; everything is joined once at the end
+                # --- Display 1-based index for the book ---
+                add_line(f"{i}. {book_field('product_name', 'N/A')}")
+
+                book_tracking_number = book_field('tracking_number') # Get book-specific tracking
 
                 if book_tracking_number and book_tracking_number != 'N/A':
-                     book_info_lines.append(f"   Tracking Number: {book_tracking_number}")
+                     add_line(f"   Tracking Number: {book_tracking_number}")
                      if order_tracking_url and order_tracking_url != 'N/A':
-                          book_info_lines.append(f"   Tracking URL: {order_tracking_url}")
+                          add_line(f"   Tracking URL: {order_tracking_url}")
                      else:
-                          book_info_lines.append(f"   Please visit the Bookswagon website to track this book using the tracking number.")
+                          add_line(f"   Please visit the Bookswagon website to track this book using the tracking number.")
 
 
                 # Conditional display of delivery information for the specific book
-                book_delivery_date_str = book.get('delivery_date')
-                book_expected_delivery_duration = book.get('expected_delivery_duration')
-                book_delivery_status = book.get('delivery_status')
+                book_delivery_date_str = book_field('delivery_date')
+                book_expected_delivery_duration = book_field('expected_delivery_duration')
+                book_delivery_status = book_field('delivery_status')
 
 
                 if book_delivery_date_str and book_delivery_date_str != 'N/A':
-                     book_info_lines.append(f"   Delivery Status: {book_delivery_status or 'N/A'}")
-                     book_info_lines.append(f"   Delivery Date: {book_delivery_date_str}")
+                     add_line(f"   Delivery Status: {book_delivery_status or 'N/A'}")
+                     add_line(f"   Delivery Date: {book_delivery_date_str}")
 
                      # Check for return eligibility based on 7-day window
-                     try:
-                         delivery_date = datetime.strptime(book_delivery_date_str, "%Y-%m-%d")
-                         current_date = datetime.now()
-                         return_window_end = delivery_date + timedelta(days=7)
-
-                         if current_date > return_window_end:
-                             book_info_lines.append("   Return Status: Not eligible for standard return (7-day window passed).")
-                         else:
-                             days_left = (return_window_end - current_date).days
-                             book_info_lines.append(f"   Return Status: Eligible for return. You have {days_left} days left to return.")
-
-                     except ValueError:
-                         book_info_lines.append("   Return status could not be determined due to invalid delivery date.")
+                     add_line(return_status_line(order_book.delivery_date, current_date, "   "))
 
 
                 elif book_expected_delivery_duration and book_expected_delivery_duration != 'N/A':
-                     book_info_lines.append(f"   Expected Delivery Duration: {book_expected_delivery_duration}")
+                     add_line(f"   Expected Delivery Duration: {book_expected_delivery_duration}")
                 # No specific fallback for individual books if both are missing
 
-
-                book_details_list.append("\n".join(book_info_lines))
-
-        if book_details_list:
-             return "\n".join(response_parts) + "\n\n" + "\n\n".join(book_details_list)
         else:
-             return "\n".join(response_parts) + "\n\nNo books listed for this order."
+            response_parts.extend(("", "No books listed for this order."))
+
+        return "\n".join(response_parts)
 
 
     @staticmethod
@@ -580,27 +979,15 @@ class FormatterService:
         """
         if not isinstance(user_input, str): # Basic type check
             return []
+        return FormatterService.book_indices_from_numbers(FormatterService.BOOK_NUMBER_PATTERN.findall(user_input), total_books)
 
-        # Replace commas and multiple spaces with a single space for easier splitting
-        cleaned_input = re.sub(r',', ' ', user_input)
-        cleaned_input = re.sub(r'\s+', ' ', cleaned_input).strip()
-
-        parts = cleaned_input.split(' ')
-        indices = []
-        for part in parts:
-            if not part.isdigit(): # Skip non-numeric parts
-                continue
-            try:
-                # Convert to 0-based index
-                idx = int(part) - 1
-                if 0 <= idx < total_books: # Check if index is valid
-                    if idx not in indices: # Avoid duplicate indices
-                        indices.append(idx)
-            except ValueError:
-                # Handles cases where part might be empty string after split or other non-int
-                continue
-
-        return sorted(indices) # Return sorted unique indices
+    @staticmethod
+    def book_indices_from_numbers(numbers, total_books):
+        """
+        Convert 1-based book numbers (digit strings from BOOK_NUMBER_PATTERN) to sorted, unique,
+        0-based indices that fall within the order's books.
+        """
+        return sorted({number - 1 for number in map(int, numbers) if 0 < number <= total_books})
 
     @staticmethod
     def format_specific_books_response(order, indices):
@@ -611,65 +998,52 @@ class FormatterService:
         if not order or not hasattr(order, 'books') or not order.books or not indices:
             return "Could not find details for the requested books, or the order/book list is empty."
 
-        book_details_list = []
+        detail_lines = [] # Lines of every requested book, separated by blank lines and joined once at the end
         order_number = order.order_number if hasattr(order, 'order_number') else 'N/A'
-        order_details = order.to_dict().get('order_details', {})
-        order_tracking_url = order_details.get('tracking_url', 'N/A') # Get order-level tracking URL here
-
+        # Check index validity once, based on the 0-based list; the order dict isn't needed if nothing is left
+        book_count = len(order.books)
+        indices = [i for i in indices if 0 <= i < book_count]
+        if not indices:
+            return f"Could not find valid details for the specified book numbers in order {order_number}."
+        # Fields are read straight off the models; only the requested books are touched, with no order.to_dict()
+        order_tracking_url = order.tracking_url # Get order-level tracking URL here
+
+        current_date = datetime.now() # One reference time for every book's return window
+        add_line = detail_lines.append # Bound once for the loop
         # Assuming books in order.books are already in the correct order from the query
-        for i in indices:
-             # Check index validity based on 0-based list but display 1-based
-            if 0 <= i < len(order.books):
-                book = order.books[i] # Access book by 0-based index
-                book_info_lines = [
-                    # --- Display 1-based index for the book ---
-                    f"Details for Book {i + 1} in Order {order_number}:",
-                    f"- Product: {book.product_name or 'Unknown Product'}"
-                ]
+        for i in indices: # Display 1-based
+            book = order.books[i] # Access book by 0-based index
+            if detail_lines:
+                add_line("") # Separate details for each book with double newline
+            # --- Display 1-based index for the book ---
+            add_line(f"Details for Book {i + 1} in Order {order_number}:")
+            add_line(f"- Product: {book.product_name or 'Unknown Product'}")
 
-                book_tracking_number = book.get('tracking_number') # Get book-specific tracking
-                if book_tracking_number and book_tracking_number != 'N/A':
-                     book_info_lines.append(f"- Tracking Number: {book_tracking_number}")
-                     if order_tracking_url and order_tracking_url != 'N/A':
-                          book_info_lines.append(f"- Tracking URL: {order_tracking_url}")
-                     else:
-                          book_info_lines.append(f"- Please visit the Bookswagon website to track this book using the tracking number.")
-
-
-                # Conditional display of delivery information for the specific book
-                book_delivery_date_str = book.get('delivery_date')
-                book_expected_delivery_duration = book.get('expected_delivery_duration')
-                book_delivery_status = book.get('delivery_status')
+            book_tracking_number = book.tracking_number # Get book-specific tracking
+            if book_tracking_number and book_tracking_number != 'N/A':
+                 add_line(f"- Tracking Number: {book_tracking_number}")
+                 if order_tracking_url and order_tracking_url != 'N/A':
+                      add_line(f"- Tracking URL: {order_tracking_url}")
+                 else:
+                      add_line(f"- Please visit the Bookswagon website to track this book using the tracking number.")
 
 
-                if book_delivery_date_str and book_delivery_date_str != 'N/A':
-                     book_info_lines.append(f"- Delivery Status: {book_delivery_status or 'N/A'}")
-                     book_info_lines.append(f"- Delivery Date: {book_delivery_date_str}")
+            # Conditional display of delivery information for the specific book
+            book_delivery_date_str = format_date(book.delivery_date) # DD/MM/YYYY, or 'N/A' when missing
+            book_expected_delivery_duration = book.expected_delivery_duration
+            book_delivery_status = book.delivery_status
 
-                     # Check for return eligibility based on 7-day window
-                     try:
-                         delivery_date = datetime.strptime(book_delivery_date_str, "%Y-%m-%d")
-                         current_date = datetime.now()
-                         return_window_end = delivery_date + timedelta(days=7)
 
-                         if current_date > return_window_end:
-                             book_info_lines.append("- Return Status: Not eligible for standard return (7day window passed).")
-                         else:
-                             days_left = (return_window_end - current_date).days
-                             book_info_lines.append(f"- Return Status: Eligible for return. You have {days_left} days left to return.")
+            if book_delivery_date_str and book_delivery_date_str != 'N/A':
+                 add_line(f"- Delivery Status: {book_delivery_status or 'N/A'}")
+                 add_line(f"- Delivery Date: {book_delivery_date_str}")
 
-                     except ValueError:
-                         book_info_lines.append("- Return status could not be determined due to invalid delivery date.")
+                 # Check for return eligibility based on 7-day window
+                 add_line(return_status_line(book.delivery_date, current_date, "- "))
 
 
-                elif book_expected_delivery_duration and book_expected_delivery_duration != 'N/A':
-                     book_info_lines.append(f"- Expected Delivery Duration: {book_expected_delivery_duration}")
-                # No specific fallback for individual books if both are missing
+            elif book_expected_delivery_duration and book_expected_delivery_duration != 'N/A':
+                 add_line(f"- Expected Delivery Duration: {book_expected_delivery_duration}")
+            # No specific fallback for individual books if both are missing
 
-
-                book_details_list.append("\n".join(book_info_lines))
-
-        if book_details_list:
-             return "\n\n".join(book_details_list) # Separate details for each book with double newline
-        else:
-             return f"Could not find valid details for the specified book numbers in order {order_number}."
\ No newline at end of file
+        return "\n".join(detail_lines) # Every remaining index produced lines
\ No newline at end of file
@@ -1,40 +1,67 @@
 import re
  
+# Compiled once at import; clean_sql runs on every uncached recommendation query
+SELECT_STATEMENT_PATTERN = re.compile(r'SELECT\s+.*?;', re.DOTALL | re.IGNORECASE)
+CODE_FENCE_PATTERN = re.compile(r'```sql|```')
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# A LIKE '%...%' condition (column, pattern) or a whitespace run, so clean_sql fixes both in one scan
+CLEANUP_PATTERN = re.compile(r'(\w+)\s+LIKE\s+\'%([^\']+?)%\'|\s+')
+# parameterize_sql's tokens: string literals, the keywords that open or close a WHERE clause or an IN list,
+# and the comparison operators and punctuation a bindable literal can follow. Everything else is skipped.
+SQL_TOKEN_PATTERN = re.compile(
+    r"(?P<literal>(?:\bN)?'(?:[^']|'')*')"
+    r"|(?P<keyword>\b(?:WHERE|ORDER\s+BY|GROUP\s+BY|HAVING|LIKE|IN)\b)"
+    r"|(?P<symbol><>|!=|=|[(),])",
+    re.IGNORECASE
+)
+WHERE_CLAUSE_END_KEYWORDS = frozenset(('ORDER BY', 'GROUP BY', 'HAVING'))
+COMPARISON_TOKENS = frozenset(('LIKE', '=', '<>', '!='))
+ 
 def extract_sql_query(text):
+    # Fast path: a bare statement with at most a trailing semicolon is what the regex search would return anyway
+    stripped = text.strip()
+    semicolon = stripped.find(';')
+    if (stripped[:6].upper() == 'SELECT' and stripped[6:7].isspace() and '```' not in stripped
+            and semicolon in (-1, len(stripped) - 1)):
+        return stripped
+
     # Try to extract just the SQL statement
-    sql_match = re.search(r'SELECT\s+.*?;', text, re.DOTALL | re.IGNORECASE)
+    sql_match = SELECT_STATEMENT_PATTERN.search(text)
     if sql_match:
         return sql_match.group(0)
    
     # If no SQL found, remove any markdown code blocks
-    cleaned = re.sub(r'```sql|```', '', text).strip()
+    cleaned = CODE_FENCE_PATTERN.sub('', text).strip()
     return cleaned
  
+# --- Fix LIKE patterns with multiple wildcards (CLEANUP_PATTERN callback; module level so clean_sql doesn't rebuild it per call)
+def fix_like_pattern(match):
+    column, pattern = match.groups()
+    if column is None: # Whitespace run
+        return " "
+    pattern = WHITESPACE_PATTERN.sub(" ", pattern) # Whitespace inside the LIKE match isn't visited separately
+
+    # If there are multiple terms separated by %
+    if '%' in pattern:
+        terms = list(filter(None, pattern.split('%')))
+        if len(terms) > 1:
+            conditions = [f"{column} LIKE '%{term}%'" for term in terms]
+            return '(' + ' AND '.join(conditions) + ')'
+
+    # If no internal %, return as is
+    return f"{column} LIKE '%{pattern}%'"
+
 # --- Clean SQL to avoid % errors, quotes etc.
 def clean_sql(sql_text):
     # First extract the actual SQL query
     sql_text = extract_sql_query(sql_text)
    
-    # Clean up whitespace
-    sql_text = re.sub(r"\s+", " ", sql_text).strip()
- 
-    # Fix LIKE patterns with multiple wildcards
-    def fix_like_pattern(match):
-        column = match.group(1)
-        pattern = match.group(2)
-       
-        # If there are multiple terms separated by %
-        if '%' in pattern:
-            terms = [t for t in pattern.split('%') if t]
-            if len(terms) > 1:
-                conditions = [f"{column} LIKE '%{term}%'" for term in terms]
-                return '(' + ' AND '.join(conditions) + ')'
-       
-        # If no internal %, return as is
-        return f"{column} LIKE '%{pattern}%'"
-   
-    # Apply the pattern fix
-    sql_text = re.sub(r'(\w+)\s+LIKE\s+\'%([^\']+?)%\'', fix_like_pattern, sql_text)
+    # Clean up whitespace and fix LIKE patterns in a single pass. Without a '%' there is no LIKE '%...%'
+    # to fix, so the plain substitution collapses whitespace without calling back into Python per run.
+    if '%' in sql_text:
+        sql_text = CLEANUP_PATTERN.sub(fix_like_pattern, sql_text).strip()
+    else:
+        sql_text = WHITESPACE_PATTERN.sub(" ", sql_text).strip()
    
     # Fix unbalanced quotes
     if sql_text.count("'") % 2 != 0:
@@ -47,4 +74,47 @@ def clean_sql(sql_text):
         sql_text += ";"
    
     return sql_text
- 
\ No newline at end of file
+
+# --- Bind search-term literals as parameters
+def parameterize_sql(sql_text):
+    """
+    Replaces the string literals that are search terms in a cleaned query with ? placeholders and returns
+    (template, params, national), where national[i] is True when params[i] came from an N'...' literal.
+    Only operands of LIKE, =, <>, != and IN (...) inside a WHERE clause are bound; column aliases
+    (AS 'Title') and other literals stay inline, since a placeholder there is invalid SQL. Queries that
+    differ only in their search terms then share one SQL Server plan.
+    """
+    parts = []
+    params = []
+    national = []
+    position = 0
+    in_where = False
+    in_list = False # Directly inside the parentheses of an IN (...) list of literals
+    previous = None # Previous token, uppercased; identifiers and numbers are not tokens
+
+    for match in SQL_TOKEN_PATTERN.finditer(sql_text):
+        literal = match.group('literal')
+        if literal is None:
+            token = ' '.join(match.group().upper().split())
+            if token == 'WHERE':
+                in_where = True
+            elif token in WHERE_CLAUSE_END_KEYWORDS:
+                in_where = False
+            if token == '(':
+                in_list = previous == 'IN'
+            elif token != ',':
+                in_list = False
+            previous = token
+            continue
+
+        if in_where and (previous in COMPARISON_TOKENS or (in_list and previous in ('(', ','))):
+            parts.append(sql_text[position:match.start()])
+            parts.append('?')
+            position = match.end()
+            is_national = literal[0] in 'Nn'
+            params.append(literal[2 if is_national else 1:-1].replace("''", "'"))
+            national.append(is_national)
+        previous = 'literal'
+
+    parts.append(sql_text[position:])
+    return ''.join(parts), tuple(params), tuple(national)
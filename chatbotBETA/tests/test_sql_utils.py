@@ -0,0 +1,46 @@
+# tests/test_sql_utils.py
+# Run from chatbotBETA/: python -m unittest discover -s tests -t .
+
+import unittest
+
+from sql_utils import clean_sql, parameterize_sql
+
+
+class ParameterizeSqlTest(unittest.TestCase):
+    """parameterize_sql binds search terms only and keeps the rest of the query valid"""
+
+    def test_alias_literals_stay_inline(self):
+        sql = ("SELECT TOP 20 Product_Title AS 'Title', AuthorName1 AS 'Author' FROM Table_ProductSearchNewSearch "
+               "WHERE Product_Title LIKE '%harry%' AND Language = N'Hindi' ORDER BY Ranking ASC;")
+        template, params, national = parameterize_sql(sql)
+        self.assertEqual(
+            template,
+            "SELECT TOP 20 Product_Title AS 'Title', AuthorName1 AS 'Author' FROM Table_ProductSearchNewSearch "
+            "WHERE Product_Title LIKE ? AND Language = ? ORDER BY Ranking ASC;"
+        )
+        self.assertEqual(params, ('%harry%', 'Hindi'))
+        self.assertEqual(national, (False, True))
+
+    def test_in_list_and_escaped_quotes(self):
+        template, params, national = parameterize_sql("SELECT a FROM t WHERE c IN ('x', N'y''s') AND d <> 'z';")
+        self.assertEqual(template, "SELECT a FROM t WHERE c IN (?, ?) AND d <> ?;")
+        self.assertEqual(params, ('x', "y's", 'z'))
+        self.assertEqual(national, (False, True, False))
+
+    def test_literals_outside_where_stay_inline(self):
+        sql = "SELECT 'x' AS Kind FROM t ORDER BY CASE WHEN a = 'b' THEN 0 ELSE 1 END;"
+        self.assertEqual(parameterize_sql(sql), (sql, (), ()))
+
+    def test_function_arguments_stay_inline(self):
+        template, params, _ = parameterize_sql("SELECT a FROM t WHERE d = UPPER('z') AND e LIKE '%q%';")
+        self.assertEqual(template, "SELECT a FROM t WHERE d = UPPER('z') AND e LIKE ?;")
+        self.assertEqual(params, ('%q%',))
+
+    def test_split_like_terms_are_bound(self):
+        template, params, _ = parameterize_sql(clean_sql("SELECT a FROM t WHERE title LIKE '%harry%potter%';"))
+        self.assertEqual(template, "SELECT a FROM t WHERE (title LIKE ? AND title LIKE ?);")
+        self.assertEqual(params, ('%harry%', '%potter%'))
+
+
+if __name__ == '__main__':
+    unittest.main()